@@ -0,0 +1,213 @@
+import functools
+import json
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+import botocore
+
+from aws import AssumedRole, configure_clients, use_credentials
+from batch import DEFAULT_WORKERS, BatchSummary, DomainResult, run_batch
+from exceptions import CerbyException
+from metrics import MetricsState, metrics
+from models import HostedZoneRecord
+from ratelimit import RateLimitStats, configure_rate_limits, limiter
+
+# Accounts onboarded at once
+DEFAULT_ACCOUNT_WORKERS = 4
+
+
+@dataclass
+class AccountEntry:
+    role_arn: str
+    domains: List[str] = field(default_factory=list)
+    external_id: Optional[str] = None
+
+    @property
+    def account(self) -> str:
+        """The account ID of the role ARN, arn:aws:iam::<account>:role/<name>"""
+        return self.role_arn.split(":")[4]
+
+    @property
+    def role(self) -> AssumedRole:
+        """The CerbyRole of the account, every client of the account uses it"""
+        return AssumedRole(self.role_arn, self.external_id)
+
+
+@dataclass
+class AccountResult:
+    entry: AccountEntry
+    summary: Optional[BatchSummary] = None
+    error: Optional[str] = None
+    elapsed: float = 0.0
+    # Only filled on worker processes, which can not report domain results and
+    # record their metrics and rate limit stats apart from the parent's
+    records_pending_to_create: List[HostedZoneRecord] = field(default_factory=list)
+    metrics: Optional[MetricsState] = None
+    rate_limit_stats: Dict[str, RateLimitStats] = field(default_factory=dict)
+
+    @property
+    def succeeded(self) -> bool:
+        return (
+            self.error is None
+            and not self.summary.failed
+            and not self.summary.failed_changes
+        )
+
+
+def read_manifest(path: str) -> List[AccountEntry]:
+    """Read the accounts to onboard
+
+    The manifest is a JSON list with the CerbyRole of each account, the
+    ExternalId its trust policy requires, and the domains to configure:
+
+        [{"role_arn": "arn:aws:iam::111111111111:role/CerbyRole",
+          "external_id": "...", "domains": ["foo.com"]}]
+
+    Args:
+        path (str): The manifest file
+
+    Returns:
+        List[AccountEntry]: One entry per account
+    """
+    with open(path) as manifest_file:
+        document = json.load(manifest_file)
+    entries = []
+    for item in document:
+        entry = AccountEntry(
+            role_arn=item["role_arn"],
+            external_id=item.get("external_id"),
+            domains=[domain.strip().rstrip(".").lower() for domain in item["domains"]],
+        )
+        entries.append(entry)
+    return entries
+
+
+def onboard_account(
+    entry: AccountEntry,
+    workers: int = DEFAULT_WORKERS,
+    on_result: Optional[Callable[[AccountEntry, DomainResult], None]] = None,
+) -> AccountResult:
+    """Configure the domains of an account with its assumed role
+
+    Every client created for the batch uses the role's credentials, and the
+    account gets its own rate limit buckets.
+
+    Args:
+        entry (AccountEntry): The account and its domains
+        workers (int): Domains of the account configured at once
+        on_result (Callable, optional): Called with the entry and each domain
+            result as it completes
+
+    Returns:
+        AccountResult: The batch summary, or the error that stopped it
+    """
+    result = AccountResult(entry=entry)
+    start = time.perf_counter()
+    try:
+        with use_credentials(entry.role):
+            result.summary = run_batch(
+                entry.domains,
+                workers=workers,
+                on_result=(lambda domain: on_result(entry, domain))
+                if on_result
+                else None,
+            )
+    except botocore.exceptions.ClientError as error:
+        result.error = error.response["Error"]["Message"]
+    except (botocore.exceptions.BotoCoreError, CerbyException) as error:
+        result.error = str(error)
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def onboard_account_process(entry: AccountEntry, workers: int) -> AccountResult:
+    """onboard_account on a worker process
+
+    The domain results can not be reported to the parent as they complete, so
+    the records to add by hand come back with the result of the account, and
+    so do the metrics and rate limit stats the worker recorded for it. A
+    worker onboards one account at a time, everything recorded since its
+    previous account belongs to this one.
+
+    Args:
+        entry (AccountEntry): The account and its domains
+        workers (int): Domains of the account configured at once
+
+    Returns:
+        AccountResult: The batch summary, the records to add by hand, the
+            metrics and the rate limit stats
+    """
+    records: List[HostedZoneRecord] = []
+    result = onboard_account(
+        entry,
+        workers,
+        lambda entry, domain: records.extend(domain.records_pending_to_create),
+    )
+    result.records_pending_to_create = records
+    result.metrics = metrics.take()
+    result.rate_limit_stats = limiter.take_stats()
+    return result
+
+
+def configure_worker(rates: Dict[str, float], max_pool_connections: int):
+    """Set a worker process up like the parent one"""
+    configure_rate_limits(rates)
+    configure_clients(max_pool_connections=max_pool_connections)
+
+
+def run_accounts(
+    entries: List[AccountEntry],
+    account_workers: int = DEFAULT_ACCOUNT_WORKERS,
+    workers: int = DEFAULT_WORKERS,
+    on_result: Optional[Callable[[AccountEntry, DomainResult], None]] = None,
+    processes: bool = False,
+    rates: Optional[Dict[str, float]] = None,
+) -> List[AccountResult]:
+    """Onboard many accounts at once
+
+    Each account runs a batch with its own credentials and rate limits, on a
+    thread pool or, with processes, on a pool of worker processes so the
+    accounts do not share the GIL. Domain results are only reported as they
+    complete on threads, worker processes return the totals of the account,
+    its failed domains and its records to add by hand. Their metrics and rate
+    limit stats are added to the ones of this process.
+
+    Args:
+        entries (List[AccountEntry]): The accounts to onboard
+        account_workers (int): Accounts onboarded at once
+        workers (int): Domains of each account configured at once
+        on_result (Callable, optional): Called with each domain result, on
+            threads only
+        processes (bool): Run the accounts on worker processes
+        rates (Dict[str, float], optional): Requests per second by service of
+            each account, set in the worker processes
+
+    Returns:
+        List[AccountResult]: One result per account, in manifest order
+    """
+    executor: Executor
+    onboard: Callable[[AccountEntry], AccountResult]
+    if processes:
+        executor = ProcessPoolExecutor(
+            max_workers=account_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=configure_worker,
+            initargs=(rates or {}, max(workers * 2, 10)),
+        )
+        onboard = functools.partial(onboard_account_process, workers=workers)
+    else:
+        executor = ThreadPoolExecutor(max_workers=account_workers)
+        onboard = functools.partial(
+            onboard_account, workers=workers, on_result=on_result
+        )
+    with executor:
+        futures = [executor.submit(onboard, entry) for entry in entries]
+        results = [future.result() for future in futures]
+    for result in results:
+        if result.metrics:
+            metrics.merge(result.metrics)
+        limiter.merge_stats(result.rate_limit_stats)
+    return results
@@ -1,18 +1,232 @@
+import contextvars
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from typing import Dict, Iterator, Optional, Tuple, Union
+
+import botocore.session
 from boto3.session import Session
+from botocore.config import Config
+from botocore.credentials import RefreshableCredentials
+
+from exceptions import ConfigurationException
+from metrics import metrics
+from ratelimit import limiter
 
 AVAILABLE_REGIONS = ["us-east-1", "us-west-2", "eu-west-1", "ca-central-1"]
 
+# Services whose endpoints are not regional, clients are shared across regions.
+GLOBAL_SERVICES = ["route53"]
+
+
+@dataclass(frozen=True)
+class ClientSettings:
+    max_pool_connections: int = 50
+    retry_mode: str = "standard"
+    max_attempts: int = 5
+    connect_timeout: float = 10
+    read_timeout: float = 60
+
+    def as_config(self) -> Config:
+        return Config(
+            max_pool_connections=self.max_pool_connections,
+            retries={"mode": self.retry_mode, "total_max_attempts": self.max_attempts},
+            connect_timeout=self.connect_timeout,
+            read_timeout=self.read_timeout,
+        )
+
+
+@dataclass(frozen=True)
+class StaticCredentials:
+    access_key_id: str
+    secret_access_key: str
+    session_token: Optional[str] = None
+
+    def create_session(self) -> Session:
+        return Session(
+            aws_access_key_id=self.access_key_id,
+            aws_secret_access_key=self.secret_access_key,
+            aws_session_token=self.session_token,
+        )
+
+
+@dataclass(frozen=True)
+class AssumedRole:
+    """Credentials of a role assumed with the ambient credentials
+
+    The role is assumed once per process, when its session is first needed,
+    and botocore assumes it again shortly before the credentials expire.
+    """
+
+    role_arn: str
+    external_id: Optional[str] = None
+    session_name: str = "cerby-ses"
+    duration_seconds: int = 3600
+
+    def assume(self) -> dict:
+        params = {
+            "RoleArn": self.role_arn,
+            "RoleSessionName": self.session_name,
+            "DurationSeconds": self.duration_seconds,
+        }
+        if self.external_id:
+            params["ExternalId"] = self.external_id
+        credentials = registry.get_client("sts").assume_role(**params)["Credentials"]
+        return {
+            "access_key": credentials["AccessKeyId"],
+            "secret_key": credentials["SecretAccessKey"],
+            "token": credentials["SessionToken"],
+            "expiry_time": credentials["Expiration"].isoformat(),
+        }
+
+    def create_session(self) -> Session:
+        botocore_session = botocore.session.get_session()
+        botocore_session._credentials = RefreshableCredentials.create_from_metadata(
+            metadata=self.assume(),
+            refresh_using=self.assume,
+            method="sts-assume-role",
+        )
+        return Session(botocore_session=botocore_session)
+
+
+Credentials = Union[StaticCredentials, AssumedRole]
+
+# Credentials of the clients created without explicit ones, the ambient
+# credentials when not set. Pools running work for an account copy the
+# context of the caller so their threads use the same credentials.
+current_credentials: contextvars.ContextVar[Optional[Credentials]] = (
+    contextvars.ContextVar("current_credentials", default=None)
+)
+
+
+@contextmanager
+def use_credentials(credentials: Optional[Credentials]) -> Iterator[None]:
+    """Make the clients created inside the block use other credentials
+
+    Args:
+        credentials (Credentials, optional): The credentials, e.g. an
+            AssumedRole, the ambient ones when None
+    """
+    token = current_credentials.set(credentials)
+    try:
+        yield
+    finally:
+        current_credentials.reset(token)
+
+
+class ClientRegistry:
+    """Process-wide cache of boto3 sessions and clients
 
-def get_client(service: str):
+    Clients are keyed by (service, region, credentials) so every repository
+    asking for the same service shares one client, one credential resolution
+    and one connection pool. boto3 clients are thread-safe once created, but
+    creating them is not, so creation is serialized. Every client is attached
+    to the process rate limiter and metrics.
+    """
+
+    def __init__(self, settings: Optional[ClientSettings] = None) -> None:
+        self.settings = settings or ClientSettings()
+        self._lock = threading.RLock()
+        self._sessions: Dict[Optional[Credentials], Session] = {}
+        self._creating: Dict[Optional[Credentials], threading.Lock] = {}
+        self._clients: Dict[Tuple[str, Optional[str], object], object] = {}
+
+    def configure(self, **settings):
+        """Update the client settings, clients built with the old ones are dropped
+
+        Args:
+            **settings: Any ClientSettings field, e.g. max_pool_connections
+        """
+        with self._lock:
+            self.settings = replace(self.settings, **settings)
+            self._clients.clear()
+
+    def reset(self):
+        with self._lock:
+            self._sessions.clear()
+            self._clients.clear()
+
+    def get_session(self, credentials: Optional[Credentials] = None) -> Session:
+        """The session of the credentials, created once
+
+        Creating the session of an AssumedRole calls STS, it is done outside
+        the registry lock so clients of other credentials are not held up,
+        and under a lock of the credentials so the role is assumed once.
+        """
+        with self._lock:
+            session = self._sessions.get(credentials)
+            if session is not None:
+                return session
+            creating = self._creating.setdefault(credentials, threading.Lock())
+        with creating:
+            with self._lock:
+                session = self._sessions.get(credentials)
+            if session is None:
+                session = credentials.create_session() if credentials else Session()
+                with self._lock:
+                    self._sessions[credentials] = session
+            return session
+
+    def get_client(
+        self,
+        service: str,
+        region: Optional[str] = None,
+        credentials: Optional[Credentials] = None,
+    ):
+        session = self.get_session(credentials)
+        with self._lock:
+            if service in GLOBAL_SERVICES:
+                region = None
+            else:
+                region = region or session.region_name
+            key = (service, region, credentials)
+            client = self._clients.get(key)
+            if client is None:
+                client = session.client(
+                    service, region_name=region, config=self.settings.as_config()
+                )
+                # SES quotas are per account and region, Route53 ones per account
+                account = (credentials, region) if region else credentials
+                limiter.attach(client, service, account, self.settings.max_attempts)
+                metrics.attach(client, service)
+                self._clients[key] = client
+            return client
+
+
+registry = ClientRegistry()
+
+
+def configure_clients(**settings):
+    """Configure the pool size, retry mode and timeouts of every AWS client
+
+    Args:
+        **settings: Any ClientSettings field
+    """
+    registry.configure(**settings)
+
+
+def get_client(
+    service: str,
+    region: Optional[str] = None,
+    credentials: Optional[Credentials] = None,
+):
     """Returns an AWS Session Client based on the type argument
 
     Args:
         service (str): The service to use
+        region (str, optional): Region of the client, defaults to the
+            credential's configured Region
+        credentials (Credentials, optional): Credentials to use instead of
+            the ones set by use_credentials or the ambient ones
 
     Returns:
-        client: A valid AWS Session client
+        client: A valid AWS Session client, shared with every other caller
     """
-    return Session().client(service)
+    return registry.get_client(
+        service,
+        region=region,
+        credentials=credentials or current_credentials.get(),
+    )
 
 
 def get_current_region() -> str:
@@ -21,9 +235,27 @@ def get_current_region() -> str:
     Returns:
         str: The credential's configured Region
     """
-    return Session().region_name
+    return registry.get_session().region_name
+
+
+def get_current_account() -> str:
+    """Get the account of the configured credentials
+
+    Returns:
+        str: The AWS account ID
+    """
+    return get_client("sts").get_caller_identity()["Account"]
 
 
-def validate_region():
-    if get_current_region() not in AVAILABLE_REGIONS:
-        raise Exception("Region does not support receiving email")
+def validate_region(region: Optional[str] = None):
+    """Check SES receives email in the region
+
+    Args:
+        region (str, optional): The region to check, the configured one when
+            not given
+    """
+    region = region or get_current_region()
+    if region not in AVAILABLE_REGIONS:
+        raise ConfigurationException(
+            f"Region {region} does not support receiving email"
+        )
@@ -0,0 +1,341 @@
+import functools
+import time
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, TextIO
+
+import botocore
+
+from exceptions import CerbyException
+from metrics import metrics
+from models import ChangeInfo, HostedZoneRecord, ResourceIndex
+from repository import (
+    MAX_IDENTITIES_PER_REQUEST,
+    AWSHostedZoneRecordsRepository,
+    AWSHostedZoneRepository,
+    AWSIdentityRepository,
+)
+from rules import ReceiptRuleManager
+from ses_actions import SESActions
+from utils import chunked, imap_bounded
+
+DEFAULT_WORKERS = 8
+
+# Domains configured before their records and receipt rules are written, and
+# the domains reported and journaled, a run that dies loses at most this many
+FLUSH_EVERY = MAX_IDENTITIES_PER_REQUEST
+
+
+@dataclass
+class DomainResult:
+    domain: str
+    error: Optional[str] = None
+    records_pending_to_create: List[HostedZoneRecord] = field(default_factory=list)
+    rules_failed_to_create: Dict[str, str] = field(default_factory=dict)
+    changes: List[ChangeInfo] = field(default_factory=list)
+    elapsed: float = 0.0
+    converged: bool = False
+    region: Optional[str] = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class BatchSummary:
+    """Totals of a batch, streamed domain results are not kept
+
+    Only the failed domains and the change batches are, so the memory of a
+    batch grows with what needs attention rather than with the number of
+    domains. The records to add by hand are only counted, they go out with
+    the result of their domain. The results of the domains being flushed are
+    held until then, at most FLUSH_EVERY of them.
+    """
+
+    failed: List[DomainResult] = field(default_factory=list)
+    changes: List[ChangeInfo] = field(default_factory=list)
+    elapsed: float = 0.0
+    domains: int = 0
+    converged: int = 0
+    changed: int = 0
+    pending_records: int = 0
+
+    def add(self, result: DomainResult):
+        """Count a reported domain, keeping it only when it failed"""
+        self.domains += 1
+        if not result.succeeded:
+            self.failed.append(result)
+        elif result.converged:
+            self.converged += 1
+        else:
+            self.changed += 1
+        self.pending_records += len(result.records_pending_to_create)
+
+    @property
+    def failed_changes(self) -> List[ChangeInfo]:
+        return [change for change in self.changes if change.error]
+
+
+def read_domains(stream: TextIO) -> Iterator[str]:
+    """Read one domain per line, skipping blanks, comments and duplicates
+
+    Args:
+        stream (TextIO): A file or stdin
+
+    Yields:
+        str: The domains to configure
+    """
+    seen = set()
+    for line in stream:
+        domain = line.split("#", 1)[0].strip().rstrip(".").lower()
+        if domain and domain not in seen:
+            seen.add(domain)
+            yield domain
+
+
+def prefetched(
+    domains: Iterable[str], identity_repo: AWSIdentityRepository
+) -> Iterator[str]:
+    """Prefetch the identity attributes of the domains, 100 at a time
+
+    Args:
+        domains (Iterable[str]): The domains, may be a lazy stream
+        identity_repo (AWSIdentityRepository): Repository to prefetch into
+
+    Yields:
+        str: The same domains, once their attributes are prefetched
+    """
+    for chunk in chunked(domains, MAX_IDENTITIES_PER_REQUEST):
+        with metrics.phase("prefetch"):
+            identity_repo.prefetch(chunk)
+        yield from chunk
+
+
+def configure_domain(
+    domain: str,
+    hzr_repo: Optional[AWSHostedZoneRecordsRepository] = None,
+    identity_repo: Optional[AWSIdentityRepository] = None,
+    hz_repo: Optional[AWSHostedZoneRepository] = None,
+    rule_manager: Optional[ReceiptRuleManager] = None,
+    region: Optional[str] = None,
+    regions: Optional[List[str]] = None,
+    hosted_zone_records: Optional[ResourceIndex] = None,
+) -> DomainResult:
+    """Run the whole SES pipeline for a domain, capturing any error
+
+    Domains whose state already matches the desired one are only read and
+    reported as converged. Records are only staged in hzr_repo and the domain
+    in rule_manager, flushing them is up to the caller.
+
+    Args:
+        domain (str): Domain to configure
+        hzr_repo (AWSHostedZoneRecordsRepository, optional): Repository
+            shared by the batch to coalesce record changes
+        identity_repo (AWSIdentityRepository, optional): Repository shared by
+            the batch, with the identity attributes prefetched
+        hz_repo (AWSHostedZoneRepository, optional): Repository shared by the
+            batch so hosted zones are listed once
+        rule_manager (ReceiptRuleManager, optional): Receipt rules shared by
+            the batch so every domain is added in a few rule updates
+        region (str, optional): Region to configure, the configured one when
+            not given
+        regions (List[str], optional): Every region the domain is set up in
+        hosted_zone_records (ResourceIndex, optional): Records of the domain
+            already read for another region
+
+    Returns:
+        DomainResult: The outcome of the pipeline
+    """
+    result = DomainResult(domain=domain, region=region)
+    start = time.perf_counter()
+    ses_actions = None
+    with metrics.phase("domain", domain):
+        try:
+            ses_actions = SESActions(
+                domain=domain,
+                hzr_repo=hzr_repo,
+                identity_repo=identity_repo,
+                hz_repo=hz_repo,
+                rule_manager=rule_manager,
+                region=region,
+                regions=regions,
+                hosted_zone_records=hosted_zone_records,
+            )
+            result.converged = ses_actions.is_converged()
+            if not result.converged:
+                ses_actions.configure()
+        except botocore.exceptions.ClientError as error:
+            result.error = error.response["Error"]["Message"]
+        except (botocore.exceptions.BotoCoreError, CerbyException) as error:
+            result.error = str(error)
+        finally:
+            if ses_actions:
+                result.records_pending_to_create = ses_actions.records_pending_to_create
+                result.rules_failed_to_create = ses_actions.rules_failed_to_create
+                result.changes = ses_actions.changes
+            result.elapsed = time.perf_counter() - start
+    return result
+
+
+def needs_flush(result: DomainResult) -> bool:
+    """Whether the outcome of a domain depends on the batch flush
+
+    Records and receipt rules of a configured domain are only written when
+    the batch flushes them, converged and failed domains are final.
+    """
+    return result.succeeded and not result.converged
+
+
+def record_change_failures(results: List[DomainResult], changes: List[ChangeInfo]):
+    """Fail the domains of the record changes the batch could not write
+
+    Every domain is also given the changes submitted for it, so its Change
+    IDs are known when it is reported.
+
+    Args:
+        results (List[DomainResult]): The domains waiting on the flush
+        changes (List[ChangeInfo]): Every change submitted since the last
+            flush, the ones submitted early included
+    """
+    by_domain: Dict[str, List[ChangeInfo]] = {}
+    for change in changes:
+        for domain in change.domains:
+            by_domain.setdefault(domain, []).append(change)
+    for result in results:
+        own = {id(change) for change in result.changes}
+        for change in by_domain.get(result.domain, []):
+            if id(change) not in own:
+                result.changes.append(change)
+            if change.error and result.succeeded:
+                result.error = change.error
+
+
+def record_rule_failures(
+    results: Iterable[DomainResult],
+    failures: Dict[str, str],
+    rule_set_name: str,
+    region: Optional[str] = None,
+):
+    """Fail the domains the receipt rule flush could not add
+
+    Args:
+        results (Iterable[DomainResult]): The domains waiting on the flush
+        failures (Dict[str, str]): Error by domain returned by the flush
+        rule_set_name (str): The rule set the domains were added to
+        region (str, optional): Region of the rule set, when the batch spans
+            several
+    """
+    for result in results:
+        if region and result.region != region:
+            continue
+        error = failures.get(result.domain)
+        if error and result.succeeded:
+            result.error = error
+            result.rules_failed_to_create[rule_set_name] = error
+
+
+def flush_staged(
+    results: List[DomainResult],
+    changes: List[ChangeInfo],
+    hzr_repo: AWSHostedZoneRecordsRepository,
+    rule_managers: Dict[Optional[str], ReceiptRuleManager],
+    executor: Optional[Executor] = None,
+) -> List[ChangeInfo]:
+    """Write the staged records and receipt rules, failing the domains they miss
+
+    Args:
+        results (List[DomainResult]): The domains waiting on the flush
+        changes (List[ChangeInfo]): The changes submitted early for them
+        hzr_repo (AWSHostedZoneRecordsRepository): Repository the records are
+            staged in
+        rule_managers (Dict[Optional[str], ReceiptRuleManager]): Receipt rules
+            by region, or under None for a batch of the current region
+        executor (Executor, optional): Pool flushing the regions at once
+
+    Returns:
+        List[ChangeInfo]: The change batches the flush submitted
+    """
+    with metrics.phase("flush"):
+        submitted = hzr_repo.flush()
+        record_change_failures(results, changes + submitted)
+        regions = list(rule_managers)
+
+        def flush_rules(region: Optional[str]) -> Dict[str, str]:
+            return rule_managers[region].flush()
+
+        failures = (executor.map if executor else map)(flush_rules, regions)
+        for region, region_failures in zip(regions, failures):
+            record_rule_failures(
+                results, region_failures, rule_managers[region].rule_set_name, region
+            )
+    return submitted
+
+
+def run_batch(
+    domains: Iterable[str],
+    workers: int = DEFAULT_WORKERS,
+    on_result: Optional[Callable[[DomainResult], None]] = None,
+    hzr_repo: Optional[AWSHostedZoneRecordsRepository] = None,
+    hz_repo: Optional[AWSHostedZoneRepository] = None,
+    flush_every: int = FLUSH_EVERY,
+) -> BatchSummary:
+    """Configure many domains on a bounded worker pool
+
+    Domains are pulled from the stream only as workers free up, flush_every
+    at a time. Every domain stages its records in one shared repository, so
+    records of domains sharing a hosted zone are created together once the
+    domains of the chunk are done. Receipt rules are updated once per chunk
+    too, and identity attributes are read in bulk ahead of the workers.
+    Converged and failed domains are reported as they complete, the others
+    once the flush of their chunk wrote their records and rules, with the
+    error of the flush when it failed them.
+
+    Args:
+        domains (Iterable[str]): Domains to configure
+        workers (int): Maximum number of domains configured at once
+        on_result (Callable, optional): Called with each result as it completes
+        hzr_repo (AWSHostedZoneRecordsRepository, optional): Repository to
+            stage the record changes in, or a dns_provider.DNSProvider
+        hz_repo (AWSHostedZoneRepository, optional): Repository resolving the
+            zone of each domain, or the same DNSProvider
+        flush_every (int): Domains configured between two flushes
+
+    Returns:
+        BatchSummary: The totals and the failed domains
+    """
+    summary = BatchSummary()
+    start = time.perf_counter()
+    hzr_repo = hzr_repo or AWSHostedZoneRecordsRepository()
+    identity_repo = AWSIdentityRepository()
+    rule_manager = ReceiptRuleManager()
+    configure = functools.partial(
+        configure_domain,
+        hzr_repo=hzr_repo,
+        identity_repo=identity_repo,
+        hz_repo=hz_repo or AWSHostedZoneRepository(),
+        rule_manager=rule_manager,
+    )
+
+    def report(result: DomainResult):
+        summary.add(result)
+        if on_result:
+            on_result(result)
+
+    for chunk in chunked(domains, flush_every):
+        flushed: List[DomainResult] = []
+        changes: List[ChangeInfo] = []
+        for result in imap_bounded(
+            configure, prefetched(chunk, identity_repo), workers
+        ):
+            changes.extend(result.changes)
+            if needs_flush(result):
+                flushed.append(result)
+            else:
+                report(result)
+        changes.extend(flush_staged(flushed, changes, hzr_repo, {None: rule_manager}))
+        summary.changes.extend(changes)
+        for result in flushed:
+            report(result)
+    summary.elapsed = time.perf_counter() - start
+    return summary
@@ -0,0 +1,171 @@
+import argparse
+import contextlib
+import json
+import os
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+from aws import registry
+from batch import DEFAULT_WORKERS, run_batch
+from localaws import LocalAWS, LocalAWSSettings
+from metrics import metrics
+from ratelimit import limiter, parse_rate
+
+BENCHMARK_ZONE = "benchmark.com"
+
+# Client side rate limits of a run, high enough to measure the tool itself
+# instead of the AWS quotas. Pass the real quotas to include them.
+BENCHMARK_RATES = {"route53": 10000.0, "ses": 10000.0}
+
+
+@dataclass
+class BenchmarkResult:
+    domains: int
+    workers: int
+    zone_records: int
+    elapsed: float
+    calls: Dict[str, int] = field(default_factory=dict)
+    throttled: Dict[str, int] = field(default_factory=dict)
+    failed: int = 0
+    peak_memory: Optional[int] = None
+
+    @property
+    def domains_per_second(self) -> float:
+        return self.domains / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def calls_per_domain(self) -> float:
+        return sum(self.calls.values()) / self.domains
+
+    def as_dict(self) -> dict:
+        return {
+            **asdict(self),
+            "domains_per_second": round(self.domains_per_second, 2),
+            "calls_per_domain": round(self.calls_per_domain, 2),
+        }
+
+
+def benchmark_domains(count: int) -> List[str]:
+    return [f"tenant-{index}.{BENCHMARK_ZONE}" for index in range(count)]
+
+
+def run_benchmark(
+    domains: int,
+    workers: int = DEFAULT_WORKERS,
+    zone_records: int = 0,
+    settings: Optional[LocalAWSSettings] = None,
+    rates: Optional[Dict[str, float]] = None,
+    measure_memory: bool = True,
+) -> BenchmarkResult:
+    """Configure new domains end to end against the local AWS stand-in
+
+    Every domain lives in one hosted zone filled with zone_records unrelated
+    records. Output of the run is discarded.
+
+    Args:
+        domains (int): Domains to configure
+        workers (int): Domains configured at once
+        zone_records (int): Size of the hosted zone before the run
+        settings (LocalAWSSettings, optional): Latency and throttling of the
+            stand-in
+        rates (Dict[str, float], optional): Client side requests per second
+            by service, defaults to BENCHMARK_RATES
+        measure_memory (bool): Trace the peak memory of the run, which slows
+            it down
+
+    Returns:
+        BenchmarkResult: Wall time, API calls and peak memory of the run
+    """
+    local = LocalAWS(settings)
+    local.route53.add_hosted_zone(BENCHMARK_ZONE, filler_records=zone_records)
+    default_rates = dict(limiter.rates)
+    registry.reset()
+    limiter.reset()
+    limiter.configure({**BENCHMARK_RATES, **(rates or {})})
+    metrics.reset()
+    if measure_memory:
+        tracemalloc.start()
+    try:
+        with local.patched(), open(os.devnull, "w") as devnull:
+            with contextlib.redirect_stdout(devnull):
+                start = time.perf_counter()
+                summary = run_batch(benchmark_domains(domains), workers=workers)
+                elapsed = time.perf_counter() - start
+        peak_memory = tracemalloc.get_traced_memory()[1] if measure_memory else None
+    finally:
+        if measure_memory:
+            tracemalloc.stop()
+        registry.reset()
+        limiter.configure(default_rates)
+    return BenchmarkResult(
+        domains=domains,
+        workers=workers,
+        zone_records=zone_records,
+        elapsed=elapsed,
+        calls=dict(local.calls),
+        throttled=dict(local.throttled),
+        failed=len(summary.failed) + len(summary.failed_changes),
+        peak_memory=peak_memory,
+    )
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the SES setup against a local AWS stand-in"
+    )
+    parser.add_argument(
+        "--domains",
+        type=int,
+        action="append",
+        help="Domains to configure, repeat for several runs (default 1, 100, 10000)",
+    )
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument(
+        "--zone-records",
+        type=int,
+        default=100000,
+        help="Records already in the hosted zone (default 100000)",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds per AWS request"
+    )
+    parser.add_argument(
+        "--throttle-rate",
+        type=float,
+        help="Requests per second each service accepts before throttling",
+    )
+    parser.add_argument(
+        "--rate",
+        metavar="SERVICE=RPS",
+        type=parse_rate,
+        action="append",
+        default=[],
+        help="Client side requests per second of a service, unlimited by default",
+    )
+    parser.add_argument(
+        "--no-memory",
+        action="store_true",
+        help="Do not trace memory, tracing slows the run down",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    settings = LocalAWSSettings(latency=args.latency, throttle_rate=args.throttle_rate)
+    for domains in args.domains or [1, 100, 10000]:
+        result = run_benchmark(
+            domains,
+            workers=args.workers,
+            zone_records=args.zone_records,
+            settings=settings,
+            rates=dict(args.rate),
+            measure_memory=not args.no_memory,
+        )
+        print(json.dumps(result.as_dict()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+# Seconds an entry is trusted, by kind. Hosted zones are rarely added, while
+# identity and receipt rule state may be changed from the console.
+DEFAULT_TTLS = {
+    "zones": 3600.0,
+    "records": 900.0,
+    "dkim": 900.0,
+    "mail_from": 900.0,
+    "rule_set": 900.0,
+}
+
+# Route53 is global, its entries are shared by every region of the account.
+GLOBAL_KINDS = ["zones", "records"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    account TEXT NOT NULL,
+    region TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (account, region, kind, key)
+)
+"""
+
+
+class StateCache:
+    """On-disk snapshot of the AWS state read by the repositories
+
+    Entries are kept in SQLite per account and region, and each kind expires
+    after its own TTL. Repositories read through the cache and invalidate the
+    entries of whatever they write, so a repeat run only asks AWS about state
+    that expired or that the tool itself changed. The cache is disabled until
+    opened, every read is then a miss.
+    """
+
+    def __init__(
+        self,
+        ttls: Optional[Dict[str, float]] = None,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.ttls = dict(ttls or DEFAULT_TTLS)
+        self.clock = clock
+        self.account = ""
+        self.region = ""
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._connection is not None
+
+    def open(
+        self,
+        path: str,
+        account: str,
+        region: str,
+        ttl: Optional[float] = None,
+    ):
+        """Start caching to a SQLite file
+
+        Args:
+            path (str): The SQLite file, created when missing
+            account (str): AWS account the state belongs to
+            region (str): Region of the SES state
+            ttl (float, optional): Seconds every kind is trusted, instead of
+                the per-kind defaults
+        """
+        self.close()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(path, check_same_thread=False)
+        connection.execute(SCHEMA)
+        connection.execute("DELETE FROM entries WHERE expires <= ?", (self.clock(),))
+        connection.commit()
+        with self._lock:
+            self._connection = connection
+            self.account, self.region = account, region
+            if ttl is not None:
+                self.ttls = {kind: ttl for kind in self.ttls}
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def reset(self):
+        self.close()
+        self.ttls = dict(DEFAULT_TTLS)
+        self.hits = self.misses = 0
+
+    def _scope(self, kind: str, region: Optional[str] = None) -> tuple:
+        if kind in GLOBAL_KINDS:
+            return self.account, "", kind
+        return self.account, region or self.region, kind
+
+    def get_many(
+        self, kind: str, keys: Iterable[str], region: Optional[str] = None
+    ) -> Dict[str, object]:
+        """Read the entries of a kind that have not expired
+
+        Args:
+            kind (str): The kind of state, e.g. dkim
+            keys (Iterable[str]): The entries to read
+            region (str, optional): Region of the state, the one the cache
+                was opened for when not given
+
+        Returns:
+            Dict[str, object]: Value by key, missing and expired keys are
+                left out
+        """
+        keys = list(dict.fromkeys(keys))
+        if not self.enabled or not keys:
+            return {}
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start : start + 500]
+                rows = self._connection.execute(
+                    "SELECT key, value FROM entries"
+                    " WHERE account = ? AND region = ? AND kind = ? AND expires > ?"
+                    f" AND key IN ({', '.join('?' * len(chunk))})",
+                    (*self._scope(kind, region), self.clock(), *chunk),
+                )
+                found.update((key, json.loads(value)) for key, value in rows)
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def get(
+        self, kind: str, key: str, region: Optional[str] = None
+    ) -> Optional[object]:
+        return self.get_many(kind, [key], region).get(key)
+
+    def put_many(
+        self, kind: str, values: Dict[str, object], region: Optional[str] = None
+    ):
+        """Store entries of a kind, replacing older ones
+
+        Args:
+            kind (str): The kind of state
+            values (Dict[str, object]): JSON serializable value by key
+            region (str, optional): Region of the state
+        """
+        if not self.enabled or not values:
+            return
+        expires = self.clock() + self.ttls.get(kind, 0)
+        scope = self._scope(kind, region)
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (*scope, key, json.dumps(value), expires)
+                    for key, value in values.items()
+                ],
+            )
+            self._connection.commit()
+
+    def put(self, kind: str, key: str, value: object, region: Optional[str] = None):
+        self.put_many(kind, {key: value}, region)
+
+    def invalidate(
+        self,
+        kind: str,
+        keys: Optional[List[str]] = None,
+        region: Optional[str] = None,
+    ):
+        """Drop entries the tool is about to change
+
+        Args:
+            kind (str): The kind of state
+            keys (List[str], optional): The entries to drop, every entry of
+                the kind when not given
+            region (str, optional): Region of the state
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if keys is None:
+                self._connection.execute(
+                    "DELETE FROM entries WHERE account = ? AND region = ? AND kind = ?",
+                    self._scope(kind, region),
+                )
+            else:
+                self._connection.executemany(
+                    "DELETE FROM entries"
+                    " WHERE account = ? AND region = ? AND kind = ? AND key = ?",
+                    [(*self._scope(kind, region), key) for key in keys],
+                )
+            self._connection.commit()
+
+
+state_cache = StateCache()
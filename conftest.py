@@ -4,8 +4,71 @@ import boto3
 import pytest
 from botocore.exceptions import ClientError
 
+from aws import registry
+from cache import state_cache
+from localaws import LocalAWS
+from metrics import metrics
+from ratelimit import limiter
 
-def mock_boto3_client(service_name):
+
+def reversed_labels(name):
+    return list(reversed(name.rstrip(".").split(".")))
+
+
+PAGINATED_ZONE = sorted(
+    [
+        {
+            "Name": name,
+            "Type": record_type,
+            "TTL": 300,
+            "ResourceRecords": [{"Value": value}],
+        }
+        for name, record_type, value in [
+            ("my-identity.com.", "MX", "10 inbound-smtp.us-east-1.amazonaws.com"),
+            ("my-identity.com.", "NS", "ns-1.awsdns-00.com."),
+            ("my-identity.com.", "TXT", '"google-site-verification=abc"'),
+            ("a.my-identity.com.", "A", "10.0.0.1"),
+            ("bounce.my-identity.com.", "MX", "10 feedback-smtp.amazonses.com"),
+            ("bounce.my-identity.com.", "TXT", '"v=spf1 include:amazonses.com ~all"'),
+            ("_domainkey.my-identity.com.", "TXT", '"o=~"'),
+            ("token-a._domainkey.my-identity.com.", "CNAME", "token-a.dkim.com"),
+            ("token-b._domainkey.my-identity.com.", "CNAME", "token-b.dkim.com"),
+            ("www.my-identity.com.", "CNAME", "my-identity.com"),
+        ]
+    ],
+    key=lambda record_set: (reversed_labels(record_set["Name"]), record_set["Type"]),
+)
+
+
+def paginate_record_sets(
+    record_sets, page_size, StartRecordName=None, StartRecordType=None, **kwargs
+):
+    start = 0
+    if StartRecordName:
+        key = (reversed_labels(StartRecordName), StartRecordType or "")
+        start = next(
+            (
+                index
+                for index, record_set in enumerate(record_sets)
+                if (reversed_labels(record_set["Name"]), record_set["Type"]) >= key
+            ),
+            len(record_sets),
+        )
+    page = record_sets[start : start + page_size]
+    response = {"ResourceRecordSets": page, "IsTruncated": False}
+    if start + page_size < len(record_sets):
+        next_record_set = record_sets[start + page_size]
+        response.update(
+            {
+                "IsTruncated": True,
+                "NextRecordName": next_record_set["Name"],
+                "NextRecordType": next_record_set["Type"],
+            }
+        )
+    return response
+
+
+def mock_boto3_client(service_name, **kwargs):
     mock_client = MagicMock()
 
     if service_name == "ses":
@@ -22,72 +85,38 @@ def mock_boto3_client(service_name):
                 },
             }
 
-            if any(
-                identity in Identities
-                for identity in [
-                    "new-identity-present-in-route53.com",
-                    "new-identity-not-present-in-route53.com",
-                ]
-            ):
-                return {"DkimAttributes": {}}
-
-            for identity, dkim_attributes in dkim_attributes_map.items():
-                if identity in Identities:
-                    return {"DkimAttributes": {identity: dkim_attributes}}
-
-            return {"DkimAttributes": {}}
+            return {
+                "DkimAttributes": {
+                    identity: dkim_attributes_map[identity]
+                    for identity in Identities
+                    if identity in dkim_attributes_map
+                }
+            }
 
         def verify_domain_dkim(Domain):
             return {"DkimTokens": ["token-a", "token-b"]}
 
         def get_identity_mail_from_domain_attributes(Identities):
-            identity = Identities[0]
-            if identity == "empty-mail-from-attributes.com":
-                return {
-                    "MailFromDomainAttributes": {
-                        identity: {
-                            "BehaviorOnMXFailure": "UseDefaultValue",
-                        }
-                    }
-                }
-            return {
-                "MailFromDomainAttributes": {
-                    identity: {
+            attributes = {}
+            for identity in Identities:
+                if identity == "empty-mail-from-attributes.com":
+                    attributes[identity] = {"BehaviorOnMXFailure": "UseDefaultValue"}
+                else:
+                    attributes[identity] = {
                         "MailFromDomain": f"bounce.{identity}",
                         "MailFromDomainStatus": "Pending",
                         "BehaviorOnMXFailure": "UseDefaultValue",
                     }
-                }
-            }
+            return {"MailFromDomainAttributes": attributes}
 
         def create_receipt_rule_set(RuleSetName):
-            if RuleSetName == "rule-set-for-cerby-accessdenied":
-                raise ClientError(
-                    {
-                        "Error": {
-                            "Code": "AccessDenied",
-                            "Message": "User is not authorized to perform this action.",
-                        }
-                    },
-                    "SetActiveReceiptRule",
-                )
             return {"RuleSetName": RuleSetName}
 
         def set_active_receipt_rule_set(RuleSetName):
-            if RuleSetName == "rule-set-for-cerby-accessdenied":
-                raise ClientError(
-                    {
-                        "Error": {
-                            "Code": "AccessDenied",
-                            "Message": "User is not authorized to perform this action.",
-                        }
-                    },
-                    "SetActiveReceiptRule",
-                )
             return {"RuleSetName": RuleSetName}
 
-        def create_receipt_rule(RuleSetName, Rule):
-            if RuleSetName == "rule-set-for-cerby-accessdenied":
+        def create_receipt_rule(RuleSetName, Rule, After=None):
+            if "accessdenied.com" in Rule["Recipients"]:
                 raise ClientError(
                     {
                         "Error": {
@@ -95,10 +124,45 @@ def mock_boto3_client(service_name):
                             "Message": "User is not authorized to perform this action.",
                         }
                     },
-                    "SetActiveReceiptRule",
+                    "CreateReceiptRule",
                 )
             return {"Rule": Rule}
 
+        def describe_receipt_rule_set(RuleSetName):
+            if RuleSetName == "rule-set-for-cerby-existing-identity-present-in-route53":
+                return {
+                    "Metadata": {"Name": RuleSetName},
+                    "Rules": [
+                        {
+                            "Name": RuleSetName,
+                            "Enabled": True,
+                            "Actions": [
+                                {
+                                    "S3Action": {
+                                        "BucketName": "cerby-store-ses-email-production",
+                                        "ObjectKeyPrefix": "staged",
+                                    },
+                                },
+                                {"StopAction": {"Scope": "RuleSet"}},
+                            ],
+                            "Recipients": [],
+                            "ScanEnabled": True,
+                            "TlsPolicy": "Optional",
+                        }
+                    ],
+                }
+            raise ClientError(
+                {
+                    "Error": {
+                        "Code": "RuleSetDoesNotExist",
+                        "Message": f"Rule set does not exist: {RuleSetName}",
+                    }
+                },
+                "DescribeReceiptRuleSet",
+            )
+
+        mock_client.describe_receipt_rule_set.side_effect = describe_receipt_rule_set
+        mock_client.describe_active_receipt_rule_set.return_value = {}
         mock_client.get_identity_dkim_attributes.side_effect = (
             get_identity_dkim_attributes
         )
@@ -115,32 +179,40 @@ def mock_boto3_client(service_name):
 
     elif service_name == "route53":
 
-        def list_hosted_zones_by_name(DNSName):
-            hosted_zone_map = {
-                "new-identity-present-in-route53.com": {
-                    "HostedZones": [
-                        {
-                            "Name": "new-identity-present-in-route53.com",
-                            "Id": "some-long-id",
-                        }
-                    ]
+        def list_hosted_zones(Marker=None):
+            hosted_zones = [
+                {
+                    "Name": "new-identity-present-in-route53.com.",
+                    "Id": "some-long-id",
+                    "Config": {"PrivateZone": False},
                 },
-                "existing-identity-present-in-route53.com": {
-                    "HostedZones": [
-                        {
-                            "Name": "existing-identity-present-in-route53.com",
-                            "Id": "some-long-id",
-                        }
-                    ]
+                {
+                    "Name": "existing-identity-present-in-route53.com.",
+                    "Id": "some-long-id",
+                    "Config": {"PrivateZone": False},
                 },
-            }
-
-            if DNSName in hosted_zone_map:
-                return hosted_zone_map.get(DNSName)
-
-            return {"HostedZones": []}
+                {
+                    "Name": "company.com.",
+                    "Id": "company-id",
+                    "Config": {"PrivateZone": False},
+                },
+                {
+                    "Name": "internal.company.com.",
+                    "Id": "internal-company-id",
+                    "Config": {"PrivateZone": True},
+                },
+            ]
+            if Marker is None:
+                return {
+                    "HostedZones": hosted_zones[:2],
+                    "IsTruncated": True,
+                    "NextMarker": "page-2",
+                }
+            return {"HostedZones": hosted_zones[2:], "IsTruncated": False}
 
-        def list_resource_record_sets(HostedZoneId):
+        def list_resource_record_sets(HostedZoneId, **kwargs):
+            if HostedZoneId == "paginated-id":
+                return paginate_record_sets(PAGINATED_ZONE, page_size=2, **kwargs)
             if HostedZoneId == "token-a-id":
                 return {
                     "ResourceRecordSets": [
@@ -169,12 +241,40 @@ def mock_boto3_client(service_name):
                 }
             return {"ResourceRecordSets": []}
 
-        mock_client.list_hosted_zones_by_name.side_effect = list_hosted_zones_by_name
+        mock_client.list_hosted_zones.side_effect = list_hosted_zones
         mock_client.list_resource_record_sets.side_effect = list_resource_record_sets
-        mock_client.change_resource_records_sets = MagicMock()
+        mock_client.change_resource_record_sets.return_value = {
+            "ChangeInfo": {"Id": "/change/C1234567890", "Status": "PENDING"}
+        }
+        mock_client.get_change.return_value = {
+            "ChangeInfo": {"Id": "/change/C1234567890", "Status": "INSYNC"}
+        }
     return mock_client
 
 
+@pytest.fixture(autouse=True)
+def reset_client_registry():
+    registry.reset()
+    limiter.reset()
+    metrics.reset()
+    state_cache.reset()
+    yield
+    registry.reset()
+    limiter.reset()
+    metrics.reset()
+    state_cache.reset()
+
+
+@pytest.fixture
+def local_aws():
+    local = LocalAWS()
+    # the stand-in answers instantly, the client side limits would only slow
+    # the tests down
+    limiter.configure({"route53": 1000, "ses": 1000})
+    with local.patched():
+        yield local
+
+
 @pytest.fixture
 def mock_boto3_client_patch():
     with patch("boto3.session.Session.client") as mock_client_method:
@@ -0,0 +1,118 @@
+from abc import ABC, abstractmethod
+from typing import Dict, Iterator, List, Optional
+
+from exceptions import ConfigurationException
+from models import ChangeInfo, HostedZoneRecord
+from repository import AWSHostedZoneRecordsRepository, AWSHostedZoneRepository
+
+
+class DNSProvider(ABC):
+    """A DNS service the records of a domain are written to
+
+    This is what SESActions, the batch and the teardown need from DNS, the
+    same methods AWSHostedZoneRepository and AWSHostedZoneRecordsRepository
+    have, so a provider is passed as both the hz_repo and the hzr_repo.
+    """
+
+    @abstractmethod
+    def get(self, domain: str) -> Optional[str]:
+        """The id of the zone owning the domain, None when there is none"""
+
+    @abstractmethod
+    def get_domain_records(
+        self, hosted_zone_id: str, domain: str
+    ) -> Iterator[HostedZoneRecord]:
+        """Read the records of <domain>, bounce.<domain> and *._domainkey.<domain>"""
+
+    @abstractmethod
+    def stage(
+        self,
+        hosted_zone_id: str,
+        record: HostedZoneRecord,
+        action: str = "CREATE",
+        owner: Optional[str] = None,
+    ) -> List[ChangeInfo]:
+        """Queue a record change, returning the changes submitted early"""
+
+    @abstractmethod
+    def flush(self) -> List[ChangeInfo]:
+        """Submit every staged change, as few requests per zone as possible"""
+
+
+class Route53Provider(DNSProvider):
+    """The hosted zones of the account"""
+
+    def __init__(
+        self,
+        hz_repo: Optional[AWSHostedZoneRepository] = None,
+        hzr_repo: Optional[AWSHostedZoneRecordsRepository] = None,
+    ) -> None:
+        self.hz_repo = hz_repo or AWSHostedZoneRepository()
+        self.hzr_repo = hzr_repo or AWSHostedZoneRecordsRepository()
+
+    def get(self, domain: str) -> Optional[str]:
+        return self.hz_repo.get(domain)
+
+    def get_domain_records(
+        self, hosted_zone_id: str, domain: str
+    ) -> Iterator[HostedZoneRecord]:
+        return self.hzr_repo.get_domain_records(hosted_zone_id, domain)
+
+    def stage(
+        self,
+        hosted_zone_id: str,
+        record: HostedZoneRecord,
+        action: str = "CREATE",
+        owner: Optional[str] = None,
+    ) -> List[ChangeInfo]:
+        return self.hzr_repo.stage(hosted_zone_id, record, action, owner)
+
+    def flush(self) -> List[ChangeInfo]:
+        return self.hzr_repo.flush()
+
+
+class DNSProviders(DNSProvider):
+    """Several providers, a domain is written to the first one owning it
+
+    Zone ids of different providers never collide, e.g. Route53 ids and the
+    rfc2136: ones, so each zone is routed back to the provider that found it.
+    """
+
+    def __init__(self, providers: List[DNSProvider]) -> None:
+        self.providers = providers
+        self._owners: Dict[str, DNSProvider] = {}
+
+    def get(self, domain: str) -> Optional[str]:
+        for provider in self.providers:
+            hosted_zone_id = provider.get(domain)
+            if hosted_zone_id:
+                self._owners[hosted_zone_id] = provider
+                return hosted_zone_id
+        return None
+
+    def provider(self, hosted_zone_id: str) -> DNSProvider:
+        if hosted_zone_id not in self._owners:
+            raise ConfigurationException(f"No DNS provider owns zone {hosted_zone_id}")
+        return self._owners[hosted_zone_id]
+
+    def get_domain_records(
+        self, hosted_zone_id: str, domain: str
+    ) -> Iterator[HostedZoneRecord]:
+        return self.provider(hosted_zone_id).get_domain_records(hosted_zone_id, domain)
+
+    def stage(
+        self,
+        hosted_zone_id: str,
+        record: HostedZoneRecord,
+        action: str = "CREATE",
+        owner: Optional[str] = None,
+    ) -> List[ChangeInfo]:
+        return self.provider(hosted_zone_id).stage(
+            hosted_zone_id, record, action, owner
+        )
+
+    def flush(self) -> List[ChangeInfo]:
+        submitted = []
+        for provider in self.providers:
+            submitted.extend(provider.flush())
+        return submitted
@@ -1,10 +1,30 @@
-class RuleSetAlreadyExistsException(Exception):
+class CerbyException(Exception):
+    """Base of the errors the tool reports instead of failing with a traceback"""
+
+
+class ConfigurationException(CerbyException):
+    """The region, files or options of the run can not be used"""
+
+
+class RuleSetAlreadyExistsException(CerbyException):
+    pass
+
+
+class RuleSetDoesNotExistException(CerbyException):
+    pass
+
+
+class RuleAlreadyExistsException(CerbyException):
+    pass
+
+
+class ChangeBatchFailedException(CerbyException):
     pass
 
 
-class RuleSetDoesNotExistException(Exception):
+class ReceiptRuleFailedException(CerbyException):
     pass
 
 
-class RuleAlreadyExistsException(Exception):
+class ChangeConflictException(CerbyException):
     pass
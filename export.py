@@ -0,0 +1,193 @@
+import csv
+import itertools
+import json
+import os
+import sqlite3
+import threading
+from typing import Iterable, Iterator, List, TextIO, Tuple
+
+from exceptions import ConfigurationException
+from models import HostedZoneRecord
+from utils import normalize_fqdn
+
+# Export formats, by file extension
+ZONE = "zone"
+CSV = "csv"
+JSON = "json"
+FORMATS = {".zone": ZONE, ".csv": CSV, ".json": JSON}
+
+# Second level labels that registries of two letter country codes sell names
+# under, e.g. company.co.uk
+SECOND_LEVEL_LABELS = {"ac", "co", "com", "edu", "gov", "net", "org"}
+
+# Record types whose values end in a host name, absolute in zone files
+HOST_VALUE_TYPES = {"CNAME", "MX"}
+
+SCHEMA = """
+CREATE TABLE records (
+    zone TEXT NOT NULL,
+    name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    ttl INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (zone, name, type, value)
+)
+"""
+
+
+def export_format(path: str) -> str:
+    """The format of an export file, from its extension
+
+    Raises:
+        ConfigurationException: If the extension is not .zone, .csv or .json
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise ConfigurationException(
+            f"Can not export to {path}, use a {', '.join(FORMATS)} extension"
+        )
+    return FORMATS[extension]
+
+
+def apex_zone(name: str) -> str:
+    """The zone a DNS name is most likely registered in
+
+    Without a public suffix list this is the last two labels, or three under
+    the second level labels of country codes, e.g. company.co.uk.
+
+    Args:
+        name (str): A DNS name
+
+    Returns:
+        str: The apex of the name, without the trailing dot
+    """
+    labels = normalize_fqdn(name).rstrip(".").split(".")
+    size = 2
+    if len(labels) > 2 and len(labels[-1]) == 2 and labels[-2] in SECOND_LEVEL_LABELS:
+        size = 3
+    return ".".join(labels[-size:])
+
+
+def zone_value(record_type: str, value: str) -> str:
+    """Make the host name a value ends in absolute, as zone files need"""
+    if record_type in HOST_VALUE_TYPES and not value.endswith("."):
+        return value + "."
+    return value
+
+
+class RecordExporter:
+    """Write the records to add by hand for other DNS providers
+
+    Records are spooled to a temporary SQLite file as they are added, which
+    drops duplicates, so thousands of domains never sit in memory. write
+    reads them back sorted by apex zone and name, and streams every file:
+    RFC 1035 zone file fragments, CSV with a row per value, or JSON with the
+    record sets of each zone.
+    """
+
+    def __init__(self, paths: List[str]) -> None:
+        self.paths = {path: export_format(path) for path in paths}
+        self._lock = threading.Lock()
+        # an empty path is a temporary file SQLite deletes on close
+        self._connection = sqlite3.connect("", check_same_thread=False)
+        self._connection.execute(SCHEMA)
+
+    def add(self, records: Iterable[HostedZoneRecord]):
+        """Spool records, the ones already added are ignored
+
+        Args:
+            records (Iterable[HostedZoneRecord]): Records to add by hand
+        """
+        rows = []
+        for record in records:
+            name = normalize_fqdn(record.name).rstrip(".")
+            for value in record.values:
+                rows.append(
+                    (apex_zone(name), name, record.type.upper(), record.ttl, value)
+                )
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO records VALUES (?, ?, ?, ?, ?)", rows
+            )
+
+    def record_sets(self) -> Iterator[Tuple[str, HostedZoneRecord]]:
+        """Read the spooled records back, one record set at a time
+
+        Yields:
+            Tuple[str, HostedZoneRecord]: The apex zone and a record set, in
+                zone, name and type order
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT zone, name, type, ttl, value FROM records"
+                " ORDER BY zone, name, type, value"
+            )
+            for (zone, name, record_type), group in itertools.groupby(
+                rows, key=lambda row: row[:3]
+            ):
+                group = list(group)
+                yield (
+                    zone,
+                    HostedZoneRecord(
+                        name=name,
+                        type=record_type,
+                        ttl=min(row[3] for row in group),
+                        values=[row[4] for row in group],
+                    ),
+                )
+
+    def write(self):
+        """Write every export file"""
+        for path, file_format in self.paths.items():
+            with open(path, "w", newline="") as export_file:
+                if file_format == ZONE:
+                    self.write_zone(export_file)
+                elif file_format == CSV:
+                    self.write_csv(export_file)
+                else:
+                    self.write_json(export_file)
+
+    def write_zone(self, stream: TextIO):
+        current = None
+        for zone, record in self.record_sets():
+            if zone != current:
+                if current is not None:
+                    stream.write("\n")
+                stream.write(f"$ORIGIN {zone}.\n")
+                current = zone
+            for value in record.values:
+                stream.write(
+                    f"{record.name}. {record.ttl} IN {record.type}"
+                    f" {zone_value(record.type, value)}\n"
+                )
+
+    def write_csv(self, stream: TextIO):
+        writer = csv.writer(stream)
+        writer.writerow(["zone", "name", "type", "ttl", "value"])
+        for zone, record in self.record_sets():
+            for value in record.values:
+                writer.writerow([zone, record.name, record.type, record.ttl, value])
+
+    def write_json(self, stream: TextIO):
+        stream.write('{"zones": [')
+        current = None
+        for zone, record in self.record_sets():
+            if zone != current:
+                if current is not None:
+                    stream.write("]},")
+                stream.write(f'\n{{"zone": {json.dumps(zone)}, "records": [')
+                separator = ""
+                current = zone
+            item = {
+                "name": record.name,
+                "type": record.type,
+                "ttl": record.ttl,
+                "values": record.values,
+            }
+            stream.write(f"{separator}\n{json.dumps(item)}")
+            separator = ","
+        stream.write("]}\n]}\n" if current is not None else "]}\n")
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
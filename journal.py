@@ -0,0 +1,185 @@
+import contextlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from batch import DomainResult
+from exceptions import ConfigurationException
+
+JOURNAL_VERSION = 1
+
+# Steps of a domain in batch mode. Records and receipt rules are only written
+# when the batch flushes them, after each chunk of domains is configured.
+CONFIGURE = "configure"
+RECORDS = "records"
+RULES = "rules"
+STEPS = [CONFIGURE, RECORDS, RULES]
+
+DONE = "done"
+FAILED = "failed"
+
+
+class Journal:
+    """Append-only checkpoint of a batch run
+
+    Every step a domain finishes or fails is appended as one JSON line and
+    flushed right away, with the Change IDs of the records it submitted. A run
+    that dies midway leaves a journal a later run can resume from: domains
+    whose steps are all done are skipped, and the others are configured again,
+    which only writes what the failed or unfinished steps left missing.
+    """
+
+    def __init__(self, path: str, region: str, resume: bool = False) -> None:
+        """Start a journal, or continue one when resuming
+
+        Args:
+            path (str): The journal file, rewritten unless resuming
+            region (str): Region of the run, a journal of another region can
+                not be resumed
+            resume (bool): Load the steps of the journal and append to it
+
+        Raises:
+            ConfigurationException: If the journal to resume is of another
+                region or version
+        """
+        self.path = path
+        self.region = region
+        self.steps: Dict[str, Dict[str, str]] = {}
+        self.change_ids: Dict[str, List[str]] = {}
+        self.skipped = 0
+        self._lock = threading.Lock()
+        with contextlib.ExitStack() as stack:
+            if resume and os.path.exists(path):
+                self._load()
+                self._file = stack.enter_context(open(path, "a"))
+            else:
+                self._file = stack.enter_context(open(path, "w"))
+                self._write({"version": JOURNAL_VERSION, "region": region})
+            # only kept open once the journal is ready, closed by close
+            self._files = stack.pop_all()
+
+    def _load(self):
+        with open(self.path) as journal_file:
+            lines = journal_file.read().splitlines()
+        header = json.loads(lines[0]) if lines else {}
+        if header.get("version") != JOURNAL_VERSION:
+            raise ConfigurationException(
+                f"Unsupported journal version {header.get('version')}"
+            )
+        if header["region"] != self.region:
+            raise ConfigurationException(
+                f"Journal was written for {header['region']}, current region is"
+                f" {self.region}"
+            )
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # the last line of a run killed while writing it
+                continue
+            self.steps.setdefault(entry["domain"], {})[entry["step"]] = entry["status"]
+            self.change_ids.setdefault(entry["domain"], []).extend(
+                entry.get("changes", [])
+            )
+
+    def _write(self, entry: dict):
+        with self._lock:
+            self._file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            self._file.flush()
+
+    def close(self):
+        self._files.close()
+
+    def __enter__(self) -> "Journal":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def finished(self, domain: str) -> bool:
+        steps = self.steps.get(domain, {})
+        return all(steps.get(step) == DONE for step in STEPS)
+
+    def pending(self, domains: Iterable[str]) -> Iterator[str]:
+        """Skip the domains a previous run finished
+
+        Args:
+            domains (Iterable[str]): The domains of the batch, may be a lazy
+                stream
+
+        Yields:
+            str: The domains with a failed or unfinished step
+        """
+        for domain in domains:
+            if self.finished(domain):
+                self.skipped += 1
+            else:
+                yield domain
+
+    def record(
+        self,
+        domain: str,
+        step: str,
+        status: str,
+        error: Optional[str] = None,
+        changes: Optional[List[str]] = None,
+    ):
+        """Append the outcome of a step
+
+        Args:
+            domain (str): The domain the step belongs to
+            step (str): One of STEPS
+            status (str): DONE or FAILED
+            error (str, optional): Why the step failed
+            changes (List[str], optional): Route53 Change IDs of the step
+        """
+        entry = {"time": time.time(), "domain": domain, "step": step, "status": status}
+        if error:
+            entry["error"] = error
+        if changes:
+            entry["changes"] = changes
+            self.change_ids.setdefault(domain, []).extend(changes)
+        self._write(entry)
+        self.steps.setdefault(domain, {})[step] = status
+
+    def record_result(self, result: DomainResult):
+        """Record the steps of a domain as the batch reports it
+
+        A configured domain is only reported once the batch flushed its
+        records and receipt rules, so its result tells how both went.
+
+        Args:
+            result (DomainResult): The result reported by the batch
+        """
+        if result.converged:
+            for step in STEPS:
+                self.record(result.domain, step, DONE)
+            return
+        errors = [change.error for change in result.changes if change.error]
+        if not result.succeeded and not errors and not result.rules_failed_to_create:
+            self.record(result.domain, CONFIGURE, FAILED, error=result.error)
+            return
+        self.record(result.domain, CONFIGURE, DONE)
+        if errors:
+            self.record(result.domain, RECORDS, FAILED, error=errors[0])
+        elif result.records_pending_to_create:
+            self.record(
+                result.domain,
+                RECORDS,
+                FAILED,
+                error="No hosted zone, records pending to create by hand",
+            )
+        else:
+            self.record(
+                result.domain,
+                RECORDS,
+                DONE,
+                changes=[change.id for change in result.changes if change.id],
+            )
+        if result.rules_failed_to_create:
+            error = next(iter(result.rules_failed_to_create.values()))
+            self.record(result.domain, RULES, FAILED, error=error)
+        else:
+            self.record(result.domain, RULES, DONE)
@@ -0,0 +1,736 @@
+import bisect
+import hashlib
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+from unittest.mock import PropertyMock, patch
+
+import botocore.session
+from botocore.awsrequest import AWSResponse
+from botocore.exceptions import ClientError
+from botocore.hooks import HierarchicalEmitter
+
+from utils import normalize_fqdn
+
+# Limits enforced by SES and Route53 on the operations below
+MAX_IDENTITIES_PER_REQUEST = 100
+MAX_RECEIPT_RULE_SETS = 40
+MAX_RECEIPT_RULES = 200
+MAX_RECIPIENTS_PER_RULE = 100
+RULE_SET_PAGE_SIZE = 100
+MAX_RECORDS_PER_CHANGE_BATCH = 1000
+MAX_VALUE_CHARACTERS_PER_CHANGE_BATCH = 32000
+
+LOCAL_ACCOUNT = "123456789012"
+
+_service_models: Dict[str, object] = {}
+_service_models_lock = threading.Lock()
+
+
+def service_model(service: str):
+    """The real botocore model of a service, loaded once per process"""
+    with _service_models_lock:
+        if service not in _service_models:
+            session = botocore.session.get_session()
+            _service_models[service] = session.get_service_model(service)
+        return _service_models[service]
+
+
+class LocalAWSError(Exception):
+    def __init__(self, code: str, message: str, status: int = 400) -> None:
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.status = status
+
+
+@dataclass
+class LocalAWSSettings:
+    """Behavior of the stand-in
+
+    Attributes:
+        latency (float): Seconds every request takes, slept outside any lock
+        record_page_size (int): Most record sets per ListResourceRecordSets page
+        zone_page_size (int): Most hosted zones per ListHostedZones page
+        throttle_rate (float, optional): Requests per second each service
+            accepts before answering Throttling, unlimited by default
+        throttle_burst (float, optional): Requests accepted at once, defaults
+            to throttle_rate
+        propagation_polls (int): GetChange calls answered PENDING for each
+            change before it is INSYNC
+    """
+
+    latency: float = 0.0
+    record_page_size: int = 300
+    zone_page_size: int = 100
+    throttle_rate: Optional[float] = None
+    throttle_burst: Optional[float] = None
+    propagation_polls: int = 0
+
+
+def record_set_key(name: str, record_type: str) -> Tuple[Tuple[str, ...], str]:
+    """Route53 order of record sets: labels reversed, then type"""
+    return tuple(reversed(normalize_fqdn(name)[:-1].split("."))), record_type
+
+
+class LocalRoute53:
+    """Hosted zones and record sets of an account, kept in Route53 order"""
+
+    def __init__(self, settings: LocalAWSSettings) -> None:
+        self.settings = settings
+        self._lock = threading.Lock()
+        self.zones: Dict[str, dict] = {}
+        self._keys: Dict[str, list] = {}
+        self._record_sets: Dict[str, List[dict]] = {}
+        self.changes: Dict[str, dict] = {}
+
+    def add_hosted_zone(
+        self, name: str, private: bool = False, filler_records: int = 0
+    ) -> str:
+        """Create a hosted zone
+
+        Args:
+            name (str): Name of the zone
+            private (bool): Whether the zone is private
+            filler_records (int): A records to fill the zone with, to model
+                large zones
+
+        Returns:
+            str: The hosted zone id
+        """
+        name = normalize_fqdn(name)
+        with self._lock:
+            zone_id = f"/hostedzone/ZLOCAL{len(self.zones) + 1:08d}"
+            self.zones[zone_id] = {
+                "Id": zone_id,
+                "Name": name,
+                "Config": {"PrivateZone": private},
+            }
+            record_sets = [
+                {
+                    "Name": name,
+                    "Type": "NS",
+                    "TTL": 172800,
+                    "ResourceRecords": [{"Value": "ns-1.awsdns-00.com."}],
+                }
+            ]
+            record_sets.extend(
+                {
+                    "Name": f"host-{index}.{name}",
+                    "Type": "A",
+                    "TTL": 300,
+                    "ResourceRecords": [{"Value": f"10.{index % 256}.0.1"}],
+                }
+                for index in range(filler_records)
+            )
+            record_sets.sort(key=lambda rs: record_set_key(rs["Name"], rs["Type"]))
+            self._record_sets[zone_id] = record_sets
+            self._keys[zone_id] = [
+                record_set_key(rs["Name"], rs["Type"]) for rs in record_sets
+            ]
+        return zone_id
+
+    def _zone_id(self, hosted_zone_id: str) -> str:
+        if not hosted_zone_id.startswith("/hostedzone/"):
+            hosted_zone_id = f"/hostedzone/{hosted_zone_id}"
+        if hosted_zone_id not in self.zones:
+            raise LocalAWSError(
+                "NoSuchHostedZone", f"No hosted zone found with ID: {hosted_zone_id}"
+            )
+        return hosted_zone_id
+
+    def record_sets(self, hosted_zone_id: str) -> List[dict]:
+        with self._lock:
+            return list(self._record_sets[self._zone_id(hosted_zone_id)])
+
+    def list_hosted_zones(self, Marker=None, MaxItems=None):
+        page_size = min(int(MaxItems or 100), self.settings.zone_page_size)
+        with self._lock:
+            zones = list(self.zones.values())
+        start = next(
+            (index for index, zone in enumerate(zones) if zone["Id"] == Marker), 0
+        )
+        response = {
+            "HostedZones": zones[start : start + page_size],
+            "IsTruncated": start + page_size < len(zones),
+            "MaxItems": str(page_size),
+        }
+        if response["IsTruncated"]:
+            response["NextMarker"] = zones[start + page_size]["Id"]
+        return response
+
+    def list_resource_record_sets(
+        self,
+        HostedZoneId,
+        StartRecordName=None,
+        StartRecordType=None,
+        StartRecordIdentifier=None,
+        MaxItems=None,
+    ):
+        page_size = min(int(MaxItems or 300), self.settings.record_page_size)
+        with self._lock:
+            zone_id = self._zone_id(HostedZoneId)
+            keys = self._keys[zone_id]
+            record_sets = self._record_sets[zone_id]
+            start = 0
+            if StartRecordName:
+                start = bisect.bisect_left(
+                    keys, record_set_key(StartRecordName, StartRecordType or "")
+                )
+            page = record_sets[start : start + page_size]
+            response = {
+                "ResourceRecordSets": page,
+                "IsTruncated": start + page_size < len(record_sets),
+                "MaxItems": str(page_size),
+            }
+            if response["IsTruncated"]:
+                next_record_set = record_sets[start + page_size]
+                response["NextRecordName"] = next_record_set["Name"]
+                response["NextRecordType"] = next_record_set["Type"]
+        return response
+
+    def change_resource_record_sets(self, HostedZoneId, ChangeBatch):
+        changes = ChangeBatch["Changes"]
+        records = characters = 0
+        for change in changes:
+            values = change["ResourceRecordSet"].get("ResourceRecords", [])
+            weight = 2 if change["Action"] == "UPSERT" else 1
+            records += len(values) * weight
+            characters += sum(len(value["Value"]) for value in values) * weight
+        if records > MAX_RECORDS_PER_CHANGE_BATCH:
+            raise LocalAWSError(
+                "InvalidChangeBatch",
+                f"Number of records limit of {MAX_RECORDS_PER_CHANGE_BATCH} exceeded.",
+            )
+        if characters > MAX_VALUE_CHARACTERS_PER_CHANGE_BATCH:
+            raise LocalAWSError(
+                "InvalidChangeBatch",
+                "Number of characters limit of"
+                f" {MAX_VALUE_CHARACTERS_PER_CHANGE_BATCH} exceeded.",
+            )
+
+        with self._lock:
+            zone_id = self._zone_id(HostedZoneId)
+            keys = self._keys[zone_id]
+            record_sets = self._record_sets[zone_id]
+            # Validate the whole batch first, it is applied atomically
+            for change in changes:
+                record_set = change["ResourceRecordSet"]
+                key = record_set_key(record_set["Name"], record_set["Type"])
+                index = bisect.bisect_left(keys, key)
+                exists = index < len(keys) and keys[index] == key
+                if change["Action"] == "CREATE" and exists:
+                    raise LocalAWSError(
+                        "InvalidChangeBatch",
+                        "Tried to create resource record set"
+                        f" [name='{record_set['Name']}', type='{record_set['Type']}']"
+                        " but it already exists",
+                    )
+                if change["Action"] == "DELETE" and not exists:
+                    raise LocalAWSError(
+                        "InvalidChangeBatch",
+                        "Tried to delete resource record set"
+                        f" [name='{record_set['Name']}', type='{record_set['Type']}']"
+                        " but it was not found",
+                    )
+            for change in changes:
+                record_set = dict(change["ResourceRecordSet"])
+                record_set["Name"] = normalize_fqdn(record_set["Name"])
+                key = record_set_key(record_set["Name"], record_set["Type"])
+                index = bisect.bisect_left(keys, key)
+                exists = index < len(keys) and keys[index] == key
+                if change["Action"] == "DELETE":
+                    del keys[index]
+                    del record_sets[index]
+                elif exists:
+                    record_sets[index] = record_set
+                else:
+                    keys.insert(index, key)
+                    record_sets.insert(index, record_set)
+            change_id = f"/change/CLOCAL{len(self.changes) + 1:08d}"
+            self.changes[change_id] = {
+                "Id": change_id,
+                "Status": "PENDING",
+                "SubmittedAt": datetime.now(timezone.utc),
+                "PendingPolls": self.settings.propagation_polls,
+            }
+            return {"ChangeInfo": self._change_info(change_id)}
+
+    def _change_info(self, change_id: str) -> dict:
+        change = self.changes[change_id]
+        return {key: change[key] for key in ["Id", "Status", "SubmittedAt"]}
+
+    def get_change(self, Id):
+        change_id = Id if Id.startswith("/change/") else f"/change/{Id}"
+        with self._lock:
+            change = self.changes.get(change_id)
+            if change is None:
+                raise LocalAWSError(
+                    "NoSuchChange",
+                    f"A change with the specified change ID {Id} does not exist.",
+                )
+            if change["PendingPolls"] > 0:
+                change["PendingPolls"] -= 1
+            else:
+                change["Status"] = "INSYNC"
+            return {"ChangeInfo": self._change_info(change_id)}
+
+
+class LocalSES:
+    """Identities and receipt rule sets of an account in one region"""
+
+    def __init__(self, settings: LocalAWSSettings) -> None:
+        self.settings = settings
+        self._lock = threading.Lock()
+        self.identities: Dict[str, dict] = {}
+        self.rule_sets: Dict[str, List[dict]] = {}
+        self.active_rule_set: Optional[str] = None
+
+    def add_identity(
+        self,
+        name: str,
+        dkim_status: str = "Pending",
+        mail_from_domain: Optional[str] = None,
+        mail_from_status: str = "Pending",
+    ):
+        with self._lock:
+            self.identities[name] = {
+                "DkimTokens": self._dkim_tokens(name),
+                "DkimVerificationStatus": dkim_status,
+                "VerificationStatus": dkim_status,
+                "BehaviorOnMXFailure": "UseDefaultValue",
+            }
+            if mail_from_domain:
+                self.identities[name]["MailFromDomain"] = mail_from_domain
+                self.identities[name]["MailFromDomainStatus"] = mail_from_status
+
+    def set_status(
+        self,
+        name: str,
+        dkim: Optional[str] = None,
+        mail_from: Optional[str] = None,
+        verification: Optional[str] = None,
+    ):
+        """Move an identity along as SES would once its records are found"""
+        with self._lock:
+            identity = self.identities[name]
+            if dkim:
+                identity["DkimVerificationStatus"] = dkim
+            if mail_from:
+                identity["MailFromDomainStatus"] = mail_from
+            if verification:
+                identity["VerificationStatus"] = verification
+
+    @staticmethod
+    def _dkim_tokens(name: str) -> List[str]:
+        return [
+            hashlib.sha1(f"{name}-{index}".encode()).hexdigest()[:32]
+            for index in range(3)
+        ]
+
+    @staticmethod
+    def _check_identities(identities: List[str]):
+        if len(identities) > MAX_IDENTITIES_PER_REQUEST:
+            raise LocalAWSError(
+                "InvalidParameterValue",
+                f"At most {MAX_IDENTITIES_PER_REQUEST} identities can be requested.",
+            )
+
+    def verify_domain_dkim(self, Domain):
+        with self._lock:
+            identity = self.identities.setdefault(
+                Domain,
+                {
+                    "BehaviorOnMXFailure": "UseDefaultValue",
+                    "VerificationStatus": "Pending",
+                },
+            )
+            identity["DkimTokens"] = self._dkim_tokens(Domain)
+            identity["DkimVerificationStatus"] = "Pending"
+            return {"DkimTokens": list(identity["DkimTokens"])}
+
+    def get_identity_dkim_attributes(self, Identities):
+        self._check_identities(Identities)
+        with self._lock:
+            return {
+                "DkimAttributes": {
+                    name: {
+                        "DkimEnabled": True,
+                        "DkimTokens": list(self.identities[name]["DkimTokens"]),
+                        "DkimVerificationStatus": self.identities[name][
+                            "DkimVerificationStatus"
+                        ],
+                    }
+                    for name in Identities
+                    if "DkimTokens" in self.identities.get(name, {})
+                }
+            }
+
+    def get_identity_verification_attributes(self, Identities):
+        self._check_identities(Identities)
+        with self._lock:
+            return {
+                "VerificationAttributes": {
+                    name: {
+                        "VerificationStatus": self.identities[name][
+                            "VerificationStatus"
+                        ]
+                    }
+                    for name in Identities
+                    if "VerificationStatus" in self.identities.get(name, {})
+                }
+            }
+
+    def get_identity_mail_from_domain_attributes(self, Identities):
+        self._check_identities(Identities)
+        with self._lock:
+            attributes = {}
+            for name in Identities:
+                identity = self.identities.get(name)
+                if identity is None:
+                    continue
+                attributes[name] = {
+                    key: identity[key]
+                    for key in [
+                        "MailFromDomain",
+                        "MailFromDomainStatus",
+                        "BehaviorOnMXFailure",
+                    ]
+                    if key in identity
+                }
+            return {"MailFromDomainAttributes": attributes}
+
+    def set_identity_mail_from_domain(
+        self, Identity, MailFromDomain=None, BehaviorOnMXFailure="UseDefaultValue"
+    ):
+        with self._lock:
+            if Identity not in self.identities:
+                raise LocalAWSError(
+                    "InvalidParameterValue", f"Identity <{Identity}> does not exist."
+                )
+            identity = self.identities[Identity]
+            identity["BehaviorOnMXFailure"] = BehaviorOnMXFailure
+            identity.pop("MailFromDomain", None)
+            identity.pop("MailFromDomainStatus", None)
+            if MailFromDomain:
+                identity["MailFromDomain"] = MailFromDomain
+                identity["MailFromDomainStatus"] = "Pending"
+        return {}
+
+    def delete_identity(self, Identity):
+        with self._lock:
+            self.identities.pop(Identity, None)
+        return {}
+
+    def _rules(self, rule_set_name: str) -> List[dict]:
+        if rule_set_name not in self.rule_sets:
+            raise LocalAWSError(
+                "RuleSetDoesNotExist", f"Rule set does not exist: {rule_set_name}"
+            )
+        return self.rule_sets[rule_set_name]
+
+    @staticmethod
+    def _check_rule(rule: dict):
+        if len(rule.get("Recipients", [])) > MAX_RECIPIENTS_PER_RULE:
+            raise LocalAWSError(
+                "InvalidParameterValue",
+                f"A rule can have at most {MAX_RECIPIENTS_PER_RULE} recipients.",
+            )
+
+    def create_receipt_rule_set(self, RuleSetName):
+        with self._lock:
+            if RuleSetName in self.rule_sets:
+                raise LocalAWSError(
+                    "AlreadyExists", f"Rule set already exists: {RuleSetName}"
+                )
+            if len(self.rule_sets) >= MAX_RECEIPT_RULE_SETS:
+                raise LocalAWSError(
+                    "LimitExceeded",
+                    f"Maximum number of rule sets ({MAX_RECEIPT_RULE_SETS}) reached.",
+                )
+            self.rule_sets[RuleSetName] = []
+        return {}
+
+    def create_receipt_rule(self, RuleSetName, Rule, After=None):
+        self._check_rule(Rule)
+        with self._lock:
+            rules = self._rules(RuleSetName)
+            if any(rule["Name"] == Rule["Name"] for rule in rules):
+                raise LocalAWSError(
+                    "AlreadyExists", f"Rule already exists: {Rule['Name']}"
+                )
+            if len(rules) >= MAX_RECEIPT_RULES:
+                raise LocalAWSError(
+                    "LimitExceeded",
+                    f"Maximum number of rules ({MAX_RECEIPT_RULES}) reached.",
+                )
+            # without After the rule goes first, like in SES
+            index = 0
+            if After is not None:
+                names = [rule["Name"] for rule in rules]
+                if After not in names:
+                    raise LocalAWSError(
+                        "RuleDoesNotExist", f"Rule does not exist: {After}"
+                    )
+                index = names.index(After) + 1
+            rules.insert(index, dict(Rule))
+        return {}
+
+    def update_receipt_rule(self, RuleSetName, Rule):
+        self._check_rule(Rule)
+        with self._lock:
+            rules = self._rules(RuleSetName)
+            for index, rule in enumerate(rules):
+                if rule["Name"] == Rule["Name"]:
+                    rules[index] = dict(Rule)
+                    return {}
+        raise LocalAWSError("RuleDoesNotExist", f"Rule does not exist: {Rule['Name']}")
+
+    def delete_receipt_rule(self, RuleSetName, RuleName):
+        with self._lock:
+            rules = self._rules(RuleSetName)
+            rules[:] = [rule for rule in rules if rule["Name"] != RuleName]
+        return {}
+
+    def delete_receipt_rule_set(self, RuleSetName):
+        with self._lock:
+            if RuleSetName == self.active_rule_set:
+                raise LocalAWSError(
+                    "CannotDelete", f"Cannot delete active rule set: {RuleSetName}"
+                )
+            self.rule_sets.pop(RuleSetName, None)
+        return {}
+
+    def list_receipt_rule_sets(self, NextToken=None):
+        with self._lock:
+            names = sorted(self.rule_sets)
+        start = int(NextToken or 0)
+        page = names[start : start + RULE_SET_PAGE_SIZE]
+        response = {"RuleSets": [{"Name": name} for name in page]}
+        if start + RULE_SET_PAGE_SIZE < len(names):
+            response["NextToken"] = str(start + RULE_SET_PAGE_SIZE)
+        return response
+
+    def describe_receipt_rule_set(self, RuleSetName):
+        with self._lock:
+            return {
+                "Metadata": {"Name": RuleSetName},
+                "Rules": [dict(rule) for rule in self._rules(RuleSetName)],
+            }
+
+    def describe_active_receipt_rule_set(self):
+        with self._lock:
+            if self.active_rule_set is None:
+                return {}
+            return {
+                "Metadata": {"Name": self.active_rule_set},
+                "Rules": [dict(rule) for rule in self.rule_sets[self.active_rule_set]],
+            }
+
+    def set_active_receipt_rule_set(self, RuleSetName=None):
+        with self._lock:
+            if RuleSetName is not None:
+                self._rules(RuleSetName)
+            self.active_rule_set = RuleSetName
+        return {}
+
+
+class LocalSTS:
+    def __init__(self, account: str) -> None:
+        self.account = account
+        self.assumed_roles: Counter = Counter()
+
+    def assume_role(
+        self, RoleArn, RoleSessionName, DurationSeconds=3600, ExternalId=None
+    ):
+        self.assumed_roles[RoleArn] += 1
+        expiration = datetime.now(timezone.utc) + timedelta(seconds=DurationSeconds)
+        return {
+            "Credentials": {
+                "AccessKeyId": "ASIALOCAL",
+                "SecretAccessKey": "local",
+                "SessionToken": RoleSessionName,
+                "Expiration": expiration,
+            },
+            "AssumedRoleUser": {
+                "AssumedRoleId": f"LOCAL:{RoleSessionName}",
+                "Arn": f"{RoleArn}/{RoleSessionName}",
+            },
+        }
+
+    def get_caller_identity(self):
+        return {
+            "Account": self.account,
+            "Arn": f"arn:aws:iam::{self.account}:user/local",
+            "UserId": "LOCAL",
+        }
+
+
+@dataclass
+class _ClientMeta:
+    service_model: object
+    events: HierarchicalEmitter
+
+
+class LocalClient:
+    """A boto3-like client answering from a LocalSES or LocalRoute53
+
+    Calls go through the same botocore events as a real client (before-call,
+    before-send, needs-retry, after-call), so rate limiting and metrics hooks
+    behave as they do against AWS, retries included.
+    """
+
+    def __init__(
+        self, local: "LocalAWS", service: str, backend, max_attempts: int
+    ) -> None:
+        model = service_model(service)
+        self.local = local
+        self.service = service
+        self.backend = backend
+        self.max_attempts = max_attempts
+        self.meta = _ClientMeta(model, HierarchicalEmitter())
+        self._operations = {
+            botocore.xform_name(name): name for name in model.operation_names
+        }
+
+    def __getattr__(self, name: str):
+        if name not in self._operations or not hasattr(self.backend, name):
+            raise AttributeError(f"{self.service} stand-in has no operation {name}")
+        operation_name = self._operations[name]
+
+        def call(**params):
+            return self._make_call(operation_name, getattr(self.backend, name), params)
+
+        return call
+
+    def _make_call(self, operation_name: str, handler, params: dict):
+        model = self.meta.service_model.operation_model(operation_name)
+        events = self.meta.events
+        event_suffix = (
+            f"{self.meta.service_model.service_id.hyphenize()}.{operation_name}"
+        )
+        context: dict = {}
+        events.emit(
+            f"before-call.{event_suffix}", model=model, params=params, context=context
+        )
+        attempts = 0
+        while True:
+            attempts += 1
+            events.emit(f"before-send.{event_suffix}", request=None)
+            try:
+                self.local.request(self.service, operation_name)
+                status, parsed = 200, handler(**params)
+            except LocalAWSError as error:
+                status = error.status
+                parsed = {"Error": {"Code": error.code, "Message": error.message}}
+            parsed.setdefault("ResponseMetadata", {})["HTTPStatusCode"] = status
+            http_response = AWSResponse(f"local://{self.service}", status, {}, None)
+            _, delay = events.emit_until_response(
+                f"needs-retry.{event_suffix}",
+                response=(http_response, parsed),
+                endpoint=None,
+                operation=model,
+                attempts=attempts,
+                caught_exception=None,
+                request_dict=params,
+            )
+            if delay is None or attempts >= self.max_attempts:
+                break
+            time.sleep(delay)
+        events.emit(
+            f"after-call.{event_suffix}",
+            http_response=http_response,
+            parsed=parsed,
+            model=model,
+            context=context,
+        )
+        if "Error" in parsed:
+            raise ClientError(parsed, operation_name)
+        return parsed
+
+
+class LocalAWS:
+    """In-process stand-in for the SES and Route53 operations of the repositories
+
+    Route53 and STS are global and SES is kept per region, like in AWS. Every request
+    is counted per operation, takes the configured latency, and is throttled
+    once a service goes over the configured rate.
+    """
+
+    def __init__(
+        self, settings: Optional[LocalAWSSettings] = None, region: str = "us-east-1"
+    ) -> None:
+        self.settings = settings or LocalAWSSettings()
+        self.region = region
+        self.route53 = LocalRoute53(self.settings)
+        self.sts = LocalSTS(LOCAL_ACCOUNT)
+        self._ses: Dict[str, LocalSES] = {}
+        self._lock = threading.Lock()
+        self.calls: Counter = Counter()
+        self.throttled: Counter = Counter()
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    def ses(self, region: Optional[str] = None) -> LocalSES:
+        with self._lock:
+            region = region or self.region
+            if region not in self._ses:
+                self._ses[region] = LocalSES(self.settings)
+            return self._ses[region]
+
+    def client(self, service_name: str, region_name=None, config=None, **kwargs):
+        if service_name == "route53":
+            backend = self.route53
+        elif service_name == "ses":
+            backend = self.ses(region_name)
+        elif service_name == "sts":
+            backend = self.sts
+        else:
+            raise ValueError(f"{service_name} has no local stand-in")
+        retries = getattr(config, "retries", None) or {}
+        max_attempts = retries.get("total_max_attempts", 3)
+        return LocalClient(self, service_name, backend, max_attempts)
+
+    def request(self, service: str, operation_name: str):
+        """Account for a request, raising Throttling when over the rate"""
+        with self._lock:
+            self.calls[operation_name] += 1
+            throttled = not self._admit(service)
+            if throttled:
+                self.throttled[operation_name] += 1
+        if self.settings.latency:
+            time.sleep(self.settings.latency)
+        if throttled:
+            raise LocalAWSError("Throttling", "Rate exceeded")
+
+    def _admit(self, service: str) -> bool:
+        rate = self.settings.throttle_rate
+        if not rate:
+            return True
+        burst = self.settings.throttle_burst or rate
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(service, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        admitted = tokens >= 1
+        self._buckets[service] = (tokens - 1 if admitted else tokens, now)
+        return admitted
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    @contextmanager
+    def patched(self) -> Iterator["LocalAWS"]:
+        """Make every boto3 session answer from the stand-in"""
+        with (
+            patch("boto3.session.Session.client", side_effect=self.client),
+            patch(
+                "boto3.session.Session.region_name",
+                new_callable=PropertyMock,
+                return_value=self.region,
+            ),
+        ):
+            yield self
@@ -1,11 +1,64 @@
 import argparse
+import contextlib
+import json
+import sqlite3
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
 import botocore
 
-from aws import validate_region
-from ses_actions import SESActions
+from accounts import (
+    DEFAULT_ACCOUNT_WORKERS,
+    AccountEntry,
+    AccountResult,
+    read_manifest,
+    run_accounts,
+)
+from aws import (
+    configure_clients,
+    get_current_account,
+    get_current_region,
+    use_credentials,
+    validate_region,
+)
+from batch import DEFAULT_WORKERS, BatchSummary, DomainResult, read_domains, run_batch
+from cache import state_cache
+from dns_provider import DNSProvider, DNSProviders, Route53Provider
+from exceptions import CerbyException, ConfigurationException
+from export import RecordExporter, export_format
+from journal import Journal
+from metrics import Profiler, metrics
+from plan import Applier, Plan, Planner
+from propagation import DEFAULT_WAIT_TIMEOUT, INSYNC, ChangeTracker
+from ratelimit import configure_rate_limits, limiter, parse_rate
+from regions import parse_regions, run_regions
+from report import STDOUT, EventWriter
+from rfc2136 import RFC2136Provider, read_zones
+from ses_actions import MAX_PARALLEL_STEPS, SESActions
+from teardown import Teardown
 from utils import aws_error, print_banner, prints
+from watch import DEFAULT_WATCH_TIMEOUT, IdentityWatcher
+
+# Functions listed when printing a profile
+PROFILE_HOT_PATHS = 25
+
+# Errors reported as a message, anything else is a bug and keeps its traceback.
+# Input files that can not be read raise OSError, malformed ones ValueError.
+REPORTED_ERRORS = (
+    CerbyException,
+    botocore.exceptions.BotoCoreError,
+    OSError,
+    ValueError,
+)
+
+
+def parse_export(path: str):
+    try:
+        export_format(path)
+    except ConfigurationException as error:
+        raise argparse.ArgumentTypeError(str(error))
+    return path
 
 
 def get_args():
@@ -13,40 +66,791 @@ def get_args():
         description="Set AWS SES Service to be integrated with Cerby"
     )
     parser.add_argument(
-        "domain", type=str, help="Domain to configure, e.g. cerby.company.com"
+        "domain",
+        type=str,
+        nargs="?",
+        help="Domain to configure, e.g. cerby.company.com",
+    )
+    parser.add_argument(
+        "--domains-file",
+        type=argparse.FileType("r"),
+        help="File with one domain per line to configure in batch, - for stdin",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Domains configured at once in batch mode (default {DEFAULT_WORKERS})",
+    )
+    parser.add_argument(
+        "--regions",
+        metavar="REGION,...",
+        type=parse_regions,
+        help="Set the domains up in every one of these regions at once, e.g."
+        " us-east-1,eu-west-1,ca-central-1",
+    )
+    parser.add_argument(
+        "--accounts",
+        metavar="FILE",
+        help="JSON manifest of customer accounts, each with the role ARN and"
+        " ExternalId of its CerbyRole and the domains to configure with it",
+    )
+    parser.add_argument(
+        "--account-workers",
+        type=int,
+        default=DEFAULT_ACCOUNT_WORKERS,
+        help="Accounts onboarded at once with --accounts"
+        f" (default {DEFAULT_ACCOUNT_WORKERS})",
+    )
+    parser.add_argument(
+        "--processes",
+        action="store_true",
+        help="Onboard the --accounts on worker processes instead of threads",
+    )
+    parser.add_argument(
+        "--dns-zones",
+        metavar="FILE",
+        help="JSON list of zones outside Route53 to write the records to with"
+        " TSIG signed RFC 2136 dynamic updates, each with its server and key",
+    )
+    parser.add_argument(
+        "--plan",
+        metavar="FILE",
+        help="Only read the current state and write the changes to make to FILE",
+    )
+    parser.add_argument(
+        "--apply",
+        metavar="FILE",
+        help="Make the changes of a plan written by --plan",
+    )
+    parser.add_argument(
+        "--teardown",
+        action="store_true",
+        help="Offboard the domains, deleting the records, receipt rules, rule"
+        " sets and identities Cerby set up for them",
+    )
+    parser.add_argument(
+        "--delete-identities",
+        action="store_true",
+        help="With --teardown, delete the SES identities instead of only"
+        " resetting their MAIL FROM domain, when Cerby created them",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="With --teardown, only list what would be deleted",
+    )
+    parser.add_argument(
+        "--rate",
+        metavar="SERVICE=RPS",
+        type=parse_rate,
+        action="append",
+        default=[],
+        help="Requests per second allowed to an AWS service, e.g. route53=5",
+    )
+    parser.add_argument(
+        "--wait",
+        metavar="SECONDS",
+        type=float,
+        nargs="?",
+        const=DEFAULT_WAIT_TIMEOUT,
+        help="Wait for the Route53 changes to be in sync, at most SECONDS"
+        f" (default {DEFAULT_WAIT_TIMEOUT:.0f})",
+    )
+    parser.add_argument(
+        "--watch",
+        metavar="SECONDS",
+        type=float,
+        nargs="?",
+        const=DEFAULT_WATCH_TIMEOUT,
+        help="Only watch the SES identities until verified, at most SECONDS"
+        f" (default {DEFAULT_WATCH_TIMEOUT:.0f}), printing JSON lines",
+    )
+    parser.add_argument(
+        "--cache",
+        metavar="FILE",
+        help="Keep a snapshot of the AWS state in the SQLite FILE so repeat runs"
+        " only read what expired or changed",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        metavar="SECONDS",
+        type=float,
+        help="Seconds cached state is trusted, instead of the per-kind defaults",
+    )
+    parser.add_argument(
+        "--journal",
+        metavar="FILE",
+        help="Append every step of the batch to FILE as it finishes",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip the domains the --journal FILE has as done, retrying the rest",
+    )
+    parser.add_argument(
+        "--jsonl",
+        metavar="FILE",
+        help="Stream one JSON line per domain, pending record, Route53 change and"
+        " failure to FILE as they happen, - for stdout (the rest goes to stderr)",
+    )
+    parser.add_argument(
+        "--export",
+        metavar="FILE",
+        type=parse_export,
+        action="append",
+        default=[],
+        help="Write the records to add by hand to FILE instead of printing them,"
+        " as a zone file (.zone), CSV (.csv) or JSON (.json), grouped by zone;"
+        " may be given once per format",
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="FILE",
+        help="Write AWS API call and phase timings to FILE as JSON",
+    )
+    parser.add_argument(
+        "--prometheus",
+        metavar="FILE",
+        help="Write the same metrics to FILE in the Prometheus textfile format",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="Profile the run with cProfile, dump the stats to FILE",
     )
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.accounts and (
+        args.domain
+        or args.domains_file
+        or args.plan
+        or args.apply
+        or args.watch is not None
+        or args.regions
+        or args.journal
+        or args.cache
+    ):
+        parser.error(
+            "--accounts takes the domains from the manifest, it can not be"
+            " combined with other modes"
+        )
+    if (
+        not args.domain
+        and not args.domains_file
+        and not args.apply
+        and not args.accounts
+    ):
+        parser.error(
+            "either a domain, --domains-file, --apply or --accounts is required"
+        )
+    if args.resume and not args.journal:
+        parser.error("--resume requires --journal")
+    if args.regions and (
+        args.plan or args.apply or args.watch is not None or args.journal
+    ):
+        parser.error(
+            "--regions can not be combined with --plan, --apply, --watch or --journal"
+        )
+    if args.dry_run and not args.teardown:
+        parser.error("--dry-run requires --teardown")
+    if args.delete_identities and not args.teardown:
+        parser.error("--delete-identities requires --teardown")
+    if args.teardown and (
+        args.plan
+        or args.apply
+        or args.watch is not None
+        or args.regions
+        or args.accounts
+        or args.journal
+    ):
+        parser.error(
+            "--teardown can not be combined with --plan, --apply, --watch,"
+            " --regions, --accounts or --journal"
+        )
+    if args.dns_zones and (
+        args.plan
+        or args.apply
+        or args.watch is not None
+        or args.regions
+        or args.accounts
+    ):
+        parser.error(
+            "--dns-zones can not be combined with --plan, --apply, --watch,"
+            " --regions or --accounts"
+        )
+    if args.journal and not args.domains_file:
+        parser.error("--journal requires --domains-file")
+    if args.jsonl and args.processes:
+        parser.error(
+            "--jsonl can not be combined with --processes, worker processes do"
+            " not report domains as they complete"
+        )
+    return args
+
+
+def get_domains(args):
+    if args.domains_file:
+        return read_domains(args.domains_file)
+    return [args.domain]
+
+
+def get_dns_provider(args) -> Optional[DNSProvider]:
+    """The --dns-zones servers, then Route53 for every other domain"""
+    if not args.dns_zones:
+        return None
+    return DNSProviders(
+        [RFC2136Provider(read_zones(args.dns_zones)), Route53Provider()]
+    )
+
+
+def print_pending_records(records, exporter: Optional[RecordExporter] = None):
+    if exporter:
+        exporter.add(records)
+        prints(
+            f"{len(records)} records to add to your DNS service are exported to"
+            f" {', '.join(exporter.paths)}"
+        )
+        return
+    prints(
+        "Oops! We were unable to create the records,"
+        " please add these to your DNS service"
+    )
+    for record in records:
+        print(f"\t- {record.type}, {record.name}, {record.values}")
+
+
+def add_pending_records(records, exporter: Optional[RecordExporter] = None):
+    """Export the records of a domain as it is reported, or print them"""
+    if exporter:
+        exporter.add(records)
+        return
+    for record in records:
+        print(f"\t\t- {record.type}, {record.name}, {record.values}")
+
+
+def print_pending_total(count: int, exporter: Optional[RecordExporter] = None):
+    if not count:
+        return
+    if exporter:
+        prints(
+            f"{count} records to add to your DNS service are exported to"
+            f" {', '.join(exporter.paths)}"
+        )
+        return
+    prints(
+        f"Oops! We were unable to create {count} records,"
+        " please add the ones listed above to your DNS service"
+    )
+
+
+def print_domain_result(result: DomainResult, prefix: str = ""):
+    if not result.succeeded:
+        status = f"failed: {result.error}"
+    else:
+        status = "converged" if result.converged else "done"
+    name = f"{result.domain} in {result.region}" if result.region else result.domain
+    prints(f"{prefix}{name}: {status} ({result.elapsed:.1f}s)")
+
+
+def print_rate_limit_stats():
+    for service, stats in sorted(limiter.all_stats().items()):
+        if stats.calls:
+            print(
+                f"\t- {service}: {stats.calls} calls, {stats.retries} retries,"
+                f" {stats.throttles} throttled, waited"
+                f" {stats.wait_seconds + stats.backoff_seconds:.1f}s"
+            )
+
+
+def print_batch_summary(
+    summary: BatchSummary, exporter: Optional[RecordExporter] = None
+):
+    prints(
+        f"Configured {summary.domains} domains in {summary.elapsed:.1f}s,"
+        f" {summary.converged} converged, {summary.changed} changed,"
+        f" {len(summary.failed)} failed"
+    )
+    for result in summary.failed:
+        name = f"{result.domain} in {result.region}" if result.region else result.domain
+        print(f"\t- {name}: {result.error}")
+        for name, error in result.rules_failed_to_create.items():
+            print(f"\t\t- {name}: {error}")
+
+    if summary.changes:
+        prints(
+            f"Submitted {len(summary.changes)} Route53 change batches,"
+            f" {len(summary.failed_changes)} failed"
+        )
+    for change in summary.failed_changes:
+        print(f"\t- {', '.join(change.domains)}: {change.error}")
+
+    print_pending_total(summary.pending_records, exporter)
+
+    prints("AWS API usage:")
+    print_rate_limit_stats()
+
+
+def wait_for_changes(args, changes, events: Optional[EventWriter] = None) -> bool:
+    """Wait for the submitted changes when --wait is given, reporting each domain
+
+    Returns:
+        bool: False when some change is not in sync
+    """
+    if args.wait is None:
+        return True
+    tracker = ChangeTracker()
+    tracker.track(changes)
+    if not tracker.pending:
+        return True
+
+    def on_ready(domain: str):
+        print(f"\t- {domain} ready")
+        if events:
+            events.emit("in_sync", domain=domain)
+
+    prints(f"Waiting for {len(tracker.pending)} Route53 changes to be in sync:")
+    in_sync = tracker.wait(timeout=args.wait, on_ready=on_ready)
+    for domain, status in tracker.domain_status().items():
+        if status != INSYNC:
+            print(f"\t- {domain} {status.lower()}")
+            if events:
+                events.emit("not_in_sync", domain=domain, status=status)
+    return in_sync
+
+
+def main_batch(
+    args,
+    events: Optional[EventWriter] = None,
+    exporter: Optional[RecordExporter] = None,
+):
+    journal = None
+    try:
+        print_banner()
+        validate_region()
+        configure_clients(max_pool_connections=max(args.workers * 2, 10))
+        domains = read_domains(args.domains_file)
+        if args.journal:
+            journal = Journal(args.journal, get_current_region(), resume=args.resume)
+            domains = journal.pending(domains)
+
+        def on_result(result: DomainResult):
+            if journal:
+                journal.record_result(result)
+            if events:
+                events.domain_result(result)
+            print_domain_result(result)
+            add_pending_records(result.records_pending_to_create, exporter)
+
+        dns_provider = get_dns_provider(args)
+        summary = run_batch(
+            domains,
+            workers=args.workers,
+            on_result=on_result,
+            hzr_repo=dns_provider,
+            hz_repo=dns_provider,
+        )
+        if journal and journal.skipped:
+            prints(f"Skipped {journal.skipped} domains done in {args.journal}")
+        if events:
+            events.summary(summary)
+        print_batch_summary(summary, exporter)
+        in_sync = wait_for_changes(args, summary.changes, events)
+        print("\nThanks for using Cerby, have a nice day!\n")
+        sys.exit(1 if summary.failed or summary.failed_changes or not in_sync else 0)
+    except botocore.exceptions.NoCredentialsError as error:
+        aws_error(error)
+    except botocore.exceptions.ClientError as error:
+        aws_error(error.response["Error"]["Message"])
+        sys.exit(1)
+    except REPORTED_ERRORS as error:
+        aws_error(str(error))
+    finally:
+        if journal:
+            journal.close()
+
+
+def main_regions(
+    args,
+    events: Optional[EventWriter] = None,
+    exporter: Optional[RecordExporter] = None,
+):
+    try:
+        print_banner()
+        for region in args.regions:
+            validate_region(region)
+        workers = args.workers if args.domains_file else 1
+        configure_clients(max_pool_connections=max(workers * 2, 10))
+
+        def on_result(result: DomainResult):
+            if events:
+                events.domain_result(result)
+            print_domain_result(result)
+            add_pending_records(result.records_pending_to_create, exporter)
+
+        summary = run_regions(
+            get_domains(args), args.regions, workers=workers, on_result=on_result
+        )
+        if events:
+            events.summary(summary)
+        print_batch_summary(summary, exporter)
+        in_sync = wait_for_changes(args, summary.changes, events)
+        print("\nThanks for using Cerby, have a nice day!\n")
+        sys.exit(1 if summary.failed or summary.failed_changes or not in_sync else 0)
+    except botocore.exceptions.NoCredentialsError as error:
+        aws_error(error)
+    except botocore.exceptions.ClientError as error:
+        aws_error(error.response["Error"]["Message"])
+        sys.exit(1)
+    except REPORTED_ERRORS as error:
+        aws_error(str(error))
+
+
+def print_account_result(
+    result: AccountResult, exporter: Optional[RecordExporter] = None
+):
+    entry = result.entry
+    if result.error:
+        prints(f"Account {entry.account} failed: {result.error}")
+        return
+    summary = result.summary
+    prints(
+        f"Account {entry.account}: {summary.domains} domains in"
+        f" {result.elapsed:.1f}s, {summary.converged} converged,"
+        f" {summary.changed} changed, {len(summary.failed)} failed"
+    )
+    for domain in summary.failed:
+        print(f"\t- {domain.domain}: {domain.error}")
+    for change in summary.failed_changes:
+        print(f"\t- {', '.join(change.domains)}: {change.error}")
+    if result.records_pending_to_create:
+        print_pending_records(result.records_pending_to_create, exporter)
+    else:
+        print_pending_total(summary.pending_records, exporter)
+
+
+def main_accounts(
+    args,
+    events: Optional[EventWriter] = None,
+    exporter: Optional[RecordExporter] = None,
+):
+    try:
+        print_banner()
+        validate_region()
+        entries = read_manifest(args.accounts)
+        configure_clients(
+            max_pool_connections=max(args.workers * args.account_workers * 2, 10)
+        )
+
+        def on_result(entry: AccountEntry, result: DomainResult):
+            print_domain_result(result, prefix=f"Account {entry.account}, ")
+            add_pending_records(result.records_pending_to_create, exporter)
+            if events:
+                events.domain_result(result)
+
+        results = run_accounts(
+            entries,
+            account_workers=args.account_workers,
+            workers=args.workers,
+            on_result=None if args.processes else on_result,
+            processes=args.processes,
+            rates=dict(args.rate),
+        )
+        for result in results:
+            print_account_result(result, exporter)
+            if result.summary and events:
+                events.summary(result.summary)
+        prints("AWS API usage:")
+        print_rate_limit_stats()
+        in_sync = True
+        for result in results:
+            if result.summary:
+                # the changes are read back with the role that made them
+                with use_credentials(result.entry.role):
+                    if not wait_for_changes(args, result.summary.changes, events):
+                        in_sync = False
+        print("\nThanks for using Cerby, have a nice day!\n")
+        succeeded = all(result.succeeded for result in results)
+        sys.exit(0 if succeeded and in_sync else 1)
+    except botocore.exceptions.NoCredentialsError as error:
+        aws_error(error)
+    except botocore.exceptions.ClientError as error:
+        aws_error(error.response["Error"]["Message"])
+        sys.exit(1)
+    except REPORTED_ERRORS as error:
+        aws_error(str(error))
+
+
+def print_plan(plan: Plan):
+    prints(
+        f"Plan for {len(plan.domains)} domains in {plan.region},"
+        f" {len(plan.converged)} already converged:"
+    )
+    for change, count in sorted(plan.summary().items()):
+        print(f"\t- {change}: {count}")
+    for domain, error in plan.errors.items():
+        print(f"\t- {domain} failed: {error}")
+
+
+def print_event(event: dict):
+    print(json.dumps(event), flush=True)
+
+
+def main_watch(args, events: Optional[EventWriter] = None):
+    try:
+        validate_region()
+        result = IdentityWatcher().watch(
+            get_domains(args),
+            timeout=args.watch,
+            on_event=events.write if events else print_event,
+        )
+        sys.exit(0 if result.converged else 1)
+    except botocore.exceptions.NoCredentialsError as error:
+        aws_error(error)
+    except botocore.exceptions.ClientError as error:
+        aws_error(error.response["Error"]["Message"])
+        sys.exit(1)
+    except REPORTED_ERRORS as error:
+        aws_error(str(error))
+
+
+def main_plan(args):
+    try:
+        print_banner()
+        validate_region()
+        configure_clients(max_pool_connections=max(args.workers * 2, 10))
+        plan = Planner(workers=args.workers).plan(get_domains(args))
+        plan.save(args.plan)
+        print_plan(plan)
+        prints(f"{len(plan.changes)} changes written to {args.plan}")
+        sys.exit(1 if plan.errors else 0)
+    except botocore.exceptions.NoCredentialsError as error:
+        aws_error(error)
+    except botocore.exceptions.ClientError as error:
+        aws_error(error.response["Error"]["Message"])
+        sys.exit(1)
+    except REPORTED_ERRORS as error:
+        aws_error(str(error))
+
+
+def main_apply(args, exporter: Optional[RecordExporter] = None):
+    try:
+        print_banner()
+        plan = Plan.load(args.apply)
+        if plan.region != get_current_region():
+            raise ConfigurationException(
+                f"Plan was made for {plan.region}, current region is"
+                f" {get_current_region()}"
+            )
+        configure_clients(max_pool_connections=max(args.workers * 2, 10))
+        print_plan(plan)
+        result = Applier(workers=args.workers).apply(plan)
+        prints(
+            f"Applied {len(plan.changes)} changes,"
+            f" {len(result.changes)} Route53 change batches submitted"
+        )
+        if result.failures:
+            prints("Failed to apply the following changes:")
+            for name, error in result.failures.items():
+                print(f"\t- {name}: {error}")
+        if result.records_pending_to_create:
+            print_pending_records(result.records_pending_to_create, exporter)
+        prints("AWS API usage:")
+        print_rate_limit_stats()
+        in_sync = wait_for_changes(args, result.changes)
+        print("\nThanks for using Cerby, have a nice day!\n")
+        sys.exit(1 if result.failures or not in_sync else 0)
+    except botocore.exceptions.NoCredentialsError as error:
+        aws_error(error)
+    except botocore.exceptions.ClientError as error:
+        aws_error(error.response["Error"]["Message"])
+        sys.exit(1)
+    except REPORTED_ERRORS as error:
+        aws_error(str(error))
+
+
+def main_teardown(args, events: Optional[EventWriter] = None):
+    try:
+        print_banner()
+        validate_region()
+        configure_clients(max_pool_connections=max(args.workers * 2, 10))
+        dns_provider = get_dns_provider(args)
+        teardown = Teardown(
+            workers=args.workers,
+            hz_repo=dns_provider,
+            hzr_repo=dns_provider,
+            delete_identities=args.delete_identities,
+        )
+        plan = teardown.plan(get_domains(args))
+        prints(f"Teardown of {len(plan.domains)} domains in {plan.region}:")
+        for action in plan.changes:
+            print(
+                f"\t- {action.domain}: {action.action.lower()} {action.kind}"
+                f" {action.target}"
+            )
+            if events:
+                events.emit(
+                    "teardown",
+                    domain=action.domain,
+                    kind=action.kind,
+                    action=action.action,
+                    target=action.target,
+                    status="planned" if args.dry_run else "deleting",
+                )
+        for domain, error in plan.errors.items():
+            print(f"\t- {domain} failed: {error}")
+            if events:
+                events.emit("teardown_failed", domain=domain, error=error)
+        if args.dry_run:
+            prints(f"Dry run, {len(plan.changes)} resources would be deleted")
+            sys.exit(1 if plan.errors else 0)
+        result = teardown.apply(plan)
+        prints(
+            f"Deleted the resources of {len(plan.domains)} domains,"
+            f" {len(result.changes)} Route53 change batches submitted"
+        )
+        if events:
+            events.changes(result.changes)
+        if result.failures:
+            prints("Failed to delete the following resources:")
+            for name, error in result.failures.items():
+                print(f"\t- {name}: {error}")
+                if events:
+                    events.emit("teardown_failed", target=name, error=error)
+        prints("AWS API usage:")
+        print_rate_limit_stats()
+        in_sync = wait_for_changes(args, result.changes, events)
+        sys.exit(1 if plan.errors or result.failures or not in_sync else 0)
+    except botocore.exceptions.NoCredentialsError as error:
+        aws_error(error)
+    except botocore.exceptions.ClientError as error:
+        aws_error(error.response["Error"]["Message"])
+        sys.exit(1)
+    except REPORTED_ERRORS as error:
+        aws_error(str(error))
+
+
+def write_metrics(args, profiler: Optional[Profiler] = None):
+    if profiler:
+        stats = profiler.stop()
+        if stats:
+            stats.dump_stats(args.profile)
+            prints(f"Hot paths, full profile written to {args.profile}:")
+            stats.sort_stats("cumulative").print_stats(PROFILE_HOT_PATHS)
+    if args.metrics:
+        metrics.write_json(args.metrics)
+    if args.prometheus:
+        metrics.write_prometheus(args.prometheus)
+
+
+def open_state_cache(args):
+    """Open the --cache file of the current account and region, or exit"""
+    try:
+        state_cache.open(
+            args.cache, get_current_account(), get_current_region(), args.cache_ttl
+        )
+    except botocore.exceptions.NoCredentialsError as error:
+        aws_error(error)
+        sys.exit(1)
+    except botocore.exceptions.ClientError as error:
+        aws_error(error.response["Error"]["Message"])
+        sys.exit(1)
+    except (botocore.exceptions.BotoCoreError, sqlite3.Error, OSError) as error:
+        aws_error(str(error))
+        sys.exit(1)
 
 
 def main():
     args = get_args()
+    configure_rate_limits(dict(args.rate))
+    profiler = Profiler() if args.profile else None
+    if profiler:
+        profiler.start()
+    events = EventWriter.open(args.jsonl) if args.jsonl else None
+    exporter = RecordExporter(args.export) if args.export else None
+    # keep stdout for the events, the human output goes to stderr
+    human = contextlib.redirect_stdout(sys.stderr)
+    try:
+        with human if args.jsonl == STDOUT else contextlib.nullcontext():
+            if args.cache:
+                open_state_cache(args)
+            if args.apply:
+                return main_apply(args, exporter)
+            if args.watch is not None:
+                return main_watch(args, events)
+            if args.plan:
+                return main_plan(args)
+            if args.teardown:
+                return main_teardown(args, events)
+            if args.regions:
+                return main_regions(args, events, exporter)
+            if args.accounts:
+                return main_accounts(args, events, exporter)
+            if args.domains_file:
+                return main_batch(args, events, exporter)
+            return main_single(args, events, exporter)
+    finally:
+        if events:
+            events.close()
+        if exporter:
+            exporter.write()
+            exporter.close()
+        state_cache.close()
+        write_metrics(args, profiler)
+
+
+def main_single(
+    args,
+    events: Optional[EventWriter] = None,
+    exporter: Optional[RecordExporter] = None,
+):
     collected_records = []
     failed_rules = {}
+    result = DomainResult(domain=args.domain)
     try:
         print_banner()
         validate_region()
-        ses_actions = SESActions(domain=args.domain)
-        ses_actions.configure_sending_email()
-        ses_actions.configure_receiving_email()
-        ses_actions.configure_mail_from_domain()
-        collected_records = ses_actions.records_pending_to_create
-        ses_actions.configure_email_receiving_rules()
-        failed_rules = ses_actions.rules_failed_to_create
-        sys.exit(0)
+        with metrics.phase("domain", args.domain):
+            dns_provider = get_dns_provider(args)
+            ses_actions = SESActions(
+                domain=args.domain, hz_repo=dns_provider, hzr_repo=dns_provider
+            )
+            result.converged = ses_actions.is_converged()
+            if result.converged:
+                prints(f"{args.domain} is already configured, nothing to change")
+                if events:
+                    events.domain_result(result)
+                return
+            collected_records = ses_actions.records_pending_to_create
+            failed_rules = ses_actions.rules_failed_to_create
+            with ThreadPoolExecutor(max_workers=MAX_PARALLEL_STEPS) as executor:
+                ses_actions.configure(executor)
+            ses_actions.apply_record_changes()
+            ses_actions.apply_rule_changes()
+        if events:
+            result.records_pending_to_create = collected_records
+            result.rules_failed_to_create = failed_rules
+            events.domain_result(result)
+            events.changes(ses_actions.changes)
+        in_sync = wait_for_changes(args, ses_actions.changes, events)
+        sys.exit(0 if in_sync else 1)
     except botocore.exceptions.NoCredentialsError as error:
+        result.error = str(error)
         aws_error(error)
     except botocore.exceptions.ClientError as error:
+        result.error = error.response["Error"]["Message"]
         aws_error(error.response["Error"]["Message"])
         sys.exit(1)
-    except Exception as error:
+    except REPORTED_ERRORS as error:
+        result.error = str(error)
         aws_error(str(error))
     finally:
+        if events and result.error:
+            result.records_pending_to_create = collected_records
+            result.rules_failed_to_create = failed_rules
+            events.domain_result(result)
+
         if collected_records:
-            prints(
-                "Oops! We were unable to create the records, please add these to your DNS service"
-            )
-            for record in collected_records:
-                print(f"\t- {record.type}, {record.name}, {record.values}")
+            print_pending_records(collected_records, exporter)
 
         if failed_rules:
             prints("Failed to create the following rules:")
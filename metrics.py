@@ -0,0 +1,350 @@
+import cProfile
+import functools
+import json
+import math
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from ratelimit import THROTTLING_ERROR_CODES, limiter
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = [0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, math.inf]
+
+METRIC_PREFIX = "cerby_ses"
+
+
+@dataclass
+class OperationMetrics:
+    calls: int = 0
+    attempts: int = 0
+    errors: int = 0
+    throttles: int = 0
+    latency_seconds: float = 0.0
+    latency_buckets: List[int] = field(
+        default_factory=lambda: [0] * len(LATENCY_BUCKETS)
+    )
+
+    @property
+    def retries(self) -> int:
+        return max(self.attempts - self.calls, 0)
+
+    def observe(self, latency: float):
+        self.latency_seconds += latency
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                self.latency_buckets[index] += 1
+                break
+
+    def merge(self, other: "OperationMetrics"):
+        self.calls += other.calls
+        self.attempts += other.attempts
+        self.errors += other.errors
+        self.throttles += other.throttles
+        self.latency_seconds += other.latency_seconds
+        self.latency_buckets = [
+            count + other_count
+            for count, other_count in zip(self.latency_buckets, other.latency_buckets)
+        ]
+
+
+@dataclass
+class PhaseMetrics:
+    count: int = 0
+    seconds: float = 0.0
+    max_seconds: float = 0.0
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def merge(self, other: "PhaseMetrics"):
+        self.count += other.count
+        self.seconds += other.seconds
+        self.max_seconds = max(self.max_seconds, other.max_seconds)
+
+
+@dataclass
+class MetricsState:
+    """The metrics recorded by a worker process, sent back to the parent"""
+
+    operations: Dict[Tuple[str, str], OperationMetrics] = field(default_factory=dict)
+    phases: Dict[str, PhaseMetrics] = field(default_factory=dict)
+    domains: Dict[str, Dict[str, float]] = field(default_factory=dict)
+
+
+class Metrics:
+    """AWS API call and phase timings of a run
+
+    Calls are recorded through botocore events of every client the registry
+    builds: count, latency histogram, attempts and throttles per operation.
+    Phases are timed with the phase context manager or the timed decorator,
+    both in aggregate and per domain.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.operations: Dict[Tuple[str, str], OperationMetrics] = {}
+        self.phases: Dict[str, PhaseMetrics] = {}
+        self.domains: Dict[str, Dict[str, float]] = {}
+
+    def reset(self):
+        with self._lock:
+            self.operations.clear()
+            self.phases.clear()
+            self.domains.clear()
+
+    def take(self) -> MetricsState:
+        """Hand over what was recorded so far, recording starts again empty"""
+        with self._lock:
+            state = MetricsState(self.operations, self.phases, self.domains)
+            self.operations, self.phases, self.domains = {}, {}, {}
+        return state
+
+    def merge(self, state: MetricsState):
+        """Add the metrics recorded by another process"""
+        with self._lock:
+            for key, operation in state.operations.items():
+                self.operations.setdefault(key, OperationMetrics()).merge(operation)
+            for name, phase in state.phases.items():
+                self.phases.setdefault(name, PhaseMetrics()).merge(phase)
+            for domain, phases in state.domains.items():
+                merged = self.domains.setdefault(domain, {})
+                for name, seconds in phases.items():
+                    merged[name] = merged.get(name, 0.0) + seconds
+
+    def operation(self, service: str, operation: str) -> OperationMetrics:
+        with self._lock:
+            return self.operations.setdefault((service, operation), OperationMetrics())
+
+    def attach(self, client, service: str):
+        """Record the calls of a boto3 client
+
+        Args:
+            client: The boto3 client
+            service (str): Service name of the client, e.g. route53
+        """
+        service_id = client.meta.service_model.service_id.hyphenize()
+
+        def on_call(model=None, context=None, **kwargs):
+            if context is not None:
+                context["metrics_started"] = time.perf_counter()
+
+        def on_send(event_name="", **kwargs):
+            operation = self.operation(service, event_name.rsplit(".", 1)[-1])
+            with self._lock:
+                operation.attempts += 1
+
+        def on_needs_retry(response=None, operation=None, **kwargs):
+            if response is None or operation is None:
+                return None
+            if response[1].get("Error", {}).get("Code") in THROTTLING_ERROR_CODES:
+                metrics = self.operation(service, operation.name)
+                with self._lock:
+                    metrics.throttles += 1
+            return None
+
+        def on_after_call(model=None, context=None, parsed=None, **kwargs):
+            self._finish_call(service, model, context, "Error" in (parsed or {}))
+
+        def on_after_call_error(model=None, context=None, **kwargs):
+            self._finish_call(service, model, context, True)
+
+        events = client.meta.events
+        events.register(f"before-call.{service_id}", on_call)
+        events.register(f"before-send.{service_id}", on_send)
+        events.register(f"needs-retry.{service_id}", on_needs_retry)
+        events.register(f"after-call.{service_id}", on_after_call)
+        events.register(f"after-call-error.{service_id}", on_after_call_error)
+
+    def _finish_call(self, service: str, model, context: Optional[dict], error: bool):
+        if model is None:
+            return
+        started = (context or {}).get("metrics_started")
+        latency = time.perf_counter() - started if started else 0.0
+        operation = self.operation(service, model.name)
+        with self._lock:
+            operation.calls += 1
+            operation.errors += int(error)
+            operation.observe(latency)
+
+    @contextmanager
+    def phase(self, name: str, domain: Optional[str] = None) -> Iterator[None]:
+        """Time a block of work
+
+        Args:
+            name (str): Name of the phase, e.g. configure_sending_email
+            domain (str, optional): Domain the work is done for
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            with self._lock:
+                self.phases.setdefault(name, PhaseMetrics()).observe(seconds)
+                if domain:
+                    phases = self.domains.setdefault(domain, {})
+                    phases[name] = phases.get(name, 0.0) + seconds
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                "operations": [
+                    {
+                        "service": service,
+                        "operation": operation,
+                        "calls": metrics.calls,
+                        "retries": metrics.retries,
+                        "throttles": metrics.throttles,
+                        "errors": metrics.errors,
+                        "latency_seconds": round(metrics.latency_seconds, 6),
+                        "latency_buckets": {
+                            str(bound): count
+                            for bound, count in zip(
+                                LATENCY_BUCKETS, metrics.latency_buckets
+                            )
+                        },
+                    }
+                    for (service, operation), metrics in sorted(self.operations.items())
+                ],
+                "phases": {
+                    name: {
+                        "count": metrics.count,
+                        "seconds": round(metrics.seconds, 6),
+                        "max_seconds": round(metrics.max_seconds, 6),
+                    }
+                    for name, metrics in sorted(self.phases.items())
+                },
+                "domains": {
+                    domain: {
+                        name: round(seconds, 6) for name, seconds in phases.items()
+                    }
+                    for domain, phases in self.domains.items()
+                },
+                "rate_limits": {
+                    service: {
+                        "calls": stats.calls,
+                        "retries": stats.retries,
+                        "throttles": stats.throttles,
+                        "wait_seconds": round(stats.wait_seconds, 6),
+                        "backoff_seconds": round(stats.backoff_seconds, 6),
+                    }
+                    for service, stats in sorted(limiter.all_stats().items())
+                },
+            }
+
+    def write_json(self, path: str):
+        with open(path, "w") as report_file:
+            json.dump(self.report(), report_file, indent=2)
+
+    def write_prometheus(self, path: str):
+        """Write the metrics in the Prometheus textfile collector format
+
+        Args:
+            path (str): File to write, usually in the node exporter textfile dir
+        """
+        lines = []
+        calls = f"{METRIC_PREFIX}_aws_calls_total"
+        retries = f"{METRIC_PREFIX}_aws_retries_total"
+        throttles = f"{METRIC_PREFIX}_aws_throttles_total"
+        errors = f"{METRIC_PREFIX}_aws_errors_total"
+        latency = f"{METRIC_PREFIX}_aws_call_duration_seconds"
+        phases = f"{METRIC_PREFIX}_phase_duration_seconds"
+        with self._lock:
+            operations = sorted(self.operations.items())
+            phase_metrics = sorted(self.phases.items())
+        for name, kind in [
+            (calls, "counter"),
+            (retries, "counter"),
+            (throttles, "counter"),
+            (errors, "counter"),
+            (latency, "histogram"),
+        ]:
+            lines.append(f"# TYPE {name} {kind}")
+            for (service, operation), metrics in operations:
+                labels = f'service="{service}",operation="{operation}"'
+                if kind == "counter":
+                    value = {
+                        calls: metrics.calls,
+                        retries: metrics.retries,
+                        throttles: metrics.throttles,
+                        errors: metrics.errors,
+                    }[name]
+                    lines.append(f"{name}{{{labels}}} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, metrics.latency_buckets):
+                    cumulative += count
+                    le = "+Inf" if bound == math.inf else bound
+                    lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{labels}}} {metrics.latency_seconds:.6f}")
+                lines.append(f"{name}_count{{{labels}}} {metrics.calls}")
+        lines.append(f"# TYPE {phases} summary")
+        for phase, metrics in phase_metrics:
+            lines.append(f'{phases}_sum{{phase="{phase}"}} {metrics.seconds:.6f}')
+            lines.append(f'{phases}_count{{phase="{phase}"}} {metrics.count}')
+        with open(path, "w") as metrics_file:
+            metrics_file.write("\n".join(lines) + "\n")
+
+
+class Profiler:
+    """cProfile of the main thread and of the threads started while profiling
+
+    Before Python 3.12 a profile only sees the thread that enabled it, so each
+    new thread gets its own profile, all merged when stopping. From 3.12 on a
+    single profile already sees every thread.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._profiles: List[cProfile.Profile] = []
+
+    def _enable(self, *args):
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profiles.append(profile)
+        # Replaces the thread's profile hook, so it only runs once per thread
+        profile.enable()
+
+    def start(self):
+        self._enable()
+        if sys.version_info < (3, 12):
+            threading.setprofile(self._enable)
+
+    def stop(self) -> Optional[pstats.Stats]:
+        """Stop profiling
+
+        Returns:
+            pstats.Stats: Merged stats of every profiled thread
+        """
+        threading.setprofile(None)
+        with self._lock:
+            profiles, self._profiles = self._profiles, []
+        for profile in profiles:
+            profile.disable()
+        if not profiles:
+            return None
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        return stats
+
+
+metrics = Metrics()
+
+
+def timed(function):
+    """Time a method of an object with a domain attribute as a phase"""
+
+    @functools.wraps(function)
+    def wrapper(self, *args, **kwargs):
+        with metrics.phase(function.__name__, getattr(self, "domain", None)):
+            return function(self, *args, **kwargs)
+
+    return wrapper
@@ -1,5 +1,23 @@
+import fnmatch
 from dataclasses import dataclass, field
-from typing import List, Optional
+from typing import (
+    Dict,
+    Generic,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+from exceptions import ChangeConflictException
+from utils import normalize_fqdn
+
+# MX values of SES, for the domain and its MAIL FROM domain
+INBOUND_MX_VALUES = ["10 inbound-smtp.*.amazonaws.com"]
+BOUNCE_MX_VALUES = ["10 feedback-smtp.*.amazonses.com"]
 
 
 @dataclass
@@ -37,15 +55,146 @@ class HostedZoneRecord:
     ttl: int = 300
     values: List[str] = field(default_factory=list)
 
+    @property
+    def key(self) -> tuple:
+        return normalize_fqdn(self.name), self.type.upper()
+
+    def normalize_value(self, value: str) -> str:
+        if self.type.upper() == "TXT":
+            return value
+        return value.rstrip(".").casefold()
+
+    @property
+    def normalized_values(self) -> frozenset:
+        return frozenset(self.normalize_value(value) for value in self.values)
+
+    def matches(self, other: "HostedZoneRecord") -> bool:
+        """Compare the record values, not just the name and type
+
+        Args:
+            other (HostedZoneRecord): The record to compare with
+
+        Returns:
+            bool: True when both records resolve to the same values
+        """
+        return self == other and self.normalized_values == other.normalized_values
+
+    def covers(self, other: "HostedZoneRecord") -> bool:
+        """Whether the record has every value of the other, and maybe more"""
+        return self == other and other.normalized_values <= self.normalized_values
+
+    @staticmethod
+    def is_spf(value: str) -> bool:
+        return value.strip('"').startswith("v=spf1")
+
+    @staticmethod
+    def is_ses_mx(value: str) -> bool:
+        return any(
+            fnmatch.fnmatchcase(value, pattern)
+            for pattern in INBOUND_MX_VALUES + BOUNCE_MX_VALUES
+        )
+
+    def merge_into(
+        self, existing: Optional["HostedZoneRecord"]
+    ) -> Tuple[str, "HostedZoneRecord"]:
+        """How to add the values of the record to the existing one
+
+        The values already in the existing record are kept, so the TXT values
+        a customer shares with other services are never overwritten. An MX of
+        another mail provider is not merged, the SES one would take its mail
+        with a lower preference, only the SES MX of other regions are.
+
+        Args:
+            existing (HostedZoneRecord, optional): The record of the same name
+                and type in the hosted zone
+
+        Returns:
+            Tuple[str, HostedZoneRecord]: NOOP when the existing record has
+                every value, CREATE when there is none, UPSERT with both sets
+                of values, or MANUAL with the record when the values can not
+                be merged: a CNAME to another target, an MX of another mail
+                provider or another SPF policy
+        """
+        if existing is None:
+            return "CREATE", self
+        if existing.covers(self):
+            return "NOOP", existing
+        if self.type.upper() == "CNAME":
+            return "MANUAL", self
+        if self.type.upper() == "MX" and not all(
+            self.is_ses_mx(value) for value in existing.normalized_values
+        ):
+            return "MANUAL", self
+        if any(self.is_spf(value) for value in self.values) and any(
+            self.is_spf(value) for value in existing.values
+        ):
+            return "MANUAL", self
+        missing = [
+            value
+            for value in self.values
+            if self.normalize_value(value) not in existing.normalized_values
+        ]
+        merged = HostedZoneRecord(
+            existing.name, existing.type, existing.ttl, existing.values + missing
+        )
+        return "UPSERT", merged
+
+    def merge_change(
+        self, action: str, other: "HostedZoneRecord", other_action: str
+    ) -> Tuple[str, "HostedZoneRecord"]:
+        """Combine two changes of the record set into one
+
+        A ChangeBatch takes a single change per record set, so two writes keep
+        the values of both, as an UPSERT when either of them is one.
+
+        Args:
+            action (str): CREATE, UPSERT or DELETE of this record
+            other (HostedZoneRecord): The record of the other change
+            other_action (str): CREATE, UPSERT or DELETE of the other record
+
+        Returns:
+            Tuple[str, HostedZoneRecord]: The action and record of the change
+
+        Raises:
+            ChangeConflictException: If a change deletes the record set the
+                other writes, or other values of it
+        """
+        if "DELETE" in (action, other_action):
+            if action == other_action and self.matches(other):
+                return action, self
+            raise ChangeConflictException(
+                f"Conflicting {action} and {other_action} of the {self.type}"
+                f" record {self.name}"
+            )
+        merged_action = "UPSERT" if "UPSERT" in (action, other_action) else "CREATE"
+        missing = [
+            value
+            for value in other.values
+            if self.normalize_value(value) not in self.normalized_values
+        ]
+        if not missing:
+            return merged_action, self
+        return merged_action, HostedZoneRecord(
+            self.name, self.type, self.ttl, self.values + missing
+        )
+
     def __eq__(self, __o: object) -> bool:
         if not isinstance(__o, HostedZoneRecord):
             return False
-        if __o.name in self.name and self.type == __o.type:
-            return True
-        return False
+        return self.key == __o.key
 
     def __hash__(self):
-        return hash(self.name + self.type)
+        return hash(self.key)
+
+
+@dataclass
+class ChangeInfo:
+    hosted_zone_id: str
+    id: Optional[str] = None
+    status: str = "PENDING"
+    records: List[HostedZoneRecord] = field(default_factory=list)
+    domains: List[str] = field(default_factory=list)
+    error: Optional[str] = None
 
 
 @dataclass
@@ -54,15 +203,24 @@ class ReceiptRule:
     rule_set_name: str
     rule: dict = field(default_factory=dict)
 
+    @property
+    def key(self) -> tuple:
+        return self.rule_set_name, self.name
+
+    @staticmethod
+    def compact(rule: dict) -> dict:
+        return {key: value for key, value in rule.items() if value not in (None, [])}
+
+    def matches(self, other: "ReceiptRule") -> bool:
+        return self == other and self.compact(self.rule) == self.compact(other.rule)
+
     def __eq__(self, __o: object) -> bool:
         if not isinstance(__o, ReceiptRule):
             return False
-        if __o.name in self.name and self.rule_set_name == __o.rule_set_name:
-            return True
-        return False
+        return self.key == __o.key
 
     def __hash__(self):
-        return hash(self.name + self.rule_set_name)
+        return hash(self.key)
 
     def create_proxy_rule(self, bucket_name: str, prefix: str):
         self.rule = {
@@ -82,3 +240,72 @@ class ReceiptRule:
             "ScanEnabled": True,
             "TlsPolicy": "Optional",
         }
+
+
+T = TypeVar("T", HostedZoneRecord, ReceiptRule)
+
+
+class ResourceIndex(Generic[T]):
+    """Hash index of records or receipt rules by their key
+
+    HostedZoneRecord is keyed by normalized FQDN and type, ReceiptRule by
+    rule set and rule name, so membership is O(1) and `matches` tells apart
+    a resource that exists with different values.
+    """
+
+    def __init__(self, items: Iterable[T] = ()) -> None:
+        self._items: Dict[Hashable, T] = {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item: T):
+        self._items[item.key] = item
+
+    def get(self, item: T) -> Optional[T]:
+        return self._items.get(item.key)
+
+    def contains_value(self, item: T) -> bool:
+        existing = self.get(item)
+        return existing is not None and existing.matches(item)
+
+    def __contains__(self, item: object) -> bool:
+        return getattr(item, "key", None) in self._items
+
+    def __iter__(self) -> Iterator[T]:
+        return iter(self._items.values())
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class HostedZoneTrie:
+    """Hosted zones indexed by their labels in reverse, e.g. com -> company
+
+    Resolving a domain walks its labels from the TLD down and keeps the last
+    zone seen, so it finds the most specific zone owning the domain in
+    O(labels), e.g. cerby.company.com resolves to the company.com. zone.
+    """
+
+    def __init__(self) -> None:
+        self._root: dict = {}
+
+    @staticmethod
+    def labels(name: str) -> List[str]:
+        return list(reversed(normalize_fqdn(name).rstrip(".").split(".")))
+
+    def add(self, name: str, hosted_zone_id: str):
+        node = self._root
+        for label in self.labels(name):
+            node = node.setdefault(label, {})
+        # Zones sharing a name keep the first one listed
+        node.setdefault(None, hosted_zone_id)
+
+    def resolve(self, domain: str) -> Optional[str]:
+        node = self._root
+        hosted_zone_id = None
+        for label in self.labels(domain):
+            node = node.get(label)
+            if node is None:
+                break
+            hosted_zone_id = node.get(None, hosted_zone_id)
+        return hosted_zone_id
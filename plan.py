@@ -0,0 +1,327 @@
+import gzip
+import json
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import botocore
+
+from aws import get_current_region
+from batch import DEFAULT_WORKERS, prefetched
+from exceptions import CerbyException, ConfigurationException
+from models import (
+    ChangeInfo,
+    DkimAttributes,
+    HostedZoneRecord,
+    MailFromDomainAttributes,
+)
+from repository import (
+    AWSHostedZoneRecordsRepository,
+    AWSHostedZoneRepository,
+    AWSIdentityRepository,
+    AWSReceiptRulesRepository,
+)
+from rules import ReceiptRuleManager
+from ses_actions import SESActions
+from utils import imap_bounded
+
+PLAN_VERSION = 2
+
+# Plan actions
+NOOP = "NOOP"
+CREATE = "CREATE"
+UPSERT = "UPSERT"
+MANUAL = "MANUAL"  # A record without a Route53 hosted zone, added by hand
+
+# Resource kinds
+DKIM = "dkim"
+MAIL_FROM = "mail_from"
+RECORD = "record"
+RULE = "rule"
+
+
+@dataclass
+class PlanAction:
+    domain: str
+    kind: str
+    action: str
+    target: str
+    payload: dict = field(default_factory=dict)
+
+    @property
+    def record(self) -> HostedZoneRecord:
+        return HostedZoneRecord(**self.payload["record"])
+
+
+@dataclass
+class Plan:
+    region: str
+    actions: List[PlanAction] = field(default_factory=list)
+    errors: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def changes(self) -> List[PlanAction]:
+        return [action for action in self.actions if action.action != NOOP]
+
+    @property
+    def domains(self) -> List[str]:
+        return list(dict.fromkeys(action.domain for action in self.actions))
+
+    @property
+    def converged(self) -> List[str]:
+        """Domains without errors that the plan makes no change to"""
+        changed = {action.domain for action in self.changes} | set(self.errors)
+        return [domain for domain in self.domains if domain not in changed]
+
+    def summary(self) -> Dict[str, int]:
+        return dict(
+            Counter(f"{action.kind} {action.action}" for action in self.actions)
+        )
+
+    def save(self, path: str):
+        """Write the plan as compact JSON, gzipped when the path ends in .gz
+
+        Args:
+            path (str): File to write the plan to
+        """
+        document = {
+            "version": PLAN_VERSION,
+            "region": self.region,
+            "errors": self.errors,
+            "actions": [
+                [action.domain, action.kind, action.action, action.target]
+                + ([action.payload] if action.payload else [])
+                for action in self.actions
+            ],
+        }
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "wt") as plan_file:
+            json.dump(document, plan_file, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path: str) -> "Plan":
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt") as plan_file:
+            document = json.load(plan_file)
+        if document.get("version") != PLAN_VERSION:
+            raise ConfigurationException(
+                f"Unsupported plan version {document.get('version')}"
+            )
+        return cls(
+            region=document["region"],
+            errors=document.get("errors", {}),
+            actions=[PlanAction(*row) for row in document["actions"]],
+        )
+
+
+class Planner:
+    """Read the current state of many domains and diff it with the desired one
+
+    Reads go through repositories shared by every domain and run on a bounded
+    thread pool, nothing is written.
+    """
+
+    def __init__(
+        self,
+        workers: int = DEFAULT_WORKERS,
+        identity_repo: Optional[AWSIdentityRepository] = None,
+        hz_repo: Optional[AWSHostedZoneRepository] = None,
+        hzr_repo: Optional[AWSHostedZoneRecordsRepository] = None,
+        receipt_rules_repo: Optional[AWSReceiptRulesRepository] = None,
+        rule_manager: Optional[ReceiptRuleManager] = None,
+    ) -> None:
+        self.workers = workers
+        self.identity_repo = identity_repo or AWSIdentityRepository()
+        self.hz_repo = hz_repo or AWSHostedZoneRepository()
+        self.hzr_repo = hzr_repo or AWSHostedZoneRecordsRepository()
+        self.receipt_rules_repo = receipt_rules_repo or AWSReceiptRulesRepository()
+        self.rule_manager = rule_manager or ReceiptRuleManager(self.receipt_rules_repo)
+
+    def plan(self, domains: Iterable[str]) -> Plan:
+        plan = Plan(region=get_current_region())
+        domains = prefetched(domains, self.identity_repo)
+        for domain, actions, error in imap_bounded(
+            self._plan_domain, domains, self.workers
+        ):
+            if error:
+                plan.errors[domain] = error
+            plan.actions.extend(actions)
+        return plan
+
+    def _plan_domain(self, domain: str) -> Tuple[str, List[PlanAction], Optional[str]]:
+        try:
+            return domain, self.plan_domain(domain), None
+        except botocore.exceptions.ClientError as error:
+            return domain, [], error.response["Error"]["Message"]
+        except (botocore.exceptions.BotoCoreError, CerbyException) as error:
+            return domain, [], str(error)
+
+    def plan_domain(self, domain: str) -> List[PlanAction]:
+        ses_actions = SESActions(
+            domain=domain,
+            identity_repo=self.identity_repo,
+            hz_repo=self.hz_repo,
+            hzr_repo=self.hzr_repo,
+            receipt_rules_repo=self.receipt_rules_repo,
+            rule_manager=self.rule_manager,
+        )
+        actions = []
+
+        identity = self.identity_repo.get_dkim_attributes(domain)
+        if identity is None:
+            zone = {"zone": ses_actions.hosted_zone_id}
+            actions.append(PlanAction(domain, DKIM, CREATE, domain, zone))
+        else:
+            actions.append(PlanAction(domain, DKIM, NOOP, domain))
+            if identity.verification_status == "Pending":
+                for record in identity.dkim_tokens_as_records(domain):
+                    actions.append(self._plan_record(ses_actions, record))
+
+        for record in ses_actions.inbound_records().values():
+            actions.append(self._plan_record(ses_actions, record))
+
+        mail_from = self.identity_repo.get_mail_from_domain_attributes(domain)
+        mail_from_records = ses_actions.mail_from_records().values()
+        if mail_from is None:
+            mail_from = MailFromDomainAttributes(
+                name=domain, mail_from_domain=ses_actions.mail_from_domain
+            )
+            actions.append(
+                PlanAction(domain, MAIL_FROM, CREATE, domain, asdict(mail_from))
+            )
+            mail_from.mail_from_domain_status = "Pending"
+        else:
+            actions.append(PlanAction(domain, MAIL_FROM, NOOP, domain))
+        for record in mail_from_records:
+            if mail_from.mail_from_domain_status in ["Pending", "Success"]:
+                actions.append(self._plan_record(ses_actions, record))
+            else:
+                actions.append(self._manual_record(domain, record))
+
+        actions.extend(self._plan_rules(ses_actions))
+        return actions
+
+    def _plan_record(
+        self, ses_actions: SESActions, record: HostedZoneRecord
+    ) -> PlanAction:
+        """Plan a record, merged into the existing one of the same name and type
+
+        An existing MX or TXT record keeps its values and gets ours added, a
+        record that can not be merged is left to be fixed by hand.
+        """
+        if not ses_actions.hosted_zone_id:
+            return self._manual_record(ses_actions.domain, record)
+        existing = ses_actions.hosted_zone_records.get(record)
+        action, record = record.merge_into(existing)
+        if action == MANUAL:
+            return self._manual_record(ses_actions.domain, record)
+        payload = {"zone": ses_actions.hosted_zone_id, "record": asdict(record)}
+        return PlanAction(ses_actions.domain, RECORD, action, record.name, payload)
+
+    def _manual_record(self, domain: str, record: HostedZoneRecord) -> PlanAction:
+        return PlanAction(
+            domain, RECORD, MANUAL, record.name, {"record": asdict(record)}
+        )
+
+    def _plan_rules(self, ses_actions: SESActions) -> List[PlanAction]:
+        domain = ses_actions.domain
+        action = NOOP if self.rule_manager.covers(domain) else CREATE
+        return [PlanAction(domain, RULE, action, self.rule_manager.rule_set_name)]
+
+
+@dataclass
+class ApplyResult:
+    changes: List[ChangeInfo] = field(default_factory=list)
+    records_pending_to_create: List[HostedZoneRecord] = field(default_factory=list)
+    failures: Dict[str, str] = field(default_factory=dict)
+
+
+class Applier:
+    """Run the changes of a plan with as much batching and parallelism as possible
+
+    SES identity writes run on a thread pool, one task per domain. Every
+    record change is staged in one repository and sent as a ChangeBatch per
+    hosted zone, and every domain is added to the receipt rules at the end.
+    """
+
+    def __init__(
+        self,
+        workers: int = DEFAULT_WORKERS,
+        identity_repo: Optional[AWSIdentityRepository] = None,
+        hzr_repo: Optional[AWSHostedZoneRecordsRepository] = None,
+        receipt_rules_repo: Optional[AWSReceiptRulesRepository] = None,
+        rule_manager: Optional[ReceiptRuleManager] = None,
+    ) -> None:
+        self.workers = workers
+        self.identity_repo = identity_repo or AWSIdentityRepository()
+        self.hzr_repo = hzr_repo or AWSHostedZoneRecordsRepository()
+        self.receipt_rules_repo = receipt_rules_repo or AWSReceiptRulesRepository()
+        self.rule_manager = rule_manager or ReceiptRuleManager(self.receipt_rules_repo)
+
+    def apply(self, plan: Plan) -> ApplyResult:
+        result = ApplyResult()
+        by_domain: Dict[str, List[PlanAction]] = {}
+        for action in plan.changes:
+            if action.kind == RECORD:
+                self._apply_record(action, result)
+            elif action.kind == RULE:
+                self.rule_manager.stage(action.domain)
+            else:
+                by_domain.setdefault(action.domain, []).append(action)
+
+        for records, changes, failures in imap_bounded(
+            self._apply_domain, by_domain.values(), self.workers
+        ):
+            result.records_pending_to_create.extend(records)
+            result.changes.extend(changes)
+            result.failures.update(failures)
+
+        result.changes.extend(self.hzr_repo.flush())
+        for change in result.changes:
+            if change.error:
+                result.failures[", ".join(change.domains)] = change.error
+        result.failures.update(self.rule_manager.flush())
+        return result
+
+    def _apply_record(self, action: PlanAction, result: ApplyResult):
+        if action.action == MANUAL:
+            result.records_pending_to_create.append(action.record)
+        else:
+            result.changes.extend(
+                self.hzr_repo.stage(
+                    action.payload["zone"],
+                    action.record,
+                    action=action.action,
+                    owner=action.domain,
+                )
+            )
+
+    def _apply_domain(
+        self, actions: List[PlanAction]
+    ) -> Tuple[List[HostedZoneRecord], List[ChangeInfo], Dict[str, str]]:
+        records: List[HostedZoneRecord] = []
+        changes: List[ChangeInfo] = []
+        failures: Dict[str, str] = {}
+        for action in actions:
+            try:
+                if action.kind == DKIM:
+                    identity = self.identity_repo.verify_domain_dkim(
+                        DkimAttributes(action.domain)
+                    )
+                    zone = action.payload.get("zone")
+                    for record in identity.dkim_tokens_as_records(action.domain):
+                        if zone:
+                            changes.extend(
+                                self.hzr_repo.stage(zone, record, owner=action.domain)
+                            )
+                        else:
+                            records.append(record)
+                elif action.kind == MAIL_FROM:
+                    self.identity_repo.set_mail_from_domain_attributes(
+                        MailFromDomainAttributes(**action.payload)
+                    )
+            except botocore.exceptions.ClientError as error:
+                failures[action.target] = error.response["Error"]["Message"]
+            except (botocore.exceptions.BotoCoreError, CerbyException) as error:
+                failures[action.target] = str(error)
+        return records, changes, failures
@@ -0,0 +1,138 @@
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+from botocore.exceptions import ClientError
+
+from models import ChangeInfo
+from repository import AWSHostedZoneRecordsRepository
+
+INSYNC = "INSYNC"
+PENDING = "PENDING"
+FAILED = "FAILED"
+
+# Seconds between polling rounds, doubled after every round up to the cap.
+# Route53 usually propagates a change within a minute.
+INITIAL_POLL_DELAY = 2.0
+MAX_POLL_DELAY = 30.0
+
+DEFAULT_WAIT_TIMEOUT = 600.0
+
+
+class ChangeTracker:
+    """Waits for submitted Route53 changes to be INSYNC
+
+    Every outstanding change is polled on one shared schedule from the calling
+    thread, so thousands of changes cost one loop instead of a sleeping thread
+    each. Rounds start INITIAL_POLL_DELAY apart and back off exponentially.
+    ChangeInfo statuses are updated in place, and a domain is ready once every
+    change made for it is INSYNC.
+    """
+
+    def __init__(
+        self,
+        hzr_repo: Optional[AWSHostedZoneRecordsRepository] = None,
+        initial_delay: float = INITIAL_POLL_DELAY,
+        max_delay: float = MAX_POLL_DELAY,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.hzr_repo = hzr_repo or AWSHostedZoneRecordsRepository()
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.clock = clock
+        self.sleep = sleep
+        self.changes: List[ChangeInfo] = []
+        self.pending: Dict[str, List[ChangeInfo]] = {}
+
+    def track(self, changes: Iterable[ChangeInfo]):
+        """Add submitted changes to wait for, failed submissions are only reported
+
+        Args:
+            changes (Iterable[ChangeInfo]): Changes returned by the repository
+        """
+        for change in changes:
+            self.changes.append(change)
+            if change.id and not change.error and change.status != INSYNC:
+                self.pending.setdefault(change.id, []).append(change)
+
+    def poll(self) -> List[ChangeInfo]:
+        """Read the status of every outstanding change once
+
+        Returns:
+            List[ChangeInfo]: Changes found INSYNC or failed in this round
+        """
+        done = []
+        for change_id, changes in list(self.pending.items()):
+            try:
+                status = self.hzr_repo.get_change(change_id)
+                error = None
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "NoSuchChange":
+                    raise
+                status, error = FAILED, e.response["Error"]["Message"]
+            for change in changes:
+                change.status = status
+                change.error = error
+            if status != PENDING:
+                del self.pending[change_id]
+                done.extend(changes)
+        return done
+
+    def wait(
+        self,
+        timeout: Optional[float] = DEFAULT_WAIT_TIMEOUT,
+        on_ready: Optional[Callable[[str], None]] = None,
+    ) -> bool:
+        """Poll until every change is INSYNC or the timeout expires
+
+        Args:
+            timeout (float, optional): Seconds to wait at most, None to wait
+                for as long as it takes
+            on_ready (Callable, optional): Called with each domain as soon as
+                it is ready
+
+        Returns:
+            bool: Whether every change is INSYNC
+        """
+        deadline = None if timeout is None else self.clock() + timeout
+        delay = self.initial_delay
+        reported = set()
+        while True:
+            self.poll()
+            if on_ready:
+                for domain in self.ready_domains():
+                    if domain not in reported:
+                        reported.add(domain)
+                        on_ready(domain)
+            if not self.pending:
+                return all(change.status == INSYNC for change in self.changes)
+            if deadline is not None:
+                remaining = deadline - self.clock()
+                if remaining <= 0:
+                    return False
+                delay = min(delay, remaining)
+            self.sleep(delay)
+            delay = min(delay * 2, self.max_delay)
+
+    def domain_status(self) -> Dict[str, str]:
+        """Readiness of every domain with tracked changes
+
+        Returns:
+            Dict[str, str]: INSYNC when all changes of the domain are in sync,
+                FAILED when any failed, PENDING otherwise
+        """
+        rank = {INSYNC: 0, PENDING: 1, FAILED: 2}
+        statuses: Dict[str, str] = {}
+        for change in self.changes:
+            status = FAILED if change.error else change.status
+            for domain in change.domains:
+                current = statuses.get(domain, INSYNC)
+                statuses[domain] = max(current, status, key=rank.get)
+        return statuses
+
+    def ready_domains(self) -> List[str]:
+        return [
+            domain
+            for domain, status in self.domain_status().items()
+            if status == INSYNC
+        ]
@@ -0,0 +1,253 @@
+import argparse
+import random
+import threading
+import time
+from dataclasses import dataclass, replace
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+# Requests per second allowed to each service per account. Route53 documents
+# 5 requests per second per account, SES control plane calls are throttled
+# around the same rate.
+DEFAULT_RATES = {"route53": 5.0, "ses": 5.0}
+DEFAULT_RATE = 5.0
+
+THROTTLING_ERROR_CODES = [
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestThrottledException",
+    "TooManyRequestsException",
+    "RequestLimitExceeded",
+    "PriorRequestNotComplete",
+    "SlowDown",
+]
+
+
+def parse_rate(value: str) -> Tuple[str, float]:
+    """Parse a SERVICE=RPS command line rate, e.g. route53=5"""
+    service, _, rate = value.partition("=")
+    try:
+        return service, float(rate)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid rate {value}, use SERVICE=RPS")
+
+
+def backoff_delay(attempts: int, base: float = 0.5, cap: float = 20.0) -> float:
+    """Exponential backoff with full jitter
+
+    Args:
+        attempts (int): Attempts made so far, starting at 1
+        base (float): Delay of the first retry, before jitter
+        cap (float): Maximum delay
+
+    Returns:
+        float: Seconds to wait before the next attempt
+    """
+    return random.uniform(0, min(cap, base * 2 ** (attempts - 1)))
+
+
+@dataclass
+class RateLimitStats:
+    calls: int = 0
+    attempts: int = 0
+    throttles: int = 0
+    wait_seconds: float = 0.0
+    backoff_seconds: float = 0.0
+
+    @property
+    def retries(self) -> int:
+        return max(self.attempts - self.calls, 0)
+
+    def merge(self, other: "RateLimitStats"):
+        self.calls += other.calls
+        self.attempts += other.attempts
+        self.throttles += other.throttles
+        self.wait_seconds += other.wait_seconds
+        self.backoff_seconds += other.backoff_seconds
+
+    def clear(self):
+        self.calls = self.attempts = self.throttles = 0
+        self.wait_seconds = self.backoff_seconds = 0.0
+
+
+class TokenBucket:
+    """Token bucket whose rate adapts to throttling
+
+    Every throttle halves the rate (down to min_rate) and every success adds
+    back a fraction of a request per second until the configured rate, so a
+    busy account settles at the highest rate it sustains.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: Optional[float] = None,
+        min_rate: float = 0.5,
+        increase: float = 0.1,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst or max(rate, 1.0)
+        self.min_rate = min(min_rate, rate)
+        self.increase = increase
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = self.burst
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self) -> float:
+        """Take a token, waiting for it when the bucket is empty
+
+        Tokens are reserved under the lock and waited for outside of it, so
+        concurrent callers queue up fairly without holding each other.
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        with self._lock:
+            self._refill(self.clock())
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            self.sleep(wait)
+        return wait
+
+    def on_throttle(self):
+        with self._lock:
+            self._refill(self.clock())
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def on_success(self):
+        with self._lock:
+            if self.rate < self.max_rate:
+                self._refill(self.clock())
+                self.rate = min(self.max_rate, self.rate + self.increase)
+
+
+class RateLimiter:
+    """Rate limits shared by every AWS client of the process
+
+    Each (service, credentials) pair gets its own bucket, so every client of
+    the same service and account draws from the same budget. Clients are
+    wired through botocore events: a token is taken before each attempt,
+    throttling errors slow the bucket down and are retried with jittered
+    backoff, and successes speed it back up.
+    """
+
+    def __init__(self, rates: Optional[Dict[str, float]] = None) -> None:
+        self.rates = dict(DEFAULT_RATES)
+        self.rates.update(rates or {})
+        self._lock = threading.Lock()
+        self._buckets: Dict[Tuple[str, Hashable], TokenBucket] = {}
+        self._stats: Dict[str, RateLimitStats] = {}
+
+    def configure(self, rates: Dict[str, float]):
+        """Set the requests per second of some services, resetting their buckets
+
+        Args:
+            rates (Dict[str, float]): Requests per second by service name
+        """
+        with self._lock:
+            self.rates.update(rates)
+            for key in [key for key in self._buckets if key[0] in rates]:
+                del self._buckets[key]
+
+    def reset(self):
+        with self._lock:
+            self.rates = dict(DEFAULT_RATES)
+            self._buckets.clear()
+            self._stats.clear()
+
+    def bucket(self, service: str, account: Hashable = None) -> TokenBucket:
+        with self._lock:
+            key = (service, account)
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket(self.rates.get(service, DEFAULT_RATE))
+            return self._buckets[key]
+
+    def stats(self, service: str) -> RateLimitStats:
+        with self._lock:
+            return self._stats.setdefault(service, RateLimitStats())
+
+    def all_stats(self) -> Dict[str, RateLimitStats]:
+        with self._lock:
+            return dict(self._stats)
+
+    def take_stats(self) -> Dict[str, RateLimitStats]:
+        """Hand over the stats so far, they start again from zero
+
+        The stats of a service are cleared in place, the clients attached to
+        the limiter keep updating them.
+        """
+        with self._lock:
+            taken = {service: replace(stats) for service, stats in self._stats.items()}
+            for stats in self._stats.values():
+                stats.clear()
+        return taken
+
+    def merge_stats(self, stats: Dict[str, RateLimitStats]):
+        """Add the stats of the limiter of another process"""
+        with self._lock:
+            for service, other in stats.items():
+                self._stats.setdefault(service, RateLimitStats()).merge(other)
+
+    def attach(self, client, service: str, account: Hashable, max_attempts: int):
+        """Route the calls of a boto3 client through the service's bucket
+
+        Args:
+            client: The boto3 client
+            service (str): Service name of the client, e.g. route53
+            account (Hashable): Key of the credentials used by the client
+            max_attempts (int): Attempts allowed by the client's retry config
+        """
+        stats = self.stats(service)
+        lock = self._lock
+        service_id = client.meta.service_model.service_id.hyphenize()
+
+        def on_call(**kwargs):
+            with lock:
+                stats.calls += 1
+
+        def on_send(**kwargs):
+            wait = self.bucket(service, account).acquire()
+            with lock:
+                stats.attempts += 1
+                stats.wait_seconds += wait
+
+        def on_needs_retry(response=None, attempts=1, **kwargs):
+            if response is None:
+                return None
+            code = response[1].get("Error", {}).get("Code")
+            if code not in THROTTLING_ERROR_CODES:
+                return None
+            self.bucket(service, account).on_throttle()
+            delay = backoff_delay(attempts) if attempts < max_attempts else None
+            with lock:
+                stats.throttles += 1
+                stats.backoff_seconds += delay or 0.0
+            return delay
+
+        def on_after_call(parsed=None, **kwargs):
+            if parsed is not None and "Error" not in parsed:
+                self.bucket(service, account).on_success()
+
+        events = client.meta.events
+        events.register(f"before-call.{service_id}", on_call)
+        events.register(f"before-send.{service_id}", on_send)
+        # Registered first so our delay wins over botocore's own retry handler
+        events.register_first(f"needs-retry.{service_id}", on_needs_retry)
+        events.register(f"after-call.{service_id}", on_after_call)
+
+
+limiter = RateLimiter()
+
+
+def configure_rate_limits(rates: Dict[str, float]):
+    limiter.configure(rates)
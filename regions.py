@@ -0,0 +1,177 @@
+import functools
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import botocore
+
+from batch import (
+    DEFAULT_WORKERS,
+    FLUSH_EVERY,
+    BatchSummary,
+    DomainResult,
+    configure_domain,
+    flush_staged,
+    needs_flush,
+)
+from exceptions import CerbyException
+from metrics import metrics
+from models import ChangeInfo, ResourceIndex
+from repository import (
+    MAX_IDENTITIES_PER_REQUEST,
+    AWSHostedZoneRecordsRepository,
+    AWSHostedZoneRepository,
+    AWSIdentityRepository,
+)
+from rules import ReceiptRuleManager
+from utils import chunked, imap_bounded
+
+
+def parse_regions(value: str) -> List[str]:
+    """Split a comma separated list of regions, dropping blanks and duplicates"""
+    regions = (region.strip() for region in value.split(","))
+    return list(dict.fromkeys(region for region in regions if region))
+
+
+def configure_domain_regions(
+    domain: str,
+    regions: List[str],
+    executor: Executor,
+    hzr_repo: AWSHostedZoneRecordsRepository,
+    hz_repo: AWSHostedZoneRepository,
+    identity_repos: Dict[str, AWSIdentityRepository],
+    rule_managers: Dict[str, ReceiptRuleManager],
+) -> List[DomainResult]:
+    """Run the SES pipeline of a domain in every region at once
+
+    The hosted zone records are read once and shared by the regions, and the
+    MX records of each region list every region, so the Route53 changes of
+    all regions are the same and staged once.
+
+    Args:
+        domain (str): Domain to configure
+        regions (List[str]): Regions to set the domain up in
+        executor (Executor): Pool the regions run on
+        hzr_repo (AWSHostedZoneRecordsRepository): Repository shared by the
+            batch to coalesce record changes
+        hz_repo (AWSHostedZoneRepository): Repository shared by the batch
+        identity_repos (Dict[str, AWSIdentityRepository]): SES identities by
+            region
+        rule_managers (Dict[str, ReceiptRuleManager]): Receipt rules by region
+
+    Returns:
+        List[DomainResult]: The outcome of each region
+    """
+    try:
+        hosted_zone_id = hz_repo.get(domain)
+        records = ResourceIndex(
+            hzr_repo.get_domain_records(hosted_zone_id, domain)
+            if hosted_zone_id
+            else ()
+        )
+    except botocore.exceptions.ClientError as error:
+        message = error.response["Error"]["Message"]
+        return [
+            DomainResult(domain, error=message, region=region) for region in regions
+        ]
+    except (botocore.exceptions.BotoCoreError, CerbyException) as error:
+        return [
+            DomainResult(domain, error=str(error), region=region) for region in regions
+        ]
+    futures = [
+        executor.submit(
+            configure_domain,
+            domain,
+            hzr_repo=hzr_repo,
+            identity_repo=identity_repos[region],
+            hz_repo=hz_repo,
+            rule_manager=rule_managers[region],
+            region=region,
+            regions=regions,
+            hosted_zone_records=records,
+        )
+        for region in regions
+    ]
+    return [future.result() for future in futures]
+
+
+def run_regions(
+    domains: Iterable[str],
+    regions: List[str],
+    workers: int = DEFAULT_WORKERS,
+    on_result: Optional[Callable[[DomainResult], None]] = None,
+    hzr_repo: Optional[AWSHostedZoneRecordsRepository] = None,
+    flush_every: int = FLUSH_EVERY,
+) -> BatchSummary:
+    """Configure many domains in several regions
+
+    Works like batch.run_batch, with one result per domain and region. The
+    SES side of each region uses clients of that region and runs in parallel
+    with the other regions, while Route53 is only read and written once per
+    domain. Records and receipt rules are flushed, the receipt rules of every
+    region at once, after each flush_every domains, and the domains they
+    write are reported after it.
+
+    Args:
+        domains (Iterable[str]): Domains to configure, may be a lazy stream
+        regions (List[str]): Regions to set every domain up in
+        workers (int): Maximum number of domains configured at once
+        on_result (Callable, optional): Called with each result as it completes
+        hzr_repo (AWSHostedZoneRecordsRepository, optional): Repository to
+            stage the record changes in
+        flush_every (int): Domains configured between two flushes
+
+    Returns:
+        BatchSummary: The totals and the failed domains and regions
+    """
+    summary = BatchSummary()
+    start = time.perf_counter()
+    hzr_repo = hzr_repo or AWSHostedZoneRecordsRepository()
+    identity_repos = {region: AWSIdentityRepository(region) for region in regions}
+    rule_managers = {region: ReceiptRuleManager(region=region) for region in regions}
+
+    def report(result: DomainResult):
+        summary.add(result)
+        if on_result:
+            on_result(result)
+
+    with ThreadPoolExecutor(max_workers=workers * len(regions)) as executor:
+
+        def prefetched(domains: Iterable[str]) -> Iterator[str]:
+            for chunk in chunked(domains, MAX_IDENTITIES_PER_REQUEST):
+                with metrics.phase("prefetch"):
+                    list(
+                        executor.map(
+                            lambda region: identity_repos[region].prefetch(chunk),
+                            regions,
+                        )
+                    )
+                yield from chunk
+
+        configure = functools.partial(
+            configure_domain_regions,
+            regions=regions,
+            executor=executor,
+            hzr_repo=hzr_repo,
+            hz_repo=AWSHostedZoneRepository(),
+            identity_repos=identity_repos,
+            rule_managers=rule_managers,
+        )
+        for chunk in chunked(domains, flush_every):
+            flushed: List[DomainResult] = []
+            changes: List[ChangeInfo] = []
+            for results in imap_bounded(configure, prefetched(chunk), workers):
+                for result in results:
+                    changes.extend(result.changes)
+                    if needs_flush(result):
+                        flushed.append(result)
+                    else:
+                        report(result)
+            changes.extend(
+                flush_staged(flushed, changes, hzr_repo, rule_managers, executor)
+            )
+            summary.changes.extend(changes)
+            for result in flushed:
+                report(result)
+    summary.elapsed = time.perf_counter() - start
+    return summary
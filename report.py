@@ -0,0 +1,132 @@
+import json
+import sys
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Iterable, TextIO
+
+from batch import BatchSummary, DomainResult
+from models import ChangeInfo
+
+# Path standing for stdout
+STDOUT = "-"
+
+
+class EventWriter:
+    """Stream of JSON Lines events describing the outcome of a run
+
+    Every event is written and flushed as soon as the work it describes is
+    done, so an orchestrator can tail the run, and nothing is buffered for
+    the end. Events carry an event name and the UTC time, like the ones of
+    the watch mode.
+    """
+
+    def __init__(self, stream: TextIO, close_stream: bool = False) -> None:
+        self.stream = stream
+        self.close_stream = close_stream
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path: str) -> "EventWriter":
+        """Write the events to a file, or to stdout when the path is -
+
+        Args:
+            path (str): The file to write, truncated first
+
+        Returns:
+            EventWriter: The writer, to close once the run is done
+        """
+        if path == STDOUT:
+            return cls(sys.stdout)
+        return cls(open(path, "w"), close_stream=True)
+
+    def close(self):
+        if self.close_stream:
+            self.stream.close()
+
+    def write(self, event: dict):
+        line = json.dumps(event)
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+    def emit(self, event: str, **fields):
+        """Write one event
+
+        Args:
+            event (str): Name of the event
+            **fields: JSON serializable fields of the event
+        """
+        self.write(
+            {"event": event, "time": datetime.now(timezone.utc).isoformat(), **fields}
+        )
+
+    def domain_result(self, result: DomainResult):
+        """Report a configured domain and the records left to add by hand
+
+        Args:
+            result (DomainResult): The outcome of the domain
+        """
+        if not result.succeeded:
+            status = "failed"
+        else:
+            status = "converged" if result.converged else "changed"
+        region = {"region": result.region} if result.region else {}
+        self.emit(
+            "domain",
+            domain=result.domain,
+            **region,
+            status=status,
+            error=result.error,
+            elapsed=round(result.elapsed, 3),
+        )
+        for record in result.records_pending_to_create:
+            self.emit(
+                "pending_record",
+                domain=result.domain,
+                name=record.name,
+                type=record.type,
+                ttl=record.ttl,
+                values=record.values,
+            )
+        self.rule_failures(result.domain, result.rules_failed_to_create)
+
+    def rule_failures(self, domain: str, failures: Dict[str, str]):
+        for name, error in failures.items():
+            self.emit("rule_failed", domain=domain, rule=name, error=error)
+
+    def changes(self, changes: Iterable[ChangeInfo]):
+        """Report Route53 change batches once submitted
+
+        Args:
+            changes (Iterable[ChangeInfo]): The submitted change batches
+        """
+        for change in changes:
+            self.emit(
+                "change",
+                id=change.id,
+                hosted_zone_id=change.hosted_zone_id,
+                status=change.status,
+                domains=change.domains,
+                error=change.error,
+            )
+
+    def summary(self, summary: BatchSummary):
+        """Report the change batches and the totals of a batch
+
+        The rule failures of the flush are already in the events of their
+        domains, which are only reported once flushed.
+
+        Args:
+            summary (BatchSummary): The flushed batch
+        """
+        self.changes(summary.changes)
+        self.emit(
+            "summary",
+            domains=summary.domains,
+            converged=summary.converged,
+            changed=summary.changed,
+            failed=len(summary.failed),
+            changes=len(summary.changes),
+            failed_changes=len(summary.failed_changes),
+            elapsed=round(summary.elapsed, 3),
+        )
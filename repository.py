@@ -1,156 +1,604 @@
-from typing import List, Optional
+import threading
+from dataclasses import asdict
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 from botocore.exceptions import ClientError
 
 from aws import get_client
+from cache import state_cache
 from exceptions import (
     RuleAlreadyExistsException,
     RuleSetAlreadyExistsException,
     RuleSetDoesNotExistException,
 )
 from models import (
+    ChangeInfo,
     DkimAttributes,
     HostedZoneRecord,
+    HostedZoneTrie,
     MailFromDomainAttributes,
     ReceiptRule,
 )
+from utils import chunked, is_subdomain, normalize_fqdn
+
+# Record types written by the SES setup, every other type is skipped on read.
+MANAGED_RECORD_TYPES = ["CNAME", "TXT", "MX"]
+
+# SES identity attribute reads accept up to 100 identities per request.
+MAX_IDENTITIES_PER_REQUEST = 100
+
+# Key of the active rule set in the state cache
+ACTIVE_RULE_SET_KEY = "@active"
+
+# Route53 ChangeBatch limits, UPSERT changes count twice against both.
+MAX_RECORDS_PER_CHANGE_BATCH = 1000
+MAX_VALUE_CHARACTERS_PER_CHANGE_BATCH = 32000
 
 
 class AWSIdentityRepository:
-    def __init__(self) -> None:
+    def __init__(self, region: Optional[str] = None) -> None:
         super().__init__()
-        self.client = get_client("ses")
+        self.region = region
+        self.client = get_client("ses", region)
+        self._prefetched_dkim: Dict[str, Optional[DkimAttributes]] = {}
+        self._prefetched_mail_from: Dict[str, Optional[MailFromDomainAttributes]] = {}
+
+    def prefetch(self, names: Iterable[str]):
+        """Read the DKIM and MAIL FROM attributes of many identities in bulk
+
+        The next get_dkim_attributes / get_mail_from_domain_attributes call
+        for each identity is answered from the prefetched attributes, once.
+
+        Args:
+            names (Iterable[str]): The identities about to be configured
+        """
+        names = list(names)
+        dkim_attributes = self._read_through(
+            "dkim", names, self.get_dkim_attributes_bulk, DkimAttributes
+        )
+        mail_from_attributes = self._read_through(
+            "mail_from",
+            names,
+            self.get_mail_from_domain_attributes_bulk,
+            MailFromDomainAttributes,
+        )
+        for name in names:
+            self._prefetched_dkim[name] = dkim_attributes.get(name)
+            self._prefetched_mail_from[name] = mail_from_attributes.get(name)
+
+    def _read_through(
+        self,
+        kind: str,
+        names: List[str],
+        read: Callable[[List[str]], dict],
+        model: type,
+    ) -> dict:
+        """Answer from the state cache, reading only the missing identities
+
+        Args:
+            kind (str): The kind of state cached, dkim or mail_from
+            names (List[str]): The identities to read
+            read (Callable): Bulk read of the identities not cached
+            model (type): Dataclass the cached values are loaded into
+
+        Returns:
+            dict: Attributes by identity, identities that do not exist are
+                left out
+        """
+        cached = state_cache.get_many(kind, names, self.region)
+        found = {name: model(**value) for name, value in cached.items()}
+        missing = [name for name in names if name not in cached]
+        if missing:
+            attributes = read(missing)
+            state_cache.put_many(
+                kind,
+                {name: asdict(value) for name, value in attributes.items()},
+                self.region,
+            )
+            found.update(attributes)
+        return found
 
     def add_dkim_attributes(self, new: DkimAttributes) -> DkimAttributes:
         identity = self.get_dkim_attributes(new.name)
         if identity:
             new = identity
         else:
-            response = self.client.verify_domain_dkim(Domain=new.name)
-            new.dkim_tokens = response["DkimTokens"]
-            new.verification_status = "Pending"
+            new = self.verify_domain_dkim(new)
+        return new
+
+    def verify_domain_dkim(self, new: DkimAttributes) -> DkimAttributes:
+        state_cache.invalidate("dkim", [new.name], self.region)
+        response = self.client.verify_domain_dkim(Domain=new.name)
+        new.dkim_tokens = response["DkimTokens"]
+        new.verification_status = "Pending"
         return new
 
     def get_dkim_attributes(self, name: str) -> Optional[DkimAttributes]:
-        identities = self.client.get_identity_dkim_attributes(Identities=[name])
-        if name in identities["DkimAttributes"]:
-            attributes = identities["DkimAttributes"][name]
-            return DkimAttributes(
-                name=name,
-                dkim_tokens=attributes["DkimTokens"],
-                verification_status=attributes["DkimVerificationStatus"],
-            )
-        else:
-            return None
+        if name in self._prefetched_dkim:
+            return self._prefetched_dkim.pop(name)
+        return self._read_through(
+            "dkim", [name], self.get_dkim_attributes_bulk, DkimAttributes
+        ).get(name)
+
+    def get_dkim_attributes_bulk(
+        self, names: Iterable[str]
+    ) -> Dict[str, DkimAttributes]:
+        """Read the DKIM attributes of many identities, 100 per request
+
+        Args:
+            names (Iterable[str]): The identities to read
+
+        Returns:
+            Dict[str, DkimAttributes]: Attributes by identity, identities that
+                do not exist are left out
+        """
+        attributes_by_name = {}
+        for chunk in chunked(names, MAX_IDENTITIES_PER_REQUEST):
+            identities = self.client.get_identity_dkim_attributes(Identities=chunk)
+            for name, attributes in identities["DkimAttributes"].items():
+                attributes_by_name[name] = DkimAttributes(
+                    name=name,
+                    dkim_tokens=attributes["DkimTokens"],
+                    verification_status=attributes["DkimVerificationStatus"],
+                )
+        return attributes_by_name
 
     def add_mail_from_domain_attributes(self, new: MailFromDomainAttributes):
         attributes = self.get_mail_from_domain_attributes(new.name)
         if attributes and new.mail_from_domain:
             new = attributes
         else:
-            self.client.set_identity_mail_from_domain(
-                Identity=new.name,
-                BehaviorOnMXFailure=new.behavior_on_mx_failure,
-                MailFromDomain=new.mail_from_domain,
-            )
-            new.mail_from_domain_status = "Pending"
+            new = self.set_mail_from_domain_attributes(new)
+        return new
+
+    def set_mail_from_domain_attributes(
+        self, new: MailFromDomainAttributes
+    ) -> MailFromDomainAttributes:
+        state_cache.invalidate("mail_from", [new.name], self.region)
+        self.client.set_identity_mail_from_domain(
+            Identity=new.name,
+            BehaviorOnMXFailure=new.behavior_on_mx_failure,
+            MailFromDomain=new.mail_from_domain,
+        )
+        new.mail_from_domain_status = "Pending"
         return new
 
     def get_mail_from_domain_attributes(
         self, name: str
     ) -> Optional[MailFromDomainAttributes]:
-        identity = self.client.get_identity_mail_from_domain_attributes(
-            Identities=[name]
-        )
-        if name in identity["MailFromDomainAttributes"]:
-            attributes = identity["MailFromDomainAttributes"][name]
-            if attributes.get("MailFromDomain", None) is None:
-                return None
-            return MailFromDomainAttributes(
-                name=name,
-                behavior_on_mx_failure=attributes["BehaviorOnMXFailure"],
-                mail_from_domain=attributes["MailFromDomain"],
-                mail_from_domain_status=attributes["MailFromDomainStatus"],
+        if name in self._prefetched_mail_from:
+            return self._prefetched_mail_from.pop(name)
+        return self._read_through(
+            "mail_from",
+            [name],
+            self.get_mail_from_domain_attributes_bulk,
+            MailFromDomainAttributes,
+        ).get(name)
+
+    def get_mail_from_domain_attributes_bulk(
+        self, names: Iterable[str]
+    ) -> Dict[str, MailFromDomainAttributes]:
+        """Read the MAIL FROM attributes of many identities, 100 per request
+
+        Args:
+            names (Iterable[str]): The identities to read
+
+        Returns:
+            Dict[str, MailFromDomainAttributes]: Attributes by identity,
+                identities without a MAIL FROM domain are left out
+        """
+        attributes_by_name = {}
+        for chunk in chunked(names, MAX_IDENTITIES_PER_REQUEST):
+            identities = self.client.get_identity_mail_from_domain_attributes(
+                Identities=chunk
             )
-        return None
+            for name, attributes in identities["MailFromDomainAttributes"].items():
+                if attributes.get("MailFromDomain", None) is None:
+                    continue
+                attributes_by_name[name] = MailFromDomainAttributes(
+                    name=name,
+                    behavior_on_mx_failure=attributes["BehaviorOnMXFailure"],
+                    mail_from_domain=attributes["MailFromDomain"],
+                    mail_from_domain_status=attributes["MailFromDomainStatus"],
+                )
+        return attributes_by_name
+
+    def reset_mail_from_domain(self, name: str):
+        """Stop using a custom MAIL FROM domain, the identity is kept"""
+        state_cache.invalidate("mail_from", [name], self.region)
+        self.client.set_identity_mail_from_domain(Identity=name)
+
+    def delete_identity(self, name: str):
+        state_cache.invalidate("dkim", [name], self.region)
+        state_cache.invalidate("mail_from", [name], self.region)
+        self.client.delete_identity(Identity=name)
+
+    def get_verification_status_bulk(self, names: Iterable[str]) -> Dict[str, str]:
+        """Read the verification status of many identities, 100 per request
+
+        Args:
+            names (Iterable[str]): The identities to read
+
+        Returns:
+            Dict[str, str]: Status by identity, e.g. Pending or Success,
+                identities that do not exist are left out
+        """
+        statuses = {}
+        for chunk in chunked(names, MAX_IDENTITIES_PER_REQUEST):
+            identities = self.client.get_identity_verification_attributes(
+                Identities=chunk
+            )
+            for name, attributes in identities["VerificationAttributes"].items():
+                statuses[name] = attributes["VerificationStatus"]
+        return statuses
 
 
 class AWSHostedZoneRepository:
-    def __init__(self) -> None:
+    def __init__(self, zone_visibility: str = "public") -> None:
+        """Resolve domains to hosted zones of the account
+
+        Args:
+            zone_visibility (str): Which zones can own a domain, public,
+                private or all. Defaults to public since SES records must be
+                publicly resolvable.
+        """
         super().__init__()
         self.client = get_client("route53")
+        self.zone_visibility = zone_visibility
+        self._lock = threading.Lock()
+        self._zones: Optional[HostedZoneTrie] = None
+
+    def list_hosted_zones(self) -> Iterator[dict]:
+        params = {}
+        while True:
+            response = self.client.list_hosted_zones(**params)
+            yield from response["HostedZones"]
+            if not response.get("IsTruncated"):
+                return
+            params["Marker"] = response["NextMarker"]
+
+    @property
+    def zones(self) -> HostedZoneTrie:
+        """Every hosted zone of the account, listed once and shared by all domains"""
+        with self._lock:
+            if self._zones is None:
+                hosted_zones = state_cache.get("zones", "hosted_zones")
+                if hosted_zones is None:
+                    hosted_zones = list(self.list_hosted_zones())
+                    state_cache.put("zones", "hosted_zones", hosted_zones)
+                zones = HostedZoneTrie()
+                for hosted_zone in hosted_zones:
+                    private = hosted_zone.get("Config", {}).get("PrivateZone", False)
+                    if self.zone_visibility == "all" or private == (
+                        self.zone_visibility == "private"
+                    ):
+                        zones.add(hosted_zone["Name"], hosted_zone["Id"])
+                self._zones = zones
+            return self._zones
 
     def get(self, domain: str) -> Optional[str]:
-        hosted_zones = self.client.list_hosted_zones_by_name(DNSName=domain)[
-            "HostedZones"
-        ]
-        hosted_zone = next(
-            (
-                hosted_zone
-                for hosted_zone in hosted_zones
-                if domain in hosted_zone["Name"]
-            ),
-            None,
-        )
-        if hosted_zone:
-            return hosted_zone["Id"]
-        return None
+        return self.zones.resolve(domain)
 
 
 class AWSHostedZoneRecordsRepository:
     def __init__(self) -> None:
         super().__init__()
         self.client = get_client("route53")
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Dict[tuple, Tuple[dict, HostedZoneRecord, list]]] = {}
+        self._pending_size: Dict[str, Tuple[int, int]] = {}
 
-    def add(self, hosted_zone_id: str, record: HostedZoneRecord):
-        values = []
-        for value in record.values:
-            values.append({"Value": value})
-
-        change = {
-            "Action": "CREATE",
+    @staticmethod
+    def as_change(record: HostedZoneRecord, action: str = "CREATE") -> dict:
+        return {
+            "Action": action,
             "ResourceRecordSet": {
                 "Name": record.name,
                 "Type": record.type,
                 "TTL": record.ttl,
-                "ResourceRecords": values,
+                "ResourceRecords": [{"Value": value} for value in record.values],
             },
         }
 
-        self.client.change_resource_record_sets(
-            HostedZoneId=hosted_zone_id,
-            ChangeBatch={
-                "Comment": "For Cerby AWS SES Integration",
-                "Changes": [change],
-            },
+    @staticmethod
+    def change_size(change: dict) -> Tuple[int, int]:
+        """Weight of a change against the ChangeBatch limits
+
+        Args:
+            change (dict): A Route53 change
+
+        Returns:
+            Tuple[int, int]: The ResourceRecord elements and Value characters
+        """
+        resource_records = change["ResourceRecordSet"].get("ResourceRecords", [])
+        weight = 2 if change["Action"] == "UPSERT" else 1
+        characters = sum(len(record["Value"]) for record in resource_records)
+        return len(resource_records) * weight, characters * weight
+
+    def add(self, hosted_zone_id: str, record: HostedZoneRecord) -> ChangeInfo:
+        change_info = ChangeInfo(hosted_zone_id=hosted_zone_id, records=[record])
+        self._submit(change_info, [self.as_change(record)])
+        return change_info
+
+    def stage(
+        self,
+        hosted_zone_id: str,
+        record: HostedZoneRecord,
+        action: str = "CREATE",
+        owner: Optional[str] = None,
+    ) -> List[ChangeInfo]:
+        """Queue a record change to be sent with every other one for the zone
+
+        A record set gets one change per ChangeBatch, changes staged for the
+        same record set are merged into it, see HostedZoneRecord.merge_change.
+        When a change would not fit in the zone's pending ChangeBatch, the
+        pending one is submitted right away so memory stays bounded.
+
+        Args:
+            hosted_zone_id (str): The hosted zone to change
+            record (HostedZoneRecord): The record to change
+            action (str): CREATE, UPSERT or DELETE
+            owner (str, optional): Domain the change is made for
+
+        Returns:
+            List[ChangeInfo]: Changes submitted because the zone got full
+
+        Raises:
+            ChangeConflictException: If the change conflicts with the one
+                staged for the record set
+        """
+        full = None
+        with self._lock:
+            changes = self._pending.get(hosted_zone_id, {})
+            staged = changes.get(record.key)
+            if staged:
+                staged_change, staged_record, owners = staged
+                action, record = staged_record.merge_change(
+                    staged_change["Action"], record, action
+                )
+                change = self.as_change(record, action)
+                records, characters = self._pending_size[hosted_zone_id]
+                staged_records, staged_characters = self.change_size(staged_change)
+                change_records, change_characters = self.change_size(change)
+                self._pending_size[hosted_zone_id] = (
+                    records - staged_records + change_records,
+                    characters - staged_characters + change_characters,
+                )
+                changes[record.key] = (change, record, owners)
+            else:
+                change = self.as_change(record, action)
+                change_records, change_characters = self.change_size(change)
+                records, characters = self._pending_size.get(hosted_zone_id, (0, 0))
+                if changes and (
+                    records + change_records > MAX_RECORDS_PER_CHANGE_BATCH
+                    or characters + change_characters
+                    > MAX_VALUE_CHARACTERS_PER_CHANGE_BATCH
+                ):
+                    full = self._pending.pop(hosted_zone_id)
+                    records = characters = 0
+                self._pending_size[hosted_zone_id] = (
+                    records + change_records,
+                    characters + change_characters,
+                )
+                changes = self._pending.setdefault(hosted_zone_id, {})
+                changes[record.key] = (change, record, [])
+            owners = changes[record.key][2]
+            if owner and owner not in owners:
+                owners.append(owner)
+        return self._submit_pending(hosted_zone_id, full) if full else []
+
+    def flush(self) -> List[ChangeInfo]:
+        """Submit every staged change in as few ChangeBatch requests as possible
+
+        A failed ChangeBatch does not stop the others, its ChangeInfo carries
+        the error instead of a Change ID.
+
+        Returns:
+            List[ChangeInfo]: One entry per ChangeBatch submitted
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._pending_size = {}
+        submitted = []
+        for hosted_zone_id, changes in pending.items():
+            submitted.extend(self._submit_pending(hosted_zone_id, changes))
+        return submitted
+
+    def _submit_pending(self, hosted_zone_id: str, changes: dict) -> List[ChangeInfo]:
+        submitted = []
+        batch: List[dict] = []
+        change_info = ChangeInfo(hosted_zone_id=hosted_zone_id)
+        records = characters = 0
+        for change, record, owners in changes.values():
+            change_records, change_characters = self.change_size(change)
+            if batch and (
+                records + change_records > MAX_RECORDS_PER_CHANGE_BATCH
+                or characters + change_characters
+                > MAX_VALUE_CHARACTERS_PER_CHANGE_BATCH
+            ):
+                submitted.append(self._submit(change_info, batch, raise_error=False))
+                batch = []
+                change_info = ChangeInfo(hosted_zone_id=hosted_zone_id)
+                records = characters = 0
+            batch.append(change)
+            change_info.records.append(record)
+            change_info.domains.extend(
+                owner for owner in owners if owner not in change_info.domains
+            )
+            records += change_records
+            characters += change_characters
+        if batch:
+            submitted.append(self._submit(change_info, batch, raise_error=False))
+        return submitted
+
+    def _submit(
+        self, change_info: ChangeInfo, changes: List[dict], raise_error: bool = True
+    ) -> ChangeInfo:
+        state_cache.invalidate(
+            "records",
+            [
+                self.cache_key(change_info.hosted_zone_id, domain)
+                for record in change_info.records
+                for domain in self.parent_names(record.name)
+            ],
         )
+        try:
+            response = self.client.change_resource_record_sets(
+                HostedZoneId=change_info.hosted_zone_id,
+                ChangeBatch={
+                    "Comment": "For Cerby AWS SES Integration",
+                    "Changes": changes,
+                },
+            )
+        except ClientError as e:
+            if raise_error:
+                raise
+            change_info.status = "FAILED"
+            change_info.error = e.response["Error"]["Message"]
+            return change_info
+        change_info.id = response["ChangeInfo"]["Id"]
+        change_info.status = response["ChangeInfo"]["Status"]
+        return change_info
+
+    def get_change(self, change_id: str) -> str:
+        """Read the status of a submitted change
+
+        Args:
+            change_id (str): Id of the ChangeInfo returned on submission
+
+        Returns:
+            str: PENDING or INSYNC
+        """
+        response = self.client.get_change(Id=change_id)
+        return response["ChangeInfo"]["Status"]
+
+    def iter(
+        self,
+        hosted_zone_id: str,
+        start_name: Optional[str] = None,
+        start_type: Optional[str] = None,
+        include_subdomains: bool = True,
+    ) -> Iterator[HostedZoneRecord]:
+        """Lazily walk the record sets of a hosted zone, one page at a time
+
+        Route53 sorts record sets by name with the labels reversed, so a
+        domain and all its subdomains are contiguous. Starting at start_name
+        the walk stops as soon as it leaves that name (or its subtree), which
+        keeps reads proportional to the neighborhood instead of the zone.
 
-    def get(self, hosted_zone_id: str) -> List[HostedZoneRecord]:
-        response = self.client.list_resource_record_sets(HostedZoneId=hosted_zone_id)
-        resource_record_sets = response["ResourceRecordSets"]
-        records = []
-        for record_set in resource_record_sets:
-            values = []
-            if record_set.get("Type", "") in ["CNAME", "TXT", "MX"]:
-                for resource_record in record_set.get("ResourceRecords", []):
-                    values.append(resource_record["Value"])
-                records.append(
-                    HostedZoneRecord(
-                        record_set.get("Name"),
-                        record_set.get("Type"),
+        Args:
+            hosted_zone_id (str): The hosted zone to read
+            start_name (str, optional): Only read this name, defaults to the
+                whole zone
+            start_type (str, optional): Only read records of this type
+            include_subdomains (bool): Also read the names below start_name
+
+        Yields:
+            HostedZoneRecord: The CNAME, TXT and MX records found
+        """
+        params = {"HostedZoneId": hosted_zone_id}
+        if start_name:
+            params["StartRecordName"] = start_name
+            if start_type:
+                params["StartRecordType"] = start_type
+
+        while True:
+            response = self.client.list_resource_record_sets(**params)
+            for record_set in response["ResourceRecordSets"]:
+                name = record_set.get("Name")
+                record_type = record_set.get("Type", "")
+                if start_name:
+                    if normalize_fqdn(name) == normalize_fqdn(start_name):
+                        if start_type and not include_subdomains:
+                            if record_type != start_type:
+                                return
+                    elif not include_subdomains or not is_subdomain(name, start_name):
+                        return
+                if start_type and record_type != start_type:
+                    continue
+                if record_type in MANAGED_RECORD_TYPES:
+                    yield HostedZoneRecord(
+                        name,
+                        record_type,
                         record_set.get("TTL", 0),
-                        values,
+                        [
+                            resource_record["Value"]
+                            for resource_record in record_set.get("ResourceRecords", [])
+                        ],
                     )
-                )
-        return records
+
+            if not response.get("IsTruncated"):
+                return
+            params["StartRecordName"] = response["NextRecordName"]
+            params["StartRecordType"] = response["NextRecordType"]
+            if "NextRecordIdentifier" in response:
+                params["StartRecordIdentifier"] = response["NextRecordIdentifier"]
+            else:
+                params.pop("StartRecordIdentifier", None)
+
+    def get(
+        self,
+        hosted_zone_id: str,
+        start_name: Optional[str] = None,
+        start_type: Optional[str] = None,
+        include_subdomains: bool = True,
+    ) -> List[HostedZoneRecord]:
+        return list(
+            self.iter(hosted_zone_id, start_name, start_type, include_subdomains)
+        )
+
+    def get_domain_records(
+        self, hosted_zone_id: str, domain: str
+    ) -> Iterator[HostedZoneRecord]:
+        """Read only the names SES setup writes for a domain
+
+        Args:
+            hosted_zone_id (str): The hosted zone owning the domain
+            domain (str): The domain being configured
+
+        Yields:
+            HostedZoneRecord: Records of <domain>, bounce.<domain> and
+                *._domainkey.<domain>
+        """
+        key = self.cache_key(hosted_zone_id, domain)
+        cached = state_cache.get("records", key)
+        if cached is not None:
+            yield from (HostedZoneRecord(**record) for record in cached)
+            return
+        records = [
+            *self.iter(hosted_zone_id, domain, include_subdomains=False),
+            *self.iter(hosted_zone_id, f"bounce.{domain}", include_subdomains=False),
+            *self.iter(hosted_zone_id, f"_domainkey.{domain}"),
+        ]
+        state_cache.put("records", key, [asdict(record) for record in records])
+        yield from records
+
+    @staticmethod
+    def cache_key(hosted_zone_id: str, domain: str) -> str:
+        return f"{hosted_zone_id} {normalize_fqdn(domain)}"
+
+    @staticmethod
+    def parent_names(name: str) -> List[str]:
+        """Domains whose cached records a change to the name affects
+
+        Args:
+            name (str): The DNS name changed
+
+        Returns:
+            List[str]: The name and every name above it
+        """
+        labels = normalize_fqdn(name).split(".")
+        return [".".join(labels[index:]) for index in range(len(labels) - 1)]
 
 
 class AWSReceiptRulesRepository:
-    def __init__(self) -> None:
+    def __init__(self, region: Optional[str] = None) -> None:
         super().__init__()
-        self.client = get_client("ses")
+        self.region = region
+        self.client = get_client("ses", region)
 
     def create_receipt_rule_set(self, rule_set_name: str):
+        state_cache.invalidate("rule_set", region=self.region)
         try:
             self.client.create_receipt_rule_set(RuleSetName=rule_set_name)
         except ClientError as e:
@@ -162,6 +610,7 @@ class AWSReceiptRulesRepository:
             raise
 
     def set_active_receipt_rule_set(self, rule_set_name: str):
+        state_cache.invalidate("rule_set", region=self.region)
         try:
             self.client.set_active_receipt_rule_set(RuleSetName=rule_set_name)
         except ClientError as e:
@@ -172,10 +621,19 @@ class AWSReceiptRulesRepository:
                 )
             raise
 
-    def create_receipt_rule(self, rule: ReceiptRule):
+    def create_receipt_rule(self, rule: ReceiptRule, after: Optional[str] = None):
+        """Add a rule to its rule set
+
+        Args:
+            rule (ReceiptRule): The rule to create
+            after (str, optional): The rule to place it after, SES puts it
+                first in the rule set when not given
+        """
+        state_cache.invalidate("rule_set", region=self.region)
+        params = {"After": after} if after else {}
         try:
             self.client.create_receipt_rule(
-                RuleSetName=rule.rule_set_name, Rule=rule.rule
+                RuleSetName=rule.rule_set_name, Rule=rule.rule, **params
             )
         except ClientError as e:
             error_code = e.response["Error"]["Code"]
@@ -184,3 +642,86 @@ class AWSReceiptRulesRepository:
                     f"Rule set '{rule.name}' already exists."
                 )
             raise
+
+    def update_receipt_rule(self, rule: ReceiptRule):
+        state_cache.invalidate("rule_set", region=self.region)
+        self.client.update_receipt_rule(RuleSetName=rule.rule_set_name, Rule=rule.rule)
+
+    def delete_receipt_rule(self, rule: ReceiptRule):
+        state_cache.invalidate("rule_set", region=self.region)
+        self.client.delete_receipt_rule(
+            RuleSetName=rule.rule_set_name, RuleName=rule.name
+        )
+
+    def delete_receipt_rule_set(self, rule_set_name: str):
+        state_cache.invalidate("rule_set", region=self.region)
+        self.client.delete_receipt_rule_set(RuleSetName=rule_set_name)
+
+    def deactivate_receipt_rule_set(self):
+        """Leave the region without an active rule set"""
+        state_cache.invalidate("rule_set", region=self.region)
+        self.client.set_active_receipt_rule_set()
+
+    def list_receipt_rule_sets(self) -> List[str]:
+        """Read the names of every rule set of the region
+
+        Returns:
+            List[str]: The rule set names
+        """
+        names = []
+        params = {}
+        while True:
+            response = self.client.list_receipt_rule_sets(**params)
+            names.extend(rule_set["Name"] for rule_set in response.get("RuleSets", []))
+            if not response.get("NextToken"):
+                return names
+            params["NextToken"] = response["NextToken"]
+
+    def get_receipt_rule_set(self, rule_set_name: str) -> Optional[List[ReceiptRule]]:
+        """Read the rules of a rule set
+
+        Args:
+            rule_set_name (str): The rule set to describe
+
+        Returns:
+            Optional[List[ReceiptRule]]: The rules, None if the set does not exist
+        """
+        rules = state_cache.get("rule_set", rule_set_name, self.region)
+        if rules is None:
+            try:
+                response = self.client.describe_receipt_rule_set(
+                    RuleSetName=rule_set_name
+                )
+            except ClientError as e:
+                if e.response["Error"]["Code"] == "RuleSetDoesNotExist":
+                    return None
+                raise
+            rules = response.get("Rules", [])
+            state_cache.put("rule_set", rule_set_name, rules, self.region)
+        return [
+            ReceiptRule(name=rule["Name"], rule_set_name=rule_set_name, rule=rule)
+            for rule in rules
+        ]
+
+    def get_active_receipt_rule_set(self) -> Tuple[Optional[str], List[ReceiptRule]]:
+        """Read the active rule set of the region
+
+        Returns:
+            Tuple[Optional[str], List[ReceiptRule]]: The name and rules of the
+                active rule set, None and no rules when none is active
+        """
+        response = state_cache.get("rule_set", ACTIVE_RULE_SET_KEY, self.region)
+        if response is None:
+            response = self.client.describe_active_receipt_rule_set()
+            response = {
+                "Metadata": response.get("Metadata", {}),
+                "Rules": response.get("Rules", []),
+            }
+            state_cache.put("rule_set", ACTIVE_RULE_SET_KEY, response, self.region)
+        rule_set_name = response["Metadata"].get("Name")
+        if not rule_set_name:
+            return None, []
+        return rule_set_name, [
+            ReceiptRule(name=rule["Name"], rule_set_name=rule_set_name, rule=rule)
+            for rule in response["Rules"]
+        ]
@@ -0,0 +1,253 @@
+import json
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from dns_provider import DNSProvider
+from exceptions import ConfigurationException
+from export import zone_value
+from models import ChangeInfo, HostedZoneRecord, HostedZoneTrie
+from utils import is_subdomain, normalize_fqdn
+
+try:
+    import dns.exception
+    import dns.name
+    import dns.query
+    import dns.rcode
+    import dns.rdatatype
+    import dns.tsig
+    import dns.update
+except ImportError:  # optional, only needed for zones outside Route53
+    dns = None
+
+# Prefix of the zone ids of RFC 2136 zones, e.g. rfc2136:corp.example.com.
+ZONE_ID_PREFIX = "rfc2136:"
+
+# Record changes per UPDATE message, so it stays under the 64KB TCP limit
+MAX_RECORDS_PER_UPDATE = 500
+
+DEFAULT_TIMEOUT = 10.0
+
+
+@dataclass
+class RFC2136Zone:
+    zone: str
+    server: str
+    port: int = 53
+    key_name: Optional[str] = None
+    key_secret: Optional[str] = None
+    key_algorithm: str = "hmac-sha256"
+    timeout: float = DEFAULT_TIMEOUT
+
+    @property
+    def id(self) -> str:
+        return ZONE_ID_PREFIX + normalize_fqdn(self.zone)
+
+    @property
+    def origin(self) -> str:
+        return normalize_fqdn(self.zone)
+
+    def key(self):
+        """The TSIG key signing every message to the zone, None when unsigned"""
+        if not self.key_name:
+            return None
+        return dns.tsig.Key(self.key_name, self.key_secret, self.key_algorithm)
+
+
+def read_zones(path: str) -> List[RFC2136Zone]:
+    """Read the zones served by authoritative servers accepting dynamic updates
+
+    The file is a JSON list with the zone, its primary server and the TSIG
+    key allowed to update it:
+
+        [{"zone": "corp.example.com", "server": "10.0.0.53",
+          "key_name": "cerby", "key_secret": "<base64>",
+          "key_algorithm": "hmac-sha256"}]
+
+    Args:
+        path (str): The zones file
+
+    Returns:
+        List[RFC2136Zone]: One entry per zone
+    """
+    with open(path) as zones_file:
+        return [RFC2136Zone(**item) for item in json.load(zones_file)]
+
+
+class RFC2136Provider(DNSProvider):
+    """Zones of BIND, PowerDNS or any server taking RFC 2136 dynamic updates
+
+    Each zone is read once with a zone transfer and shared by its domains.
+    Staged changes are sent on flush as one TSIG signed UPDATE message per
+    zone, which the server applies atomically, so the changes are in sync as
+    soon as they are accepted.
+    """
+
+    def __init__(self, zones: List[RFC2136Zone]) -> None:
+        if dns is None:
+            raise ConfigurationException(
+                "RFC 2136 zones need dnspython, pip install dnspython"
+            )
+        self.zones = {zone.id: zone for zone in zones}
+        self._trie = HostedZoneTrie()
+        for zone in zones:
+            self._trie.add(zone.zone, zone.id)
+        self._lock = threading.Lock()
+        self._zone_locks = {zone_id: threading.Lock() for zone_id in self.zones}
+        self._records: Dict[str, List[HostedZoneRecord]] = {}
+        self._pending: Dict[str, Dict[tuple, Tuple[HostedZoneRecord, str, list]]] = {}
+
+    def get(self, domain: str) -> Optional[str]:
+        return self._trie.resolve(domain)
+
+    def transfer(self, zone: RFC2136Zone) -> List[HostedZoneRecord]:
+        """Read every record of a zone with AXFR
+
+        Args:
+            zone (RFC2136Zone): The zone to read
+
+        Returns:
+            List[HostedZoneRecord]: One record per name and type
+        """
+        key = zone.key()
+        records: Dict[tuple, HostedZoneRecord] = {}
+        for message in dns.query.xfr(
+            zone.server,
+            zone.origin,
+            port=zone.port,
+            keyring=key,
+            keyname=key.name if key else None,
+            lifetime=zone.timeout,
+            relativize=False,
+        ):
+            for rrset in message.answer:
+                record = HostedZoneRecord(
+                    name=rrset.name.to_text(),
+                    type=dns.rdatatype.to_text(rrset.rdtype),
+                    ttl=rrset.ttl,
+                )
+                record = records.setdefault(record.key, record)
+                for rdata in rrset:
+                    value = rdata.to_text()
+                    if value not in record.values:
+                        record.values.append(value)
+        return list(records.values())
+
+    def zone_records(self, hosted_zone_id: str) -> List[HostedZoneRecord]:
+        with self._zone_locks[hosted_zone_id]:
+            if hosted_zone_id not in self._records:
+                zone = self.zones[hosted_zone_id]
+                self._records[hosted_zone_id] = self.transfer(zone)
+            return self._records[hosted_zone_id]
+
+    def get_domain_records(
+        self, hosted_zone_id: str, domain: str
+    ) -> Iterator[HostedZoneRecord]:
+        names = [normalize_fqdn(domain), normalize_fqdn(f"bounce.{domain}")]
+        for record in self.zone_records(hosted_zone_id):
+            name = normalize_fqdn(record.name)
+            if name in names or is_subdomain(name, f"_domainkey.{domain}"):
+                yield record
+
+    def stage(
+        self,
+        hosted_zone_id: str,
+        record: HostedZoneRecord,
+        action: str = "CREATE",
+        owner: Optional[str] = None,
+    ) -> List[ChangeInfo]:
+        """Queue a record change to be sent with every other one for the zone
+
+        Changes staged for the same record set are merged into one, like the
+        Route53 ones.
+
+        Args:
+            hosted_zone_id (str): The zone to change
+            record (HostedZoneRecord): The record to change
+            action (str): CREATE, UPSERT or DELETE
+            owner (str, optional): Domain the change is made for
+
+        Returns:
+            List[ChangeInfo]: Always empty, changes are only sent on flush
+
+        Raises:
+            ChangeConflictException: If the change conflicts with the one
+                staged for the record set
+        """
+        with self._lock:
+            changes = self._pending.setdefault(hosted_zone_id, {})
+            owners = []
+            if record.key in changes:
+                staged_record, staged_action, owners = changes[record.key]
+                action, record = staged_record.merge_change(
+                    staged_action, record, action
+                )
+            changes[record.key] = (record, action, owners)
+            if owner and owner not in owners:
+                owners.append(owner)
+        return []
+
+    def flush(self) -> List[ChangeInfo]:
+        """Send the staged changes as one UPDATE message per zone
+
+        A refused or failed update does not stop the other zones, its
+        ChangeInfo carries the error.
+
+        Returns:
+            List[ChangeInfo]: One entry per UPDATE message sent
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        submitted = []
+        for hosted_zone_id, changes in pending.items():
+            staged = list(changes.values())
+            for start in range(0, len(staged), MAX_RECORDS_PER_UPDATE):
+                chunk = staged[start : start + MAX_RECORDS_PER_UPDATE]
+                submitted.append(self._submit(hosted_zone_id, chunk))
+            with self._zone_locks[hosted_zone_id]:
+                self._records.pop(hosted_zone_id, None)
+        return submitted
+
+    def _submit(
+        self, hosted_zone_id: str, changes: List[Tuple[HostedZoneRecord, str, list]]
+    ) -> ChangeInfo:
+        zone = self.zones[hosted_zone_id]
+        change_info = ChangeInfo(hosted_zone_id=hosted_zone_id)
+        key = zone.key()
+        update = dns.update.UpdateMessage(
+            zone.origin, keyring=key, keyname=key.name if key else None
+        )
+        for record, action, owners in changes:
+            name = dns.name.from_text(record.name)
+            values = [zone_value(record.type, value) for value in record.values]
+            if action == "DELETE":
+                update.delete(name, record.type)
+            elif action == "CREATE":
+                # like Route53, creating a record that exists fails the update
+                update.absent(name, record.type)
+                update.add(name, record.ttl, record.type, *values)
+            else:
+                update.replace(name, record.ttl, record.type, *values)
+            change_info.records.append(record)
+            change_info.domains.extend(
+                owner for owner in owners if owner not in change_info.domains
+            )
+        try:
+            response = dns.query.tcp(
+                update, zone.server, port=zone.port, timeout=zone.timeout
+            )
+        except (dns.exception.DNSException, EOFError, OSError) as e:
+            # EOFError when the server drops the connection, e.g. a bad key
+            change_info.status = "FAILED"
+            change_info.error = f"Update of {zone.origin} failed: {e}"
+            return change_info
+        if response.rcode() != dns.rcode.NOERROR:
+            change_info.status = "FAILED"
+            change_info.error = (
+                f"Update of {zone.origin} refused:"
+                f" {dns.rcode.to_text(response.rcode())}"
+            )
+            return change_info
+        change_info.id = f"{hosted_zone_id}/{update.id}"
+        change_info.status = "INSYNC"
+        return change_info
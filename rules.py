@@ -0,0 +1,345 @@
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from aws import get_current_region
+from exceptions import (
+    CerbyException,
+    ConfigurationException,
+    RuleSetAlreadyExistsException,
+)
+from models import ReceiptRule
+from repository import AWSReceiptRulesRepository
+from utils import extract_main_domain
+
+# SES receipt rule limits
+MAX_RECIPIENTS_PER_RULE = 100
+MAX_RULES_PER_RULE_SET = 200
+
+# Rule set created when the region has no active one, SES only evaluates the
+# active rule set so Cerby rules are added to it whenever there is one.
+CERBY_RULE_SET_NAME = "rule-set-for-cerby"
+CERBY_RULE_PREFIX = "cerby-proxy-"
+
+# Errors of a rule set or rule write, they only fail the domains of the write
+RULE_WRITE_ERRORS = (ClientError, BotoCoreError, CerbyException)
+
+# Rule sets older versions created for each main domain, e.g.
+# rule-set-for-cerby-company for cerby.company.com and mail.company.com, with
+# a single rule of the same name receiving every recipient
+LEGACY_RULE_SET_PREFIX = "rule-set-for-cerby-"
+
+# Bucket the Cerby proxy rules store incoming email in, by region
+PROXY_BUCKETS = {
+    "us-east-1": "cerby-store-ses-email-production",
+    "us-west-2": "cerby-store-ses-email-production",
+    "eu-west-1": "cerby-store-ses-email-production",
+    "ca-central-1": "cerby-store-ses-email-production-ca-central-1",
+}
+
+
+def proxy_bucket(region: str) -> str:
+    """The Cerby bucket of a region
+
+    Raises:
+        ConfigurationException: If Cerby does not receive email in the region
+    """
+    if region not in PROXY_BUCKETS:
+        raise ConfigurationException(f"No Cerby bucket receives email in {region}")
+    return PROXY_BUCKETS[region]
+
+
+def legacy_rule_set_name(domain: str) -> str:
+    main_domain = extract_main_domain(domain)
+    return f"{LEGACY_RULE_SET_PREFIX}{main_domain}"[:100]  # max length is 100
+
+
+@dataclass
+class RuleChange:
+    action: str
+    rule: ReceiptRule
+    domains: List[str] = field(default_factory=list)
+
+
+class ReceiptRuleManager:
+    """Keeps every Cerby domain of a region in one receipt rule set
+
+    Domains are packed as Recipients into Cerby proxy rules, up to 100 per
+    rule and 200 rules per set. The active rule set is read once, domains are
+    staged, and flush writes only the rules whose recipients or actions
+    changed, creating and activating the rule set only when needed. New rules
+    go after every rule of the set, the proxy rule stops the evaluation of
+    the set so it must not come before the customer's own rules.
+    """
+
+    def __init__(
+        self,
+        receipt_rules_repo: Optional[AWSReceiptRulesRepository] = None,
+        region: Optional[str] = None,
+    ) -> None:
+        self.region = region or get_current_region()
+        self.receipt_rules_repo = receipt_rules_repo or AWSReceiptRulesRepository(
+            region
+        )
+        self.rule_set_name = CERBY_RULE_SET_NAME
+        self.rules: List[ReceiptRule] = []
+        self.exists = False
+        self.active = False
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._pending: Dict[str, None] = {}
+        self._removed: Dict[str, None] = {}
+
+    def load(self):
+        """Read the active rule set, or the Cerby one when none is active, once"""
+        with self._lock:
+            if self._loaded:
+                return
+            name, rules = self.receipt_rules_repo.get_active_receipt_rule_set()
+            if name:
+                self.rule_set_name, self.rules = name, rules
+                self.exists = self.active = True
+            else:
+                rules = self.receipt_rules_repo.get_receipt_rule_set(self.rule_set_name)
+                self.exists = rules is not None
+                self.rules = rules or []
+            self._loaded = True
+
+    @property
+    def cerby_rules(self) -> List[ReceiptRule]:
+        return [rule for rule in self.rules if rule.name.startswith(CERBY_RULE_PREFIX)]
+
+    def proxy_rule(self, name: str, recipients: List[str]) -> ReceiptRule:
+        rule = ReceiptRule(name=name, rule_set_name=self.rule_set_name)
+        rule.create_proxy_rule(bucket_name=proxy_bucket(self.region), prefix="staged")
+        rule.rule["Recipients"] = recipients
+        return rule
+
+    def rules_for(self, domain: str) -> List[ReceiptRule]:
+        """The Cerby rules receiving the domain's email"""
+        self.load()
+        domain = domain.lower()
+        with self._lock:
+            return [
+                rule
+                for rule in self.cerby_rules
+                if domain in rule.rule.get("Recipients", [])
+            ]
+
+    def covers(self, domain: str) -> bool:
+        """Whether a Cerby rule already receives the domain's email
+
+        The legacy rule set of the domain's main domain covers it while it is
+        the active rule set.
+        """
+        return bool(self.rules_for(domain)) or self.legacy_covers(domain)
+
+    def legacy_covers(self, domain: str) -> bool:
+        """Whether the active rule set is the legacy one of the domain"""
+        self.load()
+        name = legacy_rule_set_name(domain)
+        if not self.active or self.rule_set_name != name:
+            return False
+        domain = domain.lower()
+        with self._lock:
+            # a rule without recipients receives every one of them
+            return any(
+                rule.name == name
+                and domain in (rule.rule.get("Recipients") or [domain])
+                for rule in self.rules
+            )
+
+    def stage(self, domain: str):
+        """Queue a domain to be added to the Cerby rules on flush
+
+        Args:
+            domain (str): The domain to receive email for
+        """
+        if not self.covers(domain):
+            with self._lock:
+                self._pending[domain.lower()] = None
+
+    def remove(self, domain: str):
+        """Queue a domain to be taken out of the Cerby rules on flush
+
+        Args:
+            domain (str): The domain to stop receiving email for
+        """
+        if self.covers(domain):
+            with self._lock:
+                self._removed[domain.lower()] = None
+
+    def removals(self, domains: List[str]) -> List[RuleChange]:
+        """Take domains out of the Cerby rules
+
+        Args:
+            domains (List[str]): Domains to remove from the recipients
+
+        Returns:
+            List[RuleChange]: Rules to update, or to delete once they are left
+                without recipients
+        """
+        removed = set(domains)
+        changes = []
+        for rule in self.cerby_rules:
+            recipients = rule.rule.get("Recipients", [])
+            hit = [domain for domain in recipients if domain in removed]
+            if not hit:
+                continue
+            kept = [domain for domain in recipients if domain not in removed]
+            desired = ReceiptRule(
+                rule.name, rule.rule_set_name, {**rule.rule, "Recipients": kept}
+            )
+            changes.append(RuleChange("UPDATE" if kept else "DELETE", desired, hit))
+        return changes
+
+    def changes(self, domains: List[str]) -> List[RuleChange]:
+        """Pack domains into the Cerby rules
+
+        Rules with room left are filled first, then new rules are added while
+        the rule set has room. Existing rules whose actions drifted from the
+        proxy rule are updated as well.
+
+        Args:
+            domains (List[str]): Domains not covered by any rule yet
+
+        Returns:
+            List[RuleChange]: Rules to create or update, domains that do not
+                fit are left out
+        """
+        changes: Dict[str, RuleChange] = {}
+        for rule in self.cerby_rules:
+            recipients = list(rule.rule.get("Recipients", []))
+            desired = self.proxy_rule(rule.name, recipients)
+            action = "NOOP" if desired.matches(rule) else "UPDATE"
+            changes[rule.name] = RuleChange(action, desired)
+
+        rule_count = len(self.rules)
+        next_index = 1 + max(
+            [
+                int(rule.name[len(CERBY_RULE_PREFIX) :])
+                for rule in self.cerby_rules
+                if rule.name[len(CERBY_RULE_PREFIX) :].isdigit()
+            ]
+            or [0]
+        )
+        for domain in domains:
+            change = next(
+                (
+                    change
+                    for change in changes.values()
+                    if len(change.rule.rule["Recipients"]) < MAX_RECIPIENTS_PER_RULE
+                ),
+                None,
+            )
+            if change is None:
+                if rule_count >= MAX_RULES_PER_RULE_SET:
+                    continue
+                name = f"{CERBY_RULE_PREFIX}{next_index:03d}"
+                change = RuleChange("CREATE", self.proxy_rule(name, []))
+                changes[name] = change
+                rule_count += 1
+                next_index += 1
+            elif change.action == "NOOP":
+                change.action = "UPDATE"
+            change.rule.rule["Recipients"].append(domain)
+            change.domains.append(domain)
+        return [change for change in changes.values() if change.action != "NOOP"]
+
+    def flush(self) -> Dict[str, str]:
+        """Write the staged domains in as few rule updates as possible
+
+        Removed domains are taken out first, so their room is reused. A failed
+        rule write only fails the domains added to or removed from that rule.
+
+        Returns:
+            Dict[str, str]: Error by domain, for the staged domains that could
+                not be added
+        """
+        self.load()
+        with self._lock:
+            removed, self._removed = list(self._removed), {}
+            removals = self.removals(removed)
+        failures = self._write_removals(removals)
+        with self._lock:
+            pending, self._pending = list(self._pending), {}
+            changes = self.changes(pending)
+        packed = {domain for change in changes for domain in change.domains}
+        for domain in pending:
+            if domain not in packed:
+                failures[domain] = (
+                    f"Rule set '{self.rule_set_name}' is full,"
+                    f" {MAX_RULES_PER_RULE_SET} rules of"
+                    f" {MAX_RECIPIENTS_PER_RULE} recipients"
+                )
+        if not changes:
+            return failures
+
+        try:
+            self._create_rule_set()
+        except RULE_WRITE_ERRORS as e:
+            return {**failures, **{domain: str(e) for domain in packed}}
+
+        written = []
+        for change in changes:
+            try:
+                if change.action == "CREATE":
+                    with self._lock:
+                        last = self.rules[-1].name if self.rules else None
+                    self.receipt_rules_repo.create_receipt_rule(change.rule, last)
+                else:
+                    self.receipt_rules_repo.update_receipt_rule(change.rule)
+            except RULE_WRITE_ERRORS as e:
+                failures.update({domain: str(e) for domain in change.domains})
+                continue
+            written.append(change)
+            with self._lock:
+                self._put_rule(change.rule)
+
+        if written and not self.active:
+            try:
+                self.receipt_rules_repo.set_active_receipt_rule_set(self.rule_set_name)
+                self.active = True
+            except RULE_WRITE_ERRORS as e:
+                for change in written:
+                    failures.update({domain: str(e) for domain in change.domains})
+        return failures
+
+    def _write_removals(self, removals: List[RuleChange]) -> Dict[str, str]:
+        failures: Dict[str, str] = {}
+        for change in removals:
+            try:
+                if change.action == "DELETE":
+                    self.receipt_rules_repo.delete_receipt_rule(change.rule)
+                else:
+                    self.receipt_rules_repo.update_receipt_rule(change.rule)
+            except RULE_WRITE_ERRORS as e:
+                failures.update({domain: str(e) for domain in change.domains})
+                continue
+            with self._lock:
+                if change.action == "DELETE":
+                    self.rules = [
+                        rule for rule in self.rules if rule.name != change.rule.name
+                    ]
+                else:
+                    self._put_rule(change.rule)
+        return failures
+
+    def _put_rule(self, rule: ReceiptRule):
+        """Replace a rule in place, or add it last, following the rule set"""
+        names = [existing.name for existing in self.rules]
+        if rule.name in names:
+            self.rules[names.index(rule.name)] = rule
+        else:
+            self.rules.append(rule)
+
+    def _create_rule_set(self):
+        if self.exists:
+            return
+        try:
+            self.receipt_rules_repo.create_receipt_rule_set(self.rule_set_name)
+        except RuleSetAlreadyExistsException:
+            pass
+        self.exists = True
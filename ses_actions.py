@@ -1,16 +1,18 @@
+from concurrent.futures import Executor
 from functools import cached_property
+from typing import Dict, List, Optional, Tuple
+
+from botocore.exceptions import BotoCoreError, ClientError
 
 from aws import get_current_region
-from exceptions import (
-    RuleAlreadyExistsException,
-    RuleSetAlreadyExistsException,
-    RuleSetDoesNotExistException,
-)
+from exceptions import ChangeBatchFailedException, ReceiptRuleFailedException
+from metrics import timed
 from models import (
+    ChangeInfo,
     DkimAttributes,
     HostedZoneRecord,
     MailFromDomainAttributes,
-    ReceiptRule,
+    ResourceIndex,
 )
 from repository import (
     AWSHostedZoneRecordsRepository,
@@ -18,100 +20,310 @@ from repository import (
     AWSIdentityRepository,
     AWSReceiptRulesRepository,
 )
-from utils import extract_main_domain, generate_random_string, prints
+from rules import ReceiptRuleManager
+from utils import Step, prints, run_graph
+
+# Most steps of a domain that run at once, its reads of the identity, hosted
+# zone records and rule set
+MAX_PARALLEL_STEPS = 3
 
 
 class SESActions:
-    def __init__(self, domain: str):
+    def __init__(
+        self,
+        domain: str,
+        identity_repo: Optional[AWSIdentityRepository] = None,
+        hz_repo: Optional[AWSHostedZoneRepository] = None,
+        hzr_repo: Optional[AWSHostedZoneRecordsRepository] = None,
+        receipt_rules_repo: Optional[AWSReceiptRulesRepository] = None,
+        rule_manager: Optional[ReceiptRuleManager] = None,
+        region: Optional[str] = None,
+        regions: Optional[List[str]] = None,
+        hosted_zone_records: Optional[ResourceIndex] = None,
+    ):
+        """
+        Args:
+            domain (str): The domain to configure
+            region (str, optional): Region of the SES identity and receipt
+                rules, the configured one when not given
+            regions (List[str], optional): Every region the domain is set up
+                in, the MX records point to all of them. Only the region when
+                not given.
+            hosted_zone_records (ResourceIndex, optional): Records of the
+                domain already read, shared by the actions of its regions
+        """
         self.domain = domain
-        self.region = get_current_region()
-        self.identity_repo = AWSIdentityRepository()
-        self.hz_repo = AWSHostedZoneRepository()
-        self.hzr_repo = AWSHostedZoneRecordsRepository()
-        self.receipt_rules_repo = AWSReceiptRulesRepository()
+        self.region = region or get_current_region()
+        self.regions = regions or [self.region]
+        self.identity_repo = identity_repo or AWSIdentityRepository(region)
+        self.hz_repo = hz_repo or AWSHostedZoneRepository()
+        self.hzr_repo = hzr_repo or AWSHostedZoneRecordsRepository()
+        self.receipt_rules_repo = receipt_rules_repo or AWSReceiptRulesRepository(
+            region
+        )
+        self.rule_manager = rule_manager or ReceiptRuleManager(
+            self.receipt_rules_repo, self.region
+        )
         self.hosted_zone_id = self.hz_repo.get(self.domain)
+        if hosted_zone_records is not None:
+            self.hosted_zone_records = hosted_zone_records
         self.records_pending_to_create = []
         self.rules_failed_to_create = {}
+        self.changes: List[ChangeInfo] = []
+        self.staged_records: List[Tuple[HostedZoneRecord, str]] = []
 
     @cached_property
     def hosted_zone_records(self):
-        return (
-            self.hzr_repo.get(hosted_zone_id=self.hosted_zone_id)
-            if self.hosted_zone_id
-            else []
+        if not self.hosted_zone_id:
+            return ResourceIndex()
+        return ResourceIndex(
+            self.hzr_repo.get_domain_records(self.hosted_zone_id, self.domain)
         )
 
+    @cached_property
+    def dkim_attributes(self) -> Optional[DkimAttributes]:
+        return self.identity_repo.get_dkim_attributes(self.domain)
+
+    @cached_property
+    def mail_from_attributes(self) -> Optional[MailFromDomainAttributes]:
+        return self.identity_repo.get_mail_from_domain_attributes(self.domain)
+
+    @property
+    def mail_from_domain(self) -> str:
+        return f"bounce.{self.domain}"
+
+    @property
+    def rule_set_name(self) -> str:
+        return self.rule_manager.rule_set_name
+
+    def inbound_records(self) -> Dict[str, HostedZoneRecord]:
+        return {
+            "MX": HostedZoneRecord(
+                self.domain,
+                "MX",
+                600,
+                [f"10 inbound-smtp.{region}.amazonaws.com" for region in self.regions],
+            )
+        }
+
+    def mail_from_records(self) -> Dict[str, HostedZoneRecord]:
+        return {
+            "MX": HostedZoneRecord(
+                self.mail_from_domain,
+                "MX",
+                600,
+                [f"10 feedback-smtp.{region}.amazonses.com" for region in self.regions],
+            ),
+            "TXT": HostedZoneRecord(
+                self.mail_from_domain,
+                "TXT",
+                600,
+                ['"v=spf1 include:amazonses.com ~all"'],
+            ),
+        }
+
+    def desired_records(self) -> List[HostedZoneRecord]:
+        records = []
+        if self.dkim_attributes:
+            records.extend(self.dkim_attributes.dkim_tokens_as_records(self.domain))
+        records.extend(self.inbound_records().values())
+        records.extend(self.mail_from_records().values())
+        return records
+
+    @timed
+    def is_converged(self) -> bool:
+        """Check the domain already has everything the pipeline would create
+
+        Only reads, the identity attributes come from the bulk prefetch and
+        the records from the domain's neighborhood in the hosted zone.
+        Without a hosted zone the records are taken as added once SES
+        verified both the DKIM tokens and the MAIL FROM domain.
+
+        Returns:
+            bool: True when running the pipeline would not write anything
+        """
+        identity = self.dkim_attributes
+        mail_from = self.mail_from_attributes
+        if identity is None or mail_from is None:
+            return False
+        if mail_from.mail_from_domain != self.mail_from_domain:
+            return False
+        if self.hosted_zone_id:
+            if mail_from.mail_from_domain_status not in ["Pending", "Success"]:
+                return False
+            if not all(
+                record.merge_into(self.hosted_zone_records.get(record))[0] == "NOOP"
+                for record in self.desired_records()
+            ):
+                return False
+        elif (
+            identity.verification_status != "Success"
+            or mail_from.mail_from_domain_status != "Success"
+        ):
+            return False
+        return self.rule_manager.covers(self.domain)
+
+    def steps(self) -> Dict[str, Step]:
+        """The configuration of the domain as steps that depend on each other
+
+        The hosted zone records and the rule set are read once and shared by
+        the steps needing them. The MAIL FROM domain waits for the identity,
+        SES only sets it on an identity that exists, and the records and the
+        receipt rule of the domain are only staged once everything else
+        succeeded, so a failed domain leaves nothing behind in a shared batch.
+
+        Returns:
+            Dict[str, Step]: Dependencies and function by step name
+        """
+        return {
+            "identity": ([], self.set_up_identity),
+            "records": ([], lambda: self.hosted_zone_records),
+            "rule_set": ([], self.rule_manager.load),
+            "sending": (["identity", "records"], self.configure_sending_email),
+            "receiving": (["records"], self.configure_receiving_email),
+            "mail_from": (["identity"], self.set_up_mail_from),
+            "mail_from_records": (
+                ["mail_from", "records"],
+                self.configure_mail_from_domain,
+            ),
+            "rules": (
+                ["rule_set", "sending", "receiving", "mail_from_records"],
+                self.configure_email_receiving_rules,
+            ),
+        }
+
+    def configure(self, executor: Optional[Executor] = None):
+        """Configure sending, receiving, MAIL FROM and the receipt rule
+
+        Args:
+            executor (Executor, optional): Pool running independent steps at
+                once, so the domain takes about as long as its slowest branch.
+                Steps run one by one when not given.
+        """
+        run_graph(self.steps(), executor)
+
+    def set_up_identity(self):
+        if self.dkim_attributes is None:
+            self.dkim_attributes = self.identity_repo.verify_domain_dkim(
+                DkimAttributes(self.domain)
+            )
+
+    def set_up_mail_from(self):
+        if self.mail_from_attributes is None:
+            self.mail_from_attributes = (
+                self.identity_repo.set_mail_from_domain_attributes(
+                    MailFromDomainAttributes(
+                        name=self.domain, mail_from_domain=self.mail_from_domain
+                    )
+                )
+            )
+
+    def stage_record(self, record: HostedZoneRecord, action: str = "CREATE"):
+        """Keep a record change of the domain until its steps are done"""
+        self.staged_records.append((record, action))
+        self.hosted_zone_records.add(record)
+
+    def stage_record_changes(self):
+        """Hand the record changes of the domain to the records repository"""
+        staged, self.staged_records = self.staged_records, []
+        for record, action in staged:
+            self.changes.extend(
+                self.hzr_repo.stage(
+                    self.hosted_zone_id, record, action=action, owner=self.domain
+                )
+            )
+
+    def merge_record(self, record_type: str, record: HostedZoneRecord):
+        """Stage a record, merged into the existing one of the same name and type
+
+        The values of an existing MX or TXT record are kept and ours added
+        with an UPSERT. A record that can not be merged, e.g. another SPF
+        policy, is left to be added by hand.
+
+        Args:
+            record_type (str): What the record is for, e.g. MX or DKIM
+            record (HostedZoneRecord): The record the domain needs
+        """
+        action, merged = record.merge_into(self.hosted_zone_records.get(record))
+        if action == "NOOP":
+            prints(f"A {record_type} record is already present")
+        elif action == "MANUAL":
+            prints(
+                f"A different {record_type} record {record.name} is already"
+                " present, it has to be changed by hand"
+            )
+            self.records_pending_to_create.append(record)
+        else:
+            self.stage_record(merged, action)
+            prints(f"{record_type} Record {record.name} staged")
+
+    @timed
+    def apply_record_changes(self) -> List[ChangeInfo]:
+        """Submit the staged records of the hosted zone in as few batches as possible
+
+        The repository may be shared with other domains, only the failed
+        changes carrying records of this domain fail it.
+
+        Returns:
+            List[ChangeInfo]: Every change submitted while configuring the
+                domain
+        """
+        self.stage_record_changes()
+        submitted = self.hzr_repo.flush()
+        self.changes.extend(submitted)
+        for change in submitted:
+            if not change.error:
+                names = ", ".join(record.name for record in change.records)
+                prints(f"Records {names} created")
+        failed = [
+            change.error
+            for change in self.changes
+            if change.error and self.domain in change.domains
+        ]
+        if failed:
+            raise ChangeBatchFailedException("; ".join(failed))
+        return self.changes
+
+    @timed
     def configure_sending_email(self):
         prints(
             "We are going to configure the AWS SES Identity"
             + f" so you can send emails using {self.domain}"
         )
-        identity = DkimAttributes(self.domain)
-        identity = self.identity_repo.add_dkim_attributes(identity)
+        self.set_up_identity()
+        identity = self.dkim_attributes
         if identity.verification_status == "Pending":
             identity_records = identity.dkim_tokens_as_records(self.domain)
             if self.hosted_zone_id:
-                records_to_add = [
-                    record
-                    for record in identity_records
-                    if record not in self.hosted_zone_records
-                ]
-                for record in records_to_add:
-                    self.hzr_repo.add(self.hosted_zone_id, record)
-                    print(f"DKIM Record {record.name} created")
+                for record in identity_records:
+                    self.merge_record("DKIM", record)
             else:
                 self.records_pending_to_create.extend(identity_records)
 
+    @timed
     def configure_receiving_email(self):
         prints(
             "We are going to configure the AWS SES and your Hosted Zone"
             + f" so you can receive emails using {self.domain}"
         )
-        records = {
-            "MX": HostedZoneRecord(
-                self.domain,
-                "MX",
-                600,
-                [f"10 inbound-smtp.{self.region}.amazonaws.com"],
-            )
-        }
+        records = self.inbound_records()
 
         if self.hosted_zone_id:
             for record_type, record in records.items():
-                if record not in self.hosted_zone_records:
-                    self.hzr_repo.add(self.hosted_zone_id, record)
-                    prints(f"{record_type} Record {record.name} created")
-                else:
-                    prints(f"A {record_type} record is already present")
+                self.merge_record(record_type, record)
         else:
             self.records_pending_to_create.extend(records.values())
 
+    @timed
     def configure_mail_from_domain(self):
         prints(
             f"We are going to configure the MAIL FROM of AWS SES identity {self.domain}"
             f"by default is set to bounce.{self.domain}"
         )
-        mail_from_domain = f"bounce.{self.domain}"
+        records = self.mail_from_records()
 
-        records = {
-            "MX": HostedZoneRecord(
-                mail_from_domain,
-                "MX",
-                600,
-                [f"10 feedback-smtp.{self.region}.amazonses.com"],
-            ),
-            "TXT": HostedZoneRecord(
-                mail_from_domain,
-                "TXT",
-                600,
-                ['"v=spf1 include:amazonses.com ~all"'],
-            ),
-        }
-
-        attributes = MailFromDomainAttributes(
-            name=self.domain, mail_from_domain=mail_from_domain
-        )
-        domain_status = self.identity_repo.add_mail_from_domain_attributes(attributes)
+        self.set_up_mail_from()
+        domain_status = self.mail_from_attributes
 
         if domain_status.mail_from_domain_status not in ["Pending", "Success"]:
             self.records_pending_to_create.extend(records.values())
@@ -119,52 +331,26 @@ class SESActions:
 
         if self.hosted_zone_id:
             for record_type, record in records.items():
-                if record not in self.hosted_zone_records:
-                    self.hzr_repo.add(self.hosted_zone_id, record)
-                    prints(f"{record_type} Record {record.name} created")
-                else:
-                    prints(f"A {record_type} record is already present")
+                self.merge_record(record_type, record)
         else:
             self.records_pending_to_create.extend(records.values())
 
+    @timed
     def configure_email_receiving_rules(self):
         prints("We are going to configure the receving rule set")
-
-        domain = extract_main_domain(self.domain) or generate_random_string()
-        name = f"rule-set-for-cerby-{domain}"[:100]  # max length is 100 characters
-
+        self.stage_record_changes()
         try:
-            self.receipt_rules_repo.create_receipt_rule_set(rule_set_name=name)
-        except RuleSetAlreadyExistsException:
-            prints(f"Rule set '{name}' already exists.")
-        except Exception as e:
-            self.rules_failed_to_create[name] = str(e)
+            self.rule_manager.stage(self.domain)
+        except (ClientError, BotoCoreError) as e:
+            self.rules_failed_to_create[self.rule_set_name] = str(e)
             raise e
+        prints(f"Domain {self.domain} staged in rule set '{self.rule_set_name}'")
 
-        proxy_rule = ReceiptRule(name=name, rule_set_name=name)
-
-        if self.region == "ca-central-1":
-            proxy_rule.create_proxy_rule(
-                bucket_name="cerby-store-ses-email-production-ca-central-1", prefix="staged"
-            )
-        else:
-            proxy_rule.create_proxy_rule(
-                bucket_name="cerby-store-ses-email-production", prefix="staged"
-            )
-
-        try:
-            self.receipt_rules_repo.create_receipt_rule(rule=proxy_rule)
-        except RuleAlreadyExistsException:
-            prints(f"Rule '{name}' already exists.")
-        except Exception as e:
-            self.rules_failed_to_create[name] = str(e)
-            raise e
-
-        try:
-            self.receipt_rules_repo.set_active_receipt_rule_set(rule_set_name=name)
-            prints(f"Rule set '{name}' activated.")
-        except RuleSetDoesNotExistException:
-            prints(f"Unable to active Rule set '{name}', it does not exist.")
-        except Exception as e:
-            self.rules_failed_to_create[name] = str(e)
-            raise e
+    @timed
+    def apply_rule_changes(self):
+        """Add the staged domains to the Cerby receipt rules"""
+        error = self.rule_manager.flush().get(self.domain.lower())
+        if error:
+            self.rules_failed_to_create[self.rule_set_name] = error
+            raise ReceiptRuleFailedException(error)
+        prints(f"Rule set '{self.rule_set_name}' receives email for {self.domain}")
@@ -0,0 +1,292 @@
+import fnmatch
+from dataclasses import asdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import botocore
+
+from aws import get_current_region
+from batch import DEFAULT_WORKERS, prefetched
+from exceptions import CerbyException
+from models import BOUNCE_MX_VALUES, INBOUND_MX_VALUES, HostedZoneRecord
+from plan import MAIL_FROM, RECORD, RULE, UPSERT, ApplyResult, Plan, PlanAction
+from repository import (
+    AWSHostedZoneRecordsRepository,
+    AWSHostedZoneRepository,
+    AWSIdentityRepository,
+    AWSReceiptRulesRepository,
+)
+from rules import ReceiptRuleManager, legacy_rule_set_name
+from utils import imap_bounded, normalize_fqdn
+
+# Plan action
+DELETE = "DELETE"
+
+# Resource kinds, besides the plan ones
+IDENTITY = "identity"
+RULE_SET = "rule_set"
+
+# Values of the records SESActions writes
+DKIM_VALUES = ["*.dkim.amazonses.com"]
+SPF_VALUES = ['"v=spf1 include:amazonses.com ~all"']
+
+
+def cerby_values(domain: str, record: HostedZoneRecord) -> List[str]:
+    """The values of a record of the domain that SESActions wrote
+
+    Records may be shared, e.g. an MX with the SES endpoints of several
+    regions or a TXT with the customer's values, so only these values are
+    Cerby's to remove.
+
+    Args:
+        domain (str): The domain being torn down
+        record (HostedZoneRecord): A record of the domain's names
+
+    Returns:
+        List[str]: The values of the DKIM CNAMEs, the inbound MX and the
+            bounce MX and SPF TXT records, as found in the record
+    """
+    name, domain = normalize_fqdn(record.name), normalize_fqdn(domain)
+    kind = record.type.upper()
+    if kind == "CNAME" and name.endswith("._domainkey." + domain):
+        patterns = DKIM_VALUES
+    elif kind == "MX" and name == domain:
+        patterns = INBOUND_MX_VALUES
+    elif kind == "MX" and name == "bounce." + domain:
+        patterns = BOUNCE_MX_VALUES
+    elif kind == "TXT" and name == "bounce." + domain:
+        patterns = SPF_VALUES
+    else:
+        return []
+    return [
+        value
+        for value in record.values
+        if any(
+            fnmatch.fnmatchcase(record.normalize_value(value), pattern)
+            for pattern in patterns
+        )
+    ]
+
+
+class Teardown:
+    """Remove everything SESActions set up for many domains
+
+    Works like plan.Planner and plan.Applier: plan reads the Cerby owned
+    resources of every domain with bulk reads and only lists the deletions,
+    apply makes them. Record changes are sent as one ChangeBatch per hosted
+    zone, domains are taken out of the Cerby rules in one flush, and rule sets
+    and MAIL FROM domains are removed on a bounded thread pool. Records
+    shared with other values only lose the Cerby ones. A legacy rule set is
+    shared by the domains of a main domain, it is only deleted along with the
+    last of them.
+
+    An identity may have been sending email before Cerby set it up, so only
+    its MAIL FROM domain is reset, unless delete_identities is given for
+    identities known to be Cerby's. Deleting one deletes its DKIM and MAIL
+    FROM settings too.
+    """
+
+    def __init__(
+        self,
+        workers: int = DEFAULT_WORKERS,
+        identity_repo: Optional[AWSIdentityRepository] = None,
+        hz_repo: Optional[AWSHostedZoneRepository] = None,
+        hzr_repo: Optional[AWSHostedZoneRecordsRepository] = None,
+        receipt_rules_repo: Optional[AWSReceiptRulesRepository] = None,
+        rule_manager: Optional[ReceiptRuleManager] = None,
+        delete_identities: bool = False,
+    ) -> None:
+        self.workers = workers
+        self.delete_identities = delete_identities
+        self.identity_repo = identity_repo or AWSIdentityRepository()
+        self.hz_repo = hz_repo or AWSHostedZoneRepository()
+        self.hzr_repo = hzr_repo or AWSHostedZoneRecordsRepository()
+        self.receipt_rules_repo = receipt_rules_repo or AWSReceiptRulesRepository()
+        self.rule_manager = rule_manager or ReceiptRuleManager(self.receipt_rules_repo)
+        self._rule_sets: List[str] = []
+
+    def plan(self, domains: Iterable[str]) -> Plan:
+        """List the deletions that tear the domains down, nothing is written
+
+        Args:
+            domains (Iterable[str]): Domains to offboard, may be a lazy stream
+
+        Returns:
+            Plan: One DELETE action per resource Cerby owns
+        """
+        plan = Plan(region=get_current_region())
+        self._rule_sets = self.receipt_rules_repo.list_receipt_rule_sets()
+        self.rule_manager.load()
+        domains = prefetched(domains, self.identity_repo)
+        legacy: Dict[str, List[str]] = {}
+        for domain, actions, error in imap_bounded(
+            self._plan_domain, domains, self.workers
+        ):
+            if error:
+                plan.errors[domain] = error
+                continue
+            plan.actions.extend(actions)
+            rule_set_name = legacy_rule_set_name(domain)
+            if rule_set_name in self._rule_sets:
+                legacy.setdefault(rule_set_name, []).append(domain)
+
+        torn_down = {action.domain for action in plan.actions}
+        for rule_set_name, owners in legacy.items():
+            if not self.remaining_domains(rule_set_name, torn_down | set(owners)):
+                plan.actions.append(
+                    PlanAction(owners[0], RULE_SET, DELETE, rule_set_name)
+                )
+        return plan
+
+    def remaining_domains(self, rule_set_name: str, torn_down: Set[str]) -> Set[str]:
+        """The domains still using a legacy rule set once the teardown is done
+
+        Those are the recipients of its own rules, and the recipients of the
+        Cerby rules with the same main domain, that are not torn down.
+
+        Args:
+            rule_set_name (str): A legacy rule set
+            torn_down (Set[str]): The domains of the teardown
+
+        Returns:
+            Set[str]: The domains keeping the rule set
+        """
+        rules = self.receipt_rules_repo.get_receipt_rule_set(rule_set_name) or []
+        recipients = {
+            recipient.lower()
+            for rule in rules + self.rule_manager.rules
+            for recipient in rule.rule.get("Recipients", [])
+        }
+        return {
+            recipient
+            for recipient in recipients - torn_down
+            if legacy_rule_set_name(recipient) == rule_set_name
+        }
+
+    def _plan_domain(self, domain: str) -> Tuple[str, List[PlanAction], Optional[str]]:
+        try:
+            return domain, self.plan_domain(domain), None
+        except botocore.exceptions.ClientError as error:
+            return domain, [], error.response["Error"]["Message"]
+        except (botocore.exceptions.BotoCoreError, CerbyException) as error:
+            return domain, [], str(error)
+
+    def plan_domain(self, domain: str) -> List[PlanAction]:
+        actions = []
+        hosted_zone_id = self.hz_repo.get(domain)
+        if hosted_zone_id:
+            for record in self.hzr_repo.get_domain_records(hosted_zone_id, domain):
+                actions.extend(self._plan_record(domain, hosted_zone_id, record))
+
+        for rule in self.rule_manager.rules_for(domain):
+            payload = {"rule_set": rule.rule_set_name}
+            actions.append(PlanAction(domain, RULE, DELETE, rule.name, payload))
+
+        identity = self.identity_repo.get_dkim_attributes(domain)
+        mail_from = self.identity_repo.get_mail_from_domain_attributes(domain)
+        if identity is not None and self.delete_identities:
+            actions.append(PlanAction(domain, IDENTITY, DELETE, domain))
+        elif mail_from and mail_from.mail_from_domain == f"bounce.{domain}":
+            actions.append(PlanAction(domain, MAIL_FROM, DELETE, domain))
+        return actions
+
+    def _plan_record(
+        self, domain: str, hosted_zone_id: str, record: HostedZoneRecord
+    ) -> List[PlanAction]:
+        """Delete a record of Cerby values, or take them out of a shared one"""
+        values = cerby_values(domain, record)
+        if not values:
+            return []
+        kept = [value for value in record.values if value not in values]
+        if kept:
+            action = UPSERT
+            record = HostedZoneRecord(record.name, record.type, record.ttl, kept)
+        else:
+            action = DELETE
+        payload = {"zone": hosted_zone_id, "record": asdict(record)}
+        return [PlanAction(domain, RECORD, action, record.name, payload)]
+
+    def apply(self, plan: Plan) -> ApplyResult:
+        """Delete the resources of a teardown plan
+
+        DNS stops pointing at SES first, then the domains stop receiving
+        email, and the MAIL FROM domains and identities go last.
+
+        Args:
+            plan (Plan): A plan made by Teardown.plan
+
+        Returns:
+            ApplyResult: The Route53 change batches and the failed deletions
+        """
+        result = ApplyResult()
+        rule_sets, mail_from_domains, identities = [], [], []
+        for action in plan.changes:
+            if action.kind == RECORD:
+                result.changes.extend(
+                    self.hzr_repo.stage(
+                        action.payload["zone"],
+                        action.record,
+                        action=action.action,
+                        owner=action.domain,
+                    )
+                )
+            elif action.kind == RULE:
+                self.rule_manager.remove(action.domain)
+            elif action.kind == RULE_SET:
+                rule_sets.append(action.target)
+            elif action.kind == MAIL_FROM:
+                mail_from_domains.append(action.target)
+            elif action.kind == IDENTITY:
+                identities.append(action.target)
+
+        result.changes.extend(self.hzr_repo.flush())
+        for change in result.changes:
+            if change.error:
+                result.failures[", ".join(change.domains)] = change.error
+        result.failures.update(self.rule_manager.flush())
+
+        for name, error in imap_bounded(self._delete_rule_set, rule_sets, self.workers):
+            if error:
+                result.failures[name] = error
+        for name, error in imap_bounded(
+            self._reset_mail_from, mail_from_domains, self.workers
+        ):
+            if error:
+                result.failures[name] = error
+        for name, error in imap_bounded(
+            self._delete_identity, identities, self.workers
+        ):
+            if error:
+                result.failures[name] = error
+        return result
+
+    def _delete_rule_set(self, name: str) -> Tuple[str, Optional[str]]:
+        try:
+            if self.rule_manager.active and name == self.rule_manager.rule_set_name:
+                if self.rule_manager.rules:
+                    return name, "Rule set is active and still has rules"
+                self.receipt_rules_repo.deactivate_receipt_rule_set()
+                self.rule_manager.active = False
+            self.receipt_rules_repo.delete_receipt_rule_set(name)
+        except botocore.exceptions.ClientError as error:
+            return name, error.response["Error"]["Message"]
+        except botocore.exceptions.BotoCoreError as error:
+            return name, str(error)
+        return name, None
+
+    def _reset_mail_from(self, name: str) -> Tuple[str, Optional[str]]:
+        try:
+            self.identity_repo.reset_mail_from_domain(name)
+        except botocore.exceptions.ClientError as error:
+            return name, error.response["Error"]["Message"]
+        except botocore.exceptions.BotoCoreError as error:
+            return name, str(error)
+        return name, None
+
+    def _delete_identity(self, name: str) -> Tuple[str, Optional[str]]:
+        try:
+            self.identity_repo.delete_identity(name)
+        except botocore.exceptions.ClientError as error:
+            return name, error.response["Error"]["Message"]
+        except botocore.exceptions.BotoCoreError as error:
+            return name, str(error)
+        return name, None
@@ -0,0 +1,114 @@
+import json
+
+from accounts import (
+    AccountEntry,
+    AccountResult,
+    onboard_account_process,
+    read_manifest,
+    run_accounts,
+)
+from aws import AssumedRole, get_client, registry, use_credentials
+from batch import BatchSummary
+from localaws import LocalAWSError
+from metrics import metrics
+from models import ChangeInfo
+from ratelimit import limiter
+
+ROLE_A = "arn:aws:iam::111111111111:role/CerbyRole"
+ROLE_B = "arn:aws:iam::222222222222:role/CerbyRole"
+
+
+def test_read_manifest(tmp_path):
+    path = tmp_path / "accounts.json"
+    path.write_text(
+        json.dumps(
+            [{"role_arn": ROLE_A, "external_id": "external-a", "domains": ["Foo.com."]}]
+        )
+    )
+
+    (entry,) = read_manifest(str(path))
+
+    assert entry == AccountEntry(ROLE_A, ["foo.com"], "external-a")
+    assert entry.account == "111111111111"
+
+
+def test_clients_use_the_credentials_of_the_block(local_aws):
+    role = AssumedRole(ROLE_A, "external-a")
+    ambient = get_client("ses")
+    with use_credentials(role):
+        assumed = get_client("ses")
+        assert get_client("ses") is assumed
+    assert assumed is not ambient
+    assert get_client("ses") is ambient
+    # the role is assumed once, its session is shared by every client
+    with use_credentials(role):
+        get_client("route53")
+    assert local_aws.sts.assumed_roles == {ROLE_A: 1}
+    assert registry.get_session(role).get_credentials().method == "sts-assume-role"
+
+
+def test_run_accounts(local_aws, monkeypatch):
+    local_aws.route53.add_hosted_zone("example.com")
+    assume_role = local_aws.sts.assume_role
+
+    def denied(RoleArn, **params):
+        if RoleArn.endswith("DeniedRole"):
+            raise LocalAWSError("AccessDenied", "Not authorized to assume the role")
+        return assume_role(RoleArn, **params)
+
+    monkeypatch.setattr(local_aws.sts, "assume_role", denied)
+    entries = [
+        AccountEntry(
+            ROLE_A, [f"a{index}.example.com" for index in range(5)], "external-a"
+        ),
+        AccountEntry(
+            ROLE_B, [f"b{index}.example.com" for index in range(5)], "external-b"
+        ),
+        AccountEntry("arn:aws:iam::333333333333:role/DeniedRole", ["c.example.com"]),
+    ]
+    reported = []
+
+    # the stand-in is one account, the accounts share its receipt rules and
+    # must run one after the other
+    results = run_accounts(
+        entries,
+        account_workers=1,
+        workers=2,
+        on_result=lambda entry, result: reported.append(result),
+    )
+
+    assert [result.succeeded for result in results] == [True, True, False]
+    assert "Not authorized" in results[2].error
+    assert len(reported) == 10
+    assert local_aws.sts.assumed_roles == {ROLE_A: 1, ROLE_B: 1}
+
+
+def test_worker_processes_return_their_metrics(local_aws):
+    local_aws.route53.add_hosted_zone("example.com")
+    entry = AccountEntry(ROLE_A, ["a.example.com", "b.example.com"], "external-a")
+
+    result = onboard_account_process(entry, workers=2)
+
+    assert result.succeeded
+    assert result.metrics.phases["domain"].count == 2
+    assert result.rate_limit_stats["ses"].calls
+    # taken from the worker, so the next account starts from zero
+    assert metrics.phases == {}
+    assert limiter.stats("ses").calls == 0
+
+    metrics.merge(result.metrics)
+    metrics.merge(result.metrics)
+    limiter.merge_stats(result.rate_limit_stats)
+    assert metrics.phases["domain"].count == 4
+    assert limiter.stats("ses").calls == result.rate_limit_stats["ses"].calls
+
+
+def test_failed_changes_fail_the_account():
+    entry = AccountEntry(ROLE_A, ["foo.example.com"])
+    summary = BatchSummary(
+        changes=[ChangeInfo("Z1", domains=["foo.example.com"], error="Throttled")]
+    )
+
+    assert entry.role == AssumedRole(ROLE_A)
+    assert not AccountResult(entry, summary=summary).succeeded
+    assert AccountResult(entry, summary=BatchSummary()).succeeded
@@ -1,6 +1,11 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 
-from ses_actions import SESActions
+from exceptions import ChangeBatchFailedException
+from models import ChangeInfo
+from ses_actions import MAX_PARALLEL_STEPS, SESActions
 
 
 def test_configure_lifecycle(mock_boto3_client_patch):
@@ -84,13 +89,146 @@ def test_configure_email_receiving_rules_access_denied(
     domain = "accessdenied.com"
 
     ses_actions = SESActions(domain=domain)
+    ses_actions.configure_email_receiving_rules()
     with pytest.raises(Exception):
-        ses_actions.configure_email_receiving_rules()
+        ses_actions.apply_rule_changes()
 
     assert ses_actions.rules_failed_to_create
     assert len(ses_actions.rules_failed_to_create) == 1
-    error = ses_actions.rules_failed_to_create["rule-set-for-cerby-accessdenied"]
+    error = ses_actions.rules_failed_to_create["rule-set-for-cerby"]
     assert (
         error
-        == "An error occurred (AccessDenied) when calling the SetActiveReceiptRule operation: User is not authorized to perform this action."
+        == "An error occurred (AccessDenied) when calling the CreateReceiptRule operation: User is not authorized to perform this action."
     )
+
+
+def test_apply_record_changes_single_batch(mock_boto3_client_patch):
+    ses_actions = SESActions(domain="new-identity-present-in-route53.com")
+    ses_actions.configure_sending_email()
+    ses_actions.configure_receiving_email()
+    ses_actions.configure_mail_from_domain()
+
+    client = ses_actions.hzr_repo.client
+    client.change_resource_record_sets.assert_not_called()
+
+    changes = ses_actions.apply_record_changes()
+    assert len(changes) == 1
+    assert changes[0].id == "/change/C1234567890"
+    client.change_resource_record_sets.assert_called_once()
+    batch = client.change_resource_record_sets.call_args.kwargs["ChangeBatch"]
+    assert len(batch["Changes"]) == 5
+
+
+def test_apply_record_changes_ignores_other_domains(mock_boto3_client_patch):
+    ses_actions = SESActions(domain="new-identity-present-in-route53.com")
+    ses_actions.changes.append(
+        ChangeInfo("zone-a", domains=["other.com"], error="Throttling")
+    )
+
+    assert len(ses_actions.apply_record_changes()) == 1
+
+    ses_actions.changes.append(
+        ChangeInfo("zone-a", domains=[ses_actions.domain], error="Throttling")
+    )
+    with pytest.raises(ChangeBatchFailedException):
+        ses_actions.apply_record_changes()
+
+
+def test_failed_domain_stages_nothing(mock_boto3_client_patch):
+    ses_actions = SESActions(domain="new-identity-present-in-route53.com")
+
+    def fail():
+        raise RuntimeError("MAIL FROM failed")
+
+    ses_actions.set_up_mail_from = fail
+    with pytest.raises(RuntimeError):
+        ses_actions.configure()
+
+    assert ses_actions.hzr_repo.flush() == []
+    ses_actions.hzr_repo.client.change_resource_record_sets.assert_not_called()
+    assert ses_actions.rule_manager.flush() == {}
+
+
+def test_configure_runs_independent_steps_at_once(local_aws):
+    local_aws.route53.add_hosted_zone("example.com")
+    sequential = SESActions(domain="sequential.example.com")
+    parallel = SESActions(domain="parallel.example.com")
+    # the first identity, records and rule set reads only get past the
+    # barrier when all three run at once
+    barrier = threading.Barrier(MAX_PARALLEL_STEPS, timeout=5)
+
+    def together(read):
+        first = threading.Event()
+
+        def wait_then_read(*args, **kwargs):
+            if not first.is_set():
+                first.set()
+                barrier.wait()
+            return read(*args, **kwargs)
+
+        return wait_then_read
+
+    parallel.identity_repo.get_dkim_attributes = together(
+        parallel.identity_repo.get_dkim_attributes
+    )
+    parallel.hzr_repo.get_domain_records = together(
+        parallel.hzr_repo.get_domain_records
+    )
+    parallel.rule_manager.load = together(parallel.rule_manager.load)
+
+    sequential.configure()
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_STEPS) as executor:
+        parallel.configure(executor)
+
+    assert not barrier.broken
+    assert parallel.hzr_repo.flush()
+    assert len(parallel.changes) == len(sequential.changes)
+
+
+def test_configure_merges_existing_records(local_aws):
+    zone_id = local_aws.route53.add_hosted_zone("example.com")
+    customer = [
+        ("foo.example.com.", "MX", "20 mx.example.net"),
+        ("bounce.foo.example.com.", "TXT", '"google-site-verification=abc"'),
+    ]
+    local_aws.route53.change_resource_record_sets(
+        HostedZoneId=zone_id,
+        ChangeBatch={
+            "Changes": [
+                {
+                    "Action": "CREATE",
+                    "ResourceRecordSet": {
+                        "Name": name,
+                        "Type": record_type,
+                        "TTL": 300,
+                        "ResourceRecords": [{"Value": value}],
+                    },
+                }
+                for name, record_type, value in customer
+            ]
+        },
+    )
+    ses_actions = SESActions(domain="foo.example.com")
+    assert not ses_actions.is_converged()
+
+    ses_actions.configure()
+    ses_actions.apply_record_changes()
+    ses_actions.apply_rule_changes()
+
+    # the customer keeps receiving their mail, the SES MX is added by hand
+    assert [
+        (record.name, record.type) for record in ses_actions.records_pending_to_create
+    ] == [("foo.example.com", "MX")]
+    record_sets = {
+        (record_set["Name"], record_set["Type"]): record_set
+        for record_set in local_aws.route53.record_sets(zone_id)
+    }
+    assert record_sets[("foo.example.com.", "MX")]["ResourceRecords"] == [
+        {"Value": "20 mx.example.net"}
+    ]
+    txt = record_sets[("bounce.foo.example.com.", "TXT")]
+    assert txt["TTL"] == 300
+    assert [value["Value"] for value in txt["ResourceRecords"]] == [
+        '"google-site-verification=abc"',
+        '"v=spf1 include:amazonses.com ~all"',
+    ]
@@ -0,0 +1,67 @@
+import threading
+from dataclasses import dataclass
+
+from boto3.session import Session
+
+from aws import StaticCredentials, configure_clients, get_client, registry
+from repository import AWSHostedZoneRecordsRepository, AWSHostedZoneRepository
+
+
+def test_get_client_is_shared(mock_boto3_client_patch, mock_boto3_region_patch):
+    assert get_client("ses") is get_client("ses")
+    assert get_client("ses") is get_client("ses", region="us-east-1")
+    assert get_client("ses") is not get_client("ses", region="eu-west-1")
+
+    assert AWSHostedZoneRepository().client is AWSHostedZoneRecordsRepository().client
+    assert mock_boto3_client_patch.call_count == 3
+
+
+def test_get_client_global_service_ignores_region(mock_boto3_client_patch):
+    assert get_client("route53", region="eu-west-1") is get_client("route53")
+
+
+def test_get_client_keyed_by_credentials(mock_boto3_client_patch):
+    credentials = StaticCredentials("access-key", "secret-key")
+
+    assert get_client("route53", credentials=credentials) is not get_client("route53")
+    assert get_client("route53", credentials=credentials) is get_client(
+        "route53", credentials=StaticCredentials("access-key", "secret-key")
+    )
+
+
+def test_configure_clients(mock_boto3_client_patch):
+    client = get_client("route53")
+    configure_clients(max_pool_connections=5, retry_mode="adaptive")
+
+    assert registry.settings.max_pool_connections == 5
+    assert get_client("route53") is not client
+    config = mock_boto3_client_patch.call_args.kwargs["config"]
+    assert config.max_pool_connections == 5
+    assert config.retries["mode"] == "adaptive"
+
+
+def test_assuming_a_role_does_not_hold_up_other_clients(mock_boto3_client_patch):
+    assuming = threading.Event()
+    other_client = threading.Event()
+    waited = []
+
+    @dataclass(frozen=True)
+    class SlowRole:
+        role_arn: str
+
+        def create_session(self) -> Session:
+            assuming.set()
+            # the STS call of the role, another client is created meanwhile
+            waited.append(other_client.wait(timeout=5))
+            return Session()
+
+    role = SlowRole("arn:aws:iam::111111111111:role/CerbyRole")
+    thread = threading.Thread(target=get_client, args=("route53", None, role))
+    thread.start()
+    assert assuming.wait(timeout=5)
+    get_client("route53")
+    other_client.set()
+    thread.join()
+
+    assert waited == [True]
+    assert get_client("route53", credentials=role) is not get_client("route53")
@@ -0,0 +1,92 @@
+import io
+
+from aws import get_client
+from batch import read_domains, run_batch
+
+
+def test_read_domains():
+    stream = io.StringIO(
+        "# tenants\nFoo.com\n\nbar.com.  # trailing dot\nfoo.com\nbaz.com\n"
+    )
+
+    assert list(read_domains(stream)) == ["foo.com", "bar.com", "baz.com"]
+
+
+def test_run_batch(mock_boto3_client_patch, mock_boto3_region_patch):
+    domains = [
+        "new-identity-present-in-route53.com",
+        "existing-identity-present-in-route53.com",
+        "new-identity-not-present-in-route53.com",
+    ]
+    reported = []
+
+    summary = run_batch(domains, workers=2, on_result=reported.append)
+
+    assert summary.domains == 3
+    assert sorted(result.domain for result in reported) == sorted(domains)
+    assert summary.failed == []
+    assert summary.pending_records == 5
+
+    # identity attributes of the whole batch are read in one request each
+    ses = get_client("ses")
+    assert ses.get_identity_dkim_attributes.call_count == 1
+    assert ses.get_identity_mail_from_domain_attributes.call_count == 1
+    # and every domain goes into one receipt rule of one rule set
+    ses.create_receipt_rule.assert_called_once()
+    rule = ses.create_receipt_rule.call_args.kwargs["Rule"]
+    assert sorted(rule["Recipients"]) == sorted(domains)
+    ses.set_active_receipt_rule_set.assert_called_once()
+
+
+def test_converged_domains_are_not_written(local_aws):
+    local_aws.route53.add_hosted_zone("example.com", filler_records=20)
+    domains = [f"domain-{index}.example.com" for index in range(20)]
+    # verified by hand, without a hosted zone
+    local_aws.ses().add_identity(
+        "manual.com",
+        dkim_status="Success",
+        mail_from_domain="bounce.manual.com",
+        mail_from_status="Success",
+    )
+
+    first = run_batch(domains + ["manual.com"], workers=4)
+    assert first.changed == 21
+    assert first.converged == 0
+
+    local_aws.calls.clear()
+    second = run_batch(domains + ["manual.com"], workers=4)
+
+    assert second.converged == 21
+    assert second.changed == 0
+    assert second.failed == []
+    writes = [
+        operation
+        for operation in local_aws.calls
+        if operation.startswith(("Create", "Set", "Verify", "Update", "Change"))
+    ]
+    assert writes == []
+
+
+def test_domains_are_reported_after_each_flush(local_aws):
+    zone_id = local_aws.route53.add_hosted_zone("example.com")
+    domains = [f"domain-{index}.example.com" for index in range(12)]
+    reported = []
+    reported_when_pulled = []
+
+    def stream():
+        for domain in domains:
+            reported_when_pulled.append(len(reported))
+            yield domain
+
+    summary = run_batch(stream(), workers=2, on_result=reported.append, flush_every=5)
+
+    assert summary.changed == 12
+    # the first chunk is written and reported before the next one is read
+    assert reported_when_pulled[5] == 5
+    assert reported_when_pulled[10] == 10
+    assert local_aws.calls["ChangeResourceRecordSets"] == 3
+    assert all(result.changes for result in reported)
+    names = {
+        record_set["Name"] for record_set in local_aws.route53.record_sets(zone_id)
+    }
+    assert "domain-0.example.com." in names
@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+from benchmark import run_benchmark
+from localaws import LocalAWSSettings
+
+# AWS calls allowed to configure new domains in one hosted zone, going over
+# means a change made the tool chattier.
+CALL_BUDGET_ONE_DOMAIN = {
+    "ListHostedZones": 1,
+    "GetIdentityDkimAttributes": 1,
+    "GetIdentityMailFromDomainAttributes": 1,
+    "ListResourceRecordSets": 3,
+    "VerifyDomainDkim": 1,
+    "SetIdentityMailFromDomain": 1,
+    "ChangeResourceRecordSets": 1,
+    "DescribeActiveReceiptRuleSet": 1,
+    "DescribeReceiptRuleSet": 1,
+    "CreateReceiptRuleSet": 1,
+    "CreateReceiptRule": 1,
+    "SetActiveReceiptRuleSet": 1,
+}
+
+CALL_BUDGET_100_DOMAINS = {
+    "ListHostedZones": 1,
+    "GetIdentityDkimAttributes": 1,
+    "GetIdentityMailFromDomainAttributes": 1,
+    "ListResourceRecordSets": 300,
+    "VerifyDomainDkim": 100,
+    "SetIdentityMailFromDomain": 100,
+    "ChangeResourceRecordSets": 1,
+    "DescribeActiveReceiptRuleSet": 1,
+    "DescribeReceiptRuleSet": 1,
+    "CreateReceiptRuleSet": 1,
+    "CreateReceiptRule": 1,
+    "SetActiveReceiptRuleSet": 1,
+}
+
+
+def assert_within_budget(calls, budget):
+    over = {
+        operation: f"{calls.get(operation, 0)} > {budget.get(operation, 0)}"
+        for operation in set(calls) | set(budget)
+        if calls.get(operation, 0) > budget.get(operation, 0)
+    }
+    assert not over, f"AWS calls over budget: {over}"
+
+
+def test_benchmark_one_domain():
+    result = run_benchmark(1, zone_records=1000)
+
+    assert result.failed == 0
+    assert_within_budget(result.calls, CALL_BUDGET_ONE_DOMAIN)
+    assert result.elapsed < 5
+
+
+def test_benchmark_100_domains_in_a_large_zone():
+    result = run_benchmark(100, zone_records=100000)
+
+    assert result.failed == 0
+    # the zone is never listed, only the neighborhood of each domain
+    assert_within_budget(result.calls, CALL_BUDGET_100_DOMAINS)
+    assert result.elapsed < 10
+    assert result.peak_memory < 32 * 1024 * 1024
+
+
+def test_benchmark_survives_throttling():
+    settings = LocalAWSSettings(throttle_rate=200, throttle_burst=5)
+
+    result = run_benchmark(20, settings=settings, measure_memory=False)
+
+    assert result.failed == 0
+    assert result.throttled
+
+
+@pytest.mark.skipif(
+    "CERBY_BENCHMARK" not in os.environ, reason="set CERBY_BENCHMARK to run"
+)
+def test_benchmark_10000_domains():
+    result = run_benchmark(10000, zone_records=100000, measure_memory=False)
+
+    assert result.failed == 0
+    assert result.calls_per_domain < 8.1
+    assert result.calls["ChangeResourceRecordSets"] <= 100
+    assert result.domains_per_second > 50
@@ -0,0 +1,90 @@
+from aws import get_current_account, get_current_region, registry
+from batch import run_batch
+from cache import StateCache, state_cache
+from models import HostedZoneRecord
+from repository import AWSHostedZoneRecordsRepository
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_entries_expire_per_kind(tmp_path):
+    clock = FakeClock()
+    cache = StateCache(ttls={"dkim": 60, "zones": 600}, clock=clock)
+    assert cache.get("dkim", "foo.com") is None
+
+    cache.open(str(tmp_path / "state.db"), "111111111111", "us-east-1")
+    cache.put("dkim", "foo.com", {"name": "foo.com"})
+    cache.put("zones", "hosted_zones", [])
+    clock.now += 120
+
+    assert cache.get("dkim", "foo.com") is None
+    assert cache.get("zones", "hosted_zones") == []
+
+
+def test_entries_are_scoped_to_account_and_region(tmp_path):
+    path = str(tmp_path / "state.db")
+    cache = StateCache()
+    cache.open(path, "111111111111", "us-east-1")
+    cache.put_many("dkim", {"foo.com": 1, "bar.com": 2})
+    cache.put("records", "Z1 foo.com.", [])
+
+    cache.open(path, "111111111111", "eu-west-1")
+    assert cache.get_many("dkim", ["foo.com", "bar.com"]) == {}
+    # Route53 is global, its state is shared by the regions of the account
+    assert cache.get("records", "Z1 foo.com.") == []
+
+    cache.open(path, "222222222222", "us-east-1")
+    assert cache.get("records", "Z1 foo.com.") is None
+
+    cache.open(path, "111111111111", "us-east-1")
+    cache.invalidate("dkim", ["foo.com"])
+    assert cache.get_many("dkim", ["foo.com", "bar.com"]) == {"bar.com": 2}
+    cache.close()
+
+
+def test_writes_invalidate_cached_records(local_aws, tmp_path):
+    zone_id = local_aws.route53.add_hosted_zone("my-identity.com")
+    state_cache.open(str(tmp_path / "state.db"), "111111111111", "us-east-1")
+    repository = AWSHostedZoneRecordsRepository()
+
+    assert list(repository.get_domain_records(zone_id, "my-identity.com")) == []
+    assert list(repository.get_domain_records(zone_id, "my-identity.com")) == []
+    assert local_aws.calls["ListResourceRecordSets"] == 3
+
+    record = HostedZoneRecord("token._domainkey.my-identity.com", "CNAME", 300, ["x"])
+    repository.add(zone_id, record)
+
+    assert list(repository.get_domain_records(zone_id, "my-identity.com")) == [record]
+    assert local_aws.calls["ListResourceRecordSets"] == 6
+
+
+def test_reconciliation_reruns_are_answered_from_the_cache(local_aws, tmp_path):
+    local_aws.route53.add_hosted_zone("example.com", filler_records=100)
+    domains = [f"domain-{index}.example.com" for index in range(100)]
+    path = str(tmp_path / "state.db")
+
+    runs = []
+    for _ in range(3):
+        registry.reset()
+        state_cache.open(path, get_current_account(), get_current_region())
+        local_aws.calls.clear()
+        summary = run_batch(domains, workers=8)
+        assert summary.failed == []
+        runs.append(dict(local_aws.calls))
+        state_cache.close()
+
+    assert runs[0]["VerifyDomainDkim"] == 100
+    # the second run re-reads only what the first one wrote, and writes nothing
+    assert runs[1] == {
+        "GetIdentityDkimAttributes": 1,
+        "GetIdentityMailFromDomainAttributes": 1,
+        "ListResourceRecordSets": 300,
+        "DescribeActiveReceiptRuleSet": 1,
+    }
+    assert runs[2] == {}
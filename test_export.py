@@ -0,0 +1,83 @@
+import csv
+import json
+
+import pytest
+
+from export import RecordExporter, apex_zone, export_format
+from models import HostedZoneRecord
+
+
+def pending_records(domain: str):
+    return [
+        HostedZoneRecord(
+            domain, "MX", values=["10 inbound-smtp.us-east-1.amazonaws.com"]
+        ),
+        HostedZoneRecord(
+            f"bounce.{domain}",
+            "MX",
+            values=["10 feedback-smtp.us-east-1.amazonses.com"],
+        ),
+        HostedZoneRecord(
+            f"bounce.{domain}", "TXT", values=['"v=spf1 include:amazonses.com ~all"']
+        ),
+    ]
+
+
+def test_apex_zone():
+    assert apex_zone("bounce.foo.example.com.") == "example.com"
+    assert apex_zone("abc._domainkey.mail.company.co.uk") == "company.co.uk"
+    assert apex_zone("example.io") == "example.io"
+    with pytest.raises(Exception, match="extension"):
+        export_format("records.txt")
+
+
+def test_export(tmp_path):
+    exporter = RecordExporter(
+        [
+            str(tmp_path / name)
+            for name in ["records.zone", "records.csv", "records.json"]
+        ]
+    )
+    dkim = HostedZoneRecord(
+        "abc._domainkey.foo.example.com", "CNAME", values=["abc.dkim.amazonses.com"]
+    )
+    exporter.add(pending_records("foo.example.com") + [dkim])
+    # a domain reported twice, e.g. by the batch and by its account
+    exporter.add(pending_records("foo.example.com"))
+    exporter.add(pending_records("Other.NET"))
+    exporter.write()
+    exporter.close()
+
+    zone_file = (tmp_path / "records.zone").read_text()
+    assert zone_file.count("$ORIGIN") == 2
+    assert zone_file.index("$ORIGIN example.com.") < zone_file.index(
+        "$ORIGIN other.net."
+    )
+    assert (
+        "abc._domainkey.foo.example.com. 300 IN CNAME abc.dkim.amazonses.com.\n"
+        in zone_file
+    )
+    assert (
+        "foo.example.com. 300 IN MX 10 inbound-smtp.us-east-1.amazonaws.com.\n"
+        in zone_file
+    )
+    assert (
+        'bounce.other.net. 300 IN TXT "v=spf1 include:amazonses.com ~all"\n'
+        in zone_file
+    )
+
+    with open(tmp_path / "records.csv", newline="") as csv_file:
+        rows = list(csv.DictReader(csv_file))
+    assert len(rows) == 7
+    assert {row["zone"] for row in rows} == {"example.com", "other.net"}
+
+    document = json.loads((tmp_path / "records.json").read_text())
+    assert [zone["zone"] for zone in document["zones"]] == ["example.com", "other.net"]
+    assert [len(zone["records"]) for zone in document["zones"]] == [4, 3]
+
+
+def test_export_nothing(tmp_path):
+    exporter = RecordExporter([str(tmp_path / "records.json")])
+    exporter.write()
+    exporter.close()
+    assert json.loads((tmp_path / "records.json").read_text()) == {"zones": []}
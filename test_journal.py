@@ -0,0 +1,127 @@
+import pytest
+
+from batch import run_batch
+from journal import CONFIGURE, DONE, FAILED, RECORDS, RULES, Journal
+from localaws import LocalAWSError
+
+
+def run_journaled(domains, journal):
+    summary = run_batch(
+        journal.pending(domains), workers=4, on_result=journal.record_result
+    )
+    journal.close()
+    return summary
+
+
+def test_resume_retries_only_failed_domains(local_aws, monkeypatch, tmp_path):
+    local_aws.route53.add_hosted_zone("example.com")
+    domains = [f"domain-{index}.example.com" for index in range(10)]
+    path = str(tmp_path / "journal.jsonl")
+    ses = local_aws.ses()
+    verify_domain_dkim = ses.verify_domain_dkim
+
+    def denied(Domain):
+        if Domain == "domain-3.example.com":
+            raise LocalAWSError("AccessDenied", "Not authorized")
+        return verify_domain_dkim(Domain)
+
+    monkeypatch.setattr(ses, "verify_domain_dkim", denied)
+    first = run_journaled(domains, Journal(path, "us-east-1"))
+    assert [result.domain for result in first.failed] == ["domain-3.example.com"]
+
+    monkeypatch.setattr(ses, "verify_domain_dkim", verify_domain_dkim)
+    local_aws.calls.clear()
+    journal = Journal(path, "us-east-1", resume=True)
+    assert journal.steps["domain-3.example.com"] == {CONFIGURE: FAILED}
+    assert journal.change_ids["domain-0.example.com"]
+    second = run_journaled(domains, journal)
+
+    assert second.domains == 1
+    assert second.failed == []
+    assert journal.skipped == 9
+    assert local_aws.calls["VerifyDomainDkim"] == 1
+
+    journal = Journal(path, "us-east-1", resume=True)
+    assert list(journal.pending(domains)) == []
+
+
+def test_failed_changes_fail_their_domains(local_aws, monkeypatch, tmp_path):
+    local_aws.route53.add_hosted_zone("example.com")
+    domains = ["foo.example.com", "bar.example.com"]
+    path = str(tmp_path / "journal.jsonl")
+    route53 = local_aws.route53
+    change_resource_record_sets = route53.change_resource_record_sets
+
+    def invalid(HostedZoneId, ChangeBatch):
+        raise LocalAWSError("InvalidChangeBatch", "Invalid change batch")
+
+    monkeypatch.setattr(route53, "change_resource_record_sets", invalid)
+    reported = []
+    journal = Journal(path, "us-east-1")
+
+    def on_result(result):
+        journal.record_result(result)
+        reported.append((result.domain, result.error))
+
+    summary = run_batch(domains, on_result=on_result)
+    journal.close()
+
+    # domains are only reported once the flush wrote their records
+    assert sorted(reported) == sorted(
+        (domain, "Invalid change batch") for domain in domains
+    )
+    assert sorted(result.domain for result in summary.failed) == sorted(domains)
+    journal = Journal(path, "us-east-1", resume=True)
+    assert journal.steps["foo.example.com"][RECORDS] == FAILED
+    assert list(journal.pending(domains)) == domains
+
+    monkeypatch.setattr(
+        route53, "change_resource_record_sets", change_resource_record_sets
+    )
+    assert run_journaled(domains, journal).failed == []
+    assert list(Journal(path, "us-east-1", resume=True).pending(domains)) == []
+
+
+def test_flushed_domains_are_journaled_as_the_batch_goes(local_aws, tmp_path):
+    local_aws.route53.add_hosted_zone("example.com")
+    domains = [f"domain-{index}.example.com" for index in range(3)]
+    path = str(tmp_path / "journal.jsonl")
+
+    def dying():
+        yield from domains[:2]
+        raise KeyboardInterrupt
+
+    journal = Journal(path, "us-east-1")
+    with pytest.raises(KeyboardInterrupt):
+        run_batch(dying(), on_result=journal.record_result, flush_every=2)
+    journal.close()
+
+    journal = Journal(path, "us-east-1", resume=True)
+    assert list(journal.pending(domains)) == domains[2:]
+    journal.close()
+
+
+def test_resume_after_dying_midway(local_aws, tmp_path):
+    local_aws.route53.add_hosted_zone("example.com")
+    domains = ["foo.example.com", "bar.example.com"]
+    path = str(tmp_path / "journal.jsonl")
+
+    journal = Journal(path, "us-east-1")
+    run_batch(domains[:1], on_result=journal.record_result)
+    journal.close()
+    with open(path, "a") as journal_file:
+        journal_file.write('{"time":1,"domain":"bar.exa')
+
+    journal = Journal(path, "us-east-1", resume=True)
+    assert "bar.example.com" not in journal.steps
+    assert list(journal.pending(domains)) == ["bar.example.com"]
+    run_batch(journal.pending(domains), on_result=journal.record_result)
+    assert journal.steps["bar.example.com"] == {
+        CONFIGURE: DONE,
+        RECORDS: DONE,
+        RULES: DONE,
+    }
+    journal.close()
+
+    with pytest.raises(Exception, match="written for us-east-1"):
+        Journal(path, "eu-west-1", resume=True)
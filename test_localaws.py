@@ -0,0 +1,66 @@
+import pytest
+from botocore.exceptions import ClientError
+
+from aws import get_client
+from models import HostedZoneRecord
+from ratelimit import limiter
+from repository import AWSHostedZoneRecordsRepository, AWSIdentityRepository
+
+
+def test_neighborhood_reads_stop_early(local_aws):
+    local_aws.settings.record_page_size = 2
+    zone_id = local_aws.route53.add_hosted_zone("my-identity.com", filler_records=50)
+    repository = AWSHostedZoneRecordsRepository()
+    record = HostedZoneRecord("bounce.my-identity.com", "MX", 600, ["10 feedback"])
+    repository.add(zone_id, record)
+
+    records = list(repository.get_domain_records(zone_id, "my-identity.com"))
+
+    assert records == [record]
+    assert local_aws.calls["ListResourceRecordSets"] == 3
+
+
+def test_change_batches_are_validated(local_aws):
+    zone_id = local_aws.route53.add_hosted_zone("my-identity.com")
+    repository = AWSHostedZoneRecordsRepository()
+    record = HostedZoneRecord("my-identity.com", "MX", 600, ["10 inbound-smtp"])
+    repository.add(zone_id, record)
+
+    with pytest.raises(ClientError) as error:
+        repository.add(zone_id, record)
+    assert error.value.response["Error"]["Code"] == "InvalidChangeBatch"
+    assert len(local_aws.route53.record_sets(zone_id)) == 2
+
+
+def test_identity_reads_are_limited_to_100(local_aws):
+    repository = AWSIdentityRepository()
+
+    with pytest.raises(ClientError):
+        get_client("ses").get_identity_dkim_attributes(
+            Identities=[f"domain-{index}.com" for index in range(101)]
+        )
+    assert (
+        repository.get_dkim_attributes_bulk(
+            [f"domain-{index}.com" for index in range(250)]
+        )
+        == {}
+    )
+    assert local_aws.calls["GetIdentityDkimAttributes"] == 4
+
+
+def test_throttled_calls_are_retried(local_aws, monkeypatch):
+    # long enough for the stand-in to accept a request again
+    monkeypatch.setattr("ratelimit.backoff_delay", lambda attempts: 0.1)
+    local_aws.settings.throttle_rate = 10
+    local_aws.settings.throttle_burst = 1
+    limiter.configure({"route53": 100})
+    local_aws.route53.add_hosted_zone("my-identity.com")
+
+    client = get_client("route53")
+    for _ in range(5):
+        assert client.list_hosted_zones()["HostedZones"]
+
+    assert local_aws.throttled["ListHostedZones"] > 0
+    stats = limiter.stats("route53")
+    assert stats.retries == stats.throttles == local_aws.throttled["ListHostedZones"]
+    assert limiter.bucket("route53").rate < 100
@@ -0,0 +1,98 @@
+import json
+import threading
+
+import pytest
+from boto3.session import Session
+from botocore.config import Config
+
+import ratelimit
+from batch import run_batch
+from metrics import Metrics, Profiler, metrics
+from ratelimit import RateLimiter
+from test_ratelimit import HOSTED_ZONES, THROTTLING, responder
+
+
+@pytest.fixture
+def route53_client(monkeypatch):
+    monkeypatch.setattr(ratelimit, "backoff_delay", lambda attempts: 0.0)
+    session = Session(
+        aws_access_key_id="access-key",
+        aws_secret_access_key="secret-key",
+        region_name="us-east-1",
+    )
+    config = Config(retries={"mode": "standard", "total_max_attempts": 3})
+    client = session.client("route53", config=config)
+    RateLimiter().attach(client, "route53", None, max_attempts=3)
+    return client
+
+
+def test_metrics_records_calls(route53_client):
+    recorder = Metrics()
+    recorder.attach(route53_client, "route53")
+    route53_client.meta.events.register(
+        "before-send.route-53",
+        responder((400, THROTTLING), (400, THROTTLING), (200, HOSTED_ZONES)),
+    )
+
+    route53_client.list_hosted_zones()
+
+    operation = recorder.operation("route53", "ListHostedZones")
+    assert (operation.calls, operation.retries, operation.throttles) == (1, 2, 2)
+    assert operation.errors == 0
+    assert sum(operation.latency_buckets) == 1
+
+
+def test_metrics_reports_phases(tmp_path):
+    recorder = Metrics()
+    for _ in range(2):
+        with recorder.phase("configure_sending_email", "my-identity.com"):
+            pass
+    with recorder.phase("flush"):
+        pass
+
+    report = recorder.report()
+    assert report["phases"]["configure_sending_email"]["count"] == 2
+    assert list(report["domains"]) == ["my-identity.com"]
+    assert list(report["domains"]["my-identity.com"]) == ["configure_sending_email"]
+
+    recorder.write_json(tmp_path / "metrics.json")
+    assert json.loads((tmp_path / "metrics.json").read_text()) == report
+
+    recorder.write_prometheus(tmp_path / "metrics.prom")
+    prometheus = (tmp_path / "metrics.prom").read_text()
+    assert 'cerby_ses_phase_duration_seconds_count{phase="flush"} 1' in prometheus
+
+
+def test_batch_phases_are_timed(mock_boto3_client_patch, mock_boto3_region_patch):
+    domains = [
+        "new-identity-present-in-route53.com",
+        "existing-identity-present-in-route53.com",
+    ]
+
+    run_batch(domains, workers=2)
+
+    assert sorted(metrics.domains) == sorted(domains)
+    assert set(metrics.domains[domains[0]]) == {
+        "domain",
+        "is_converged",
+        "configure_sending_email",
+        "configure_receiving_email",
+        "configure_mail_from_domain",
+        "configure_email_receiving_rules",
+    }
+    assert metrics.phases["domain"].count == 2
+    assert metrics.phases["flush"].count == 1
+
+
+def test_profiler_merges_threads():
+    def busy_worker():
+        return sum(range(1000))
+
+    profiler = Profiler()
+    profiler.start()
+    thread = threading.Thread(target=busy_worker)
+    thread.start()
+    thread.join()
+    stats = profiler.stop()
+
+    assert "busy_worker" in {name for _, _, name in stats.stats}
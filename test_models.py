@@ -1,4 +1,4 @@
-from models import DkimAttributes, HostedZoneRecord
+from models import DkimAttributes, HostedZoneRecord, ReceiptRule, ResourceIndex
 
 region = "us-east-1"
 hosted_zone_id = "a2b3c4d5"
@@ -26,3 +26,104 @@ def test_identity_dkim_records():
     ]
 
     assert tokens == identity.dkim_tokens_as_records("my-identity.com")
+
+
+def test_hosted_zone_record_equality():
+    record = HostedZoneRecord("My-Identity.com", "MX", 600, ["10 inbound-smtp.com"])
+
+    assert record == HostedZoneRecord("my-identity.com.", "MX")
+    assert hash(record) == hash(HostedZoneRecord("my-identity.com.", "MX"))
+    assert record != HostedZoneRecord("bounce.my-identity.com", "MX")
+    assert record != HostedZoneRecord("identity.com", "MX")
+    assert record != HostedZoneRecord("my-identity.com", "TXT")
+
+    assert record.matches(
+        HostedZoneRecord("my-identity.com.", "MX", 300, ["10 INBOUND-SMTP.com."])
+    )
+    assert not record.matches(
+        HostedZoneRecord("my-identity.com.", "MX", 600, ["10 other-smtp.com"])
+    )
+
+
+def test_resource_index():
+    index = ResourceIndex(
+        [
+            HostedZoneRecord(
+                "token-a._domainkey.my-identity.com.", "CNAME", 300, ["a"]
+            ),
+            HostedZoneRecord("my-identity.com.", "MX", 600, ["10 inbound-smtp.com"]),
+        ]
+    )
+
+    assert len(index) == 2
+    assert HostedZoneRecord("token-a._domainkey.my-identity.com", "CNAME") in index
+    assert HostedZoneRecord("_domainkey.my-identity.com", "CNAME") not in index
+    assert index.contains_value(
+        HostedZoneRecord("my-identity.com", "MX", 600, ["10 inbound-smtp.com"])
+    )
+    assert not index.contains_value(HostedZoneRecord("my-identity.com", "MX"))
+
+    index.add(HostedZoneRecord("my-identity.com", "MX", 600, ["10 other-smtp.com"]))
+    assert len(index) == 2
+    assert index.get(HostedZoneRecord("my-identity.com.", "MX")).values == [
+        "10 other-smtp.com"
+    ]
+
+
+def test_resource_index_receipt_rules():
+    rule = ReceiptRule("rule-set-for-cerby-company", "rule-set-for-cerby-company")
+    rule.create_proxy_rule(bucket_name="bucket", prefix="staged")
+    index = ResourceIndex([rule])
+
+    assert (
+        ReceiptRule("rule-set-for-cerby-company", "rule-set-for-cerby-company") in index
+    )
+    assert ReceiptRule("rule-set-for-cerby", "rule-set-for-cerby-company") not in index
+    assert index.contains_value(rule)
+    assert not index.contains_value(
+        ReceiptRule("rule-set-for-cerby-company", "rule-set-for-cerby-company")
+    )
+
+
+def test_hosted_zone_record_merge_into():
+    record = HostedZoneRecord(
+        "my-identity.com", "MX", 300, ["10 inbound-smtp.us-east-1.amazonaws.com"]
+    )
+
+    assert record.merge_into(None) == ("CREATE", record)
+    existing = HostedZoneRecord(
+        "my-identity.com.", "MX", 600, ["10 INBOUND-SMTP.us-east-1.amazonaws.com."]
+    )
+    assert record.merge_into(existing) == ("NOOP", existing)
+
+    # the MX of another mail provider is left alone, SES would take its mail
+    existing = HostedZoneRecord("my-identity.com.", "MX", 600, ["20 mx.example.net"])
+    assert record.merge_into(existing) == ("MANUAL", record)
+
+    existing = HostedZoneRecord(
+        "my-identity.com.", "MX", 600, ["10 inbound-smtp.eu-west-1.amazonaws.com"]
+    )
+    action, merged = record.merge_into(existing)
+    assert action == "UPSERT"
+    assert merged.ttl == 600
+    assert merged.values == [
+        "10 inbound-smtp.eu-west-1.amazonaws.com",
+        "10 inbound-smtp.us-east-1.amazonaws.com",
+    ]
+
+    spf = HostedZoneRecord(
+        "bounce.my-identity.com", "TXT", values=['"v=spf1 include:amazonses.com ~all"']
+    )
+    existing = HostedZoneRecord(
+        "bounce.my-identity.com", "TXT", values=['"v=spf1 include:example.net ~all"']
+    )
+    assert spf.merge_into(existing) == ("MANUAL", spf)
+    existing.values = ['"google-site-verification=abc"']
+    assert spf.merge_into(existing)[1].values == [
+        '"google-site-verification=abc"',
+        '"v=spf1 include:amazonses.com ~all"',
+    ]
+
+    cname = HostedZoneRecord("a._domainkey.my-identity.com", "CNAME", values=["a"])
+    existing = HostedZoneRecord("a._domainkey.my-identity.com", "CNAME", values=["b"])
+    assert cname.merge_into(existing) == ("MANUAL", cname)
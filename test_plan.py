@@ -0,0 +1,182 @@
+from plan import (
+    CREATE,
+    DKIM,
+    MAIL_FROM,
+    MANUAL,
+    NOOP,
+    RECORD,
+    RULE,
+    UPSERT,
+    Applier,
+    Plan,
+    Planner,
+)
+
+
+def test_plan_new_identity(mock_boto3_client_patch, mock_boto3_region_patch):
+    plan = Planner().plan(["new-identity-present-in-route53.com"])
+
+    assert plan.errors == {}
+    assert plan.region == "us-east-1"
+    assert [(action.kind, action.action) for action in plan.actions] == [
+        (DKIM, CREATE),
+        (RECORD, CREATE),
+        (MAIL_FROM, NOOP),
+        (RECORD, CREATE),
+        (RECORD, CREATE),
+        (RULE, CREATE),
+    ]
+
+
+def test_plan_existing_identity(mock_boto3_client_patch, mock_boto3_region_patch):
+    plan = Planner().plan(
+        [
+            "existing-identity-present-in-route53.com",
+            "new-identity-not-present-in-route53.com",
+        ]
+    )
+
+    existing = [
+        (action.kind, action.action)
+        for action in plan.actions
+        if action.domain == "existing-identity-present-in-route53.com"
+    ]
+    assert existing == [
+        (DKIM, NOOP),
+        (RECORD, CREATE),
+        (RECORD, CREATE),
+        (RECORD, CREATE),
+        (MAIL_FROM, NOOP),
+        (RECORD, CREATE),
+        (RECORD, CREATE),
+        (RULE, CREATE),
+    ]
+    manual = [action for action in plan.changes if action.action == MANUAL]
+    assert len(manual) == 3
+    assert {action.domain for action in manual} == {
+        "new-identity-not-present-in-route53.com"
+    }
+
+
+def test_plan_mail_from(mock_boto3_client_patch, mock_boto3_region_patch):
+    plan = Planner().plan(["empty-mail-from-attributes.com"])
+
+    mail_from = [action for action in plan.actions if action.kind == MAIL_FROM]
+    assert [action.action for action in mail_from] == [CREATE]
+    assert mail_from[0].payload["mail_from_domain"] == (
+        "bounce.empty-mail-from-attributes.com"
+    )
+
+    applier = Applier()
+    applier.apply(plan)
+    applier.identity_repo.client.set_identity_mail_from_domain.assert_called_once()
+
+
+def test_plan_save_and_load(mock_boto3_client_patch, tmp_path):
+    plan = Planner().plan(["new-identity-present-in-route53.com", "accessdenied.com"])
+
+    for name in ["plan.json", "plan.json.gz"]:
+        plan.save(str(tmp_path / name))
+        assert Plan.load(str(tmp_path / name)) == plan
+
+
+def test_apply(mock_boto3_client_patch, mock_boto3_region_patch):
+    plan = Planner().plan(
+        [
+            "new-identity-present-in-route53.com",
+            "new-identity-not-present-in-route53.com",
+        ]
+    )
+    applier = Applier()
+    result = applier.apply(plan)
+
+    assert result.failures == {}
+    assert len(result.records_pending_to_create) == 5
+    assert len(result.changes) == 1
+    assert len(result.changes[0].records) == 5
+    route53 = applier.hzr_repo.client
+    route53.change_resource_record_sets.assert_called_once()
+    ses = applier.identity_repo.client
+    assert ses.verify_domain_dkim.call_count == 2
+    ses.set_identity_mail_from_domain.assert_not_called()
+    # both domains share one proxy rule in one rule set
+    ses.create_receipt_rule_set.assert_called_once()
+    ses.create_receipt_rule.assert_called_once()
+    ses.set_active_receipt_rule_set.assert_called_once()
+
+
+def test_apply_failures(mock_boto3_client_patch, mock_boto3_region_patch):
+    plan = Planner().plan(["accessdenied.com"])
+    result = Applier().apply(plan)
+
+    assert set(result.failures) == {"accessdenied.com"}
+
+
+def test_plan_converged_domains(mock_boto3_client_patch, mock_boto3_region_patch):
+    plan = Planner().plan(["new-identity-present-in-route53.com"])
+    plan.actions = [action for action in plan.actions if action.action == NOOP]
+    plan.errors = {}
+
+    assert plan.converged == ["new-identity-present-in-route53.com"]
+    assert Plan(region="us-east-1", actions=[]).converged == []
+
+
+def test_plan_merges_existing_records(local_aws):
+    zone_id = local_aws.route53.add_hosted_zone("example.com")
+    customer = [
+        ("foo.example.com.", "MX", "20 mx.example.net"),
+        ("bounce.foo.example.com.", "TXT", '"google-site-verification=abc"'),
+    ]
+    local_aws.route53.change_resource_record_sets(
+        HostedZoneId=zone_id,
+        ChangeBatch={
+            "Changes": [
+                {
+                    "Action": "CREATE",
+                    "ResourceRecordSet": {
+                        "Name": name,
+                        "Type": record_type,
+                        "TTL": 300,
+                        "ResourceRecords": [{"Value": value}],
+                    },
+                }
+                for name, record_type, value in customer
+            ]
+        },
+    )
+
+    plan = Planner().plan(["foo.example.com"])
+
+    records = {
+        (action.target, action.record.type): action
+        for action in plan.actions
+        if action.kind == RECORD
+    }
+    # the MX of another mail provider is left to be changed by hand
+    assert records[("foo.example.com", "MX")].action == MANUAL
+    txt = records[("bounce.foo.example.com.", "TXT")]
+    assert txt.action == UPSERT
+    assert txt.record.values == [
+        '"google-site-verification=abc"',
+        '"v=spf1 include:amazonses.com ~all"',
+    ]
+
+    result = Applier().apply(plan)
+
+    assert result.failures == {}
+    assert len(result.changes) == 1
+    assert [
+        (record.name, record.type, record.values)
+        for record in result.records_pending_to_create
+    ] == [("foo.example.com", "MX", ["10 inbound-smtp.us-east-1.amazonaws.com"])]
+    record_sets = {
+        (record_set["Name"], record_set["Type"]): record_set
+        for record_set in local_aws.route53.record_sets(zone_id)
+    }
+    assert record_sets[("foo.example.com.", "MX")]["ResourceRecords"] == [
+        {"Value": "20 mx.example.net"}
+    ]
+    assert [
+        value["Value"]
+        for value in record_sets[("bounce.foo.example.com.", "TXT")]["ResourceRecords"]
+    ] == ['"google-site-verification=abc"', '"v=spf1 include:amazonses.com ~all"']
@@ -0,0 +1,75 @@
+from models import ChangeInfo, HostedZoneRecord
+from propagation import ChangeTracker
+from repository import AWSHostedZoneRecordsRepository
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def stage_domains(local_aws, domains):
+    local_aws.settings.propagation_polls = 3
+    repository = AWSHostedZoneRecordsRepository()
+    for zone in ["company.com", "other.com"]:
+        zone_id = local_aws.route53.add_hosted_zone(zone)
+        for domain in domains:
+            record = HostedZoneRecord(f"{domain}.{zone}", "MX", 600, ["10 inbound"])
+            repository.stage(zone_id, record, owner=f"{domain}.{zone}")
+    return repository.flush()
+
+
+def test_tracker_polls_every_change_on_one_schedule(local_aws):
+    changes = stage_domains(local_aws, ["a", "b"])
+    clock = FakeClock()
+    tracker = ChangeTracker(clock=clock, sleep=clock.sleep)
+    tracker.track(changes)
+    ready = []
+
+    assert tracker.wait(timeout=60, on_ready=ready.append)
+
+    assert clock.sleeps == [2.0, 4.0, 8.0]
+    # one GetChange per change and round, not per domain
+    assert local_aws.calls["GetChange"] == 2 * 4
+    assert sorted(ready) == [
+        "a.company.com",
+        "a.other.com",
+        "b.company.com",
+        "b.other.com",
+    ]
+    assert all(change.status == "INSYNC" for change in changes)
+
+
+def test_tracker_times_out(local_aws):
+    changes = stage_domains(local_aws, ["a"])
+    clock = FakeClock()
+    tracker = ChangeTracker(clock=clock, sleep=clock.sleep)
+    tracker.track(changes)
+
+    assert not tracker.wait(timeout=5)
+    assert clock.now == 5
+    assert tracker.domain_status() == {
+        "a.company.com": "PENDING",
+        "a.other.com": "PENDING",
+    }
+
+
+def test_tracker_reports_failed_changes(local_aws):
+    failed = ChangeInfo(
+        hosted_zone_id="zone", status="FAILED", domains=["a.com"], error="denied"
+    )
+    unknown = ChangeInfo(hosted_zone_id="zone", id="/change/unknown", domains=["b.com"])
+    tracker = ChangeTracker(sleep=lambda seconds: None)
+    tracker.track([failed, unknown])
+
+    assert not tracker.wait()
+    assert tracker.domain_status() == {"a.com": "FAILED", "b.com": "FAILED"}
+    assert unknown.error
@@ -0,0 +1,156 @@
+import argparse
+
+import pytest
+from boto3.session import Session
+from botocore.awsrequest import AWSResponse
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+import ratelimit
+from ratelimit import RateLimiter, TokenBucket, parse_rate
+
+THROTTLING = (
+    b"""<?xml version="1.0"?>
+<ErrorResponse xmlns="https://route53.amazonaws.com/doc/2013-04-01/">
+  <Error><Type>Sender</Type><Code>Throttling</Code>"""
+    b"""<Message>Rate exceeded</Message></Error>
+</ErrorResponse>"""
+)
+
+HOSTED_ZONES = b"""<?xml version="1.0"?>
+<ListHostedZonesResponse xmlns="https://route53.amazonaws.com/doc/2013-04-01/">
+  <HostedZones/><IsTruncated>false</IsTruncated><MaxItems>100</MaxItems>
+</ListHostedZonesResponse>"""
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class RawBody:
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+
+def responder(*responses):
+    responses = list(responses)
+
+    def send(request, **kwargs):
+        status, body = responses.pop(0)
+        return AWSResponse(request.url, status, {}, RawBody(body))
+
+    return send
+
+
+@pytest.fixture
+def route53_client(monkeypatch):
+    monkeypatch.setattr(ratelimit, "backoff_delay", lambda attempts: 0.0)
+    session = Session(
+        aws_access_key_id="access-key",
+        aws_secret_access_key="secret-key",
+        region_name="us-east-1",
+    )
+    config = Config(retries={"mode": "standard", "total_max_attempts": 3})
+    return session.client("route53", config=config)
+
+
+def test_parse_rate():
+    assert parse_rate("route53=2.5") == ("route53", 2.5)
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_rate("route53")
+
+
+def test_token_bucket_waits_when_empty():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=5, clock=clock, sleep=clock.sleep)
+
+    waits = [bucket.acquire() for _ in range(10)]
+    assert waits[:5] == [0.0] * 5
+    assert waits[5:] == pytest.approx([0.2] * 5)
+    assert clock.now == pytest.approx(1.0)
+
+
+def test_token_bucket_adapts_to_throttling():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=4, clock=clock, sleep=clock.sleep, increase=1)
+
+    bucket.on_throttle()
+    bucket.on_throttle()
+    assert bucket.rate == 1
+    for _ in range(3):
+        bucket.on_throttle()
+    assert bucket.rate == 0.5
+
+    for _ in range(10):
+        bucket.on_success()
+    assert bucket.rate == 4
+
+
+def test_rate_limiter_retries_throttled_calls(route53_client):
+    limiter = RateLimiter()
+    limiter.attach(route53_client, "route53", None, max_attempts=3)
+    route53_client.meta.events.register(
+        "before-send.route-53",
+        responder((400, THROTTLING), (400, THROTTLING), (200, HOSTED_ZONES)),
+    )
+
+    assert route53_client.list_hosted_zones()["HostedZones"] == []
+    stats = limiter.stats("route53")
+    assert (stats.calls, stats.attempts, stats.retries, stats.throttles) == (1, 3, 2, 2)
+    # halved twice, then sped up by the success
+    assert limiter.bucket("route53").rate == pytest.approx(1.35)
+
+
+def test_rate_limiter_hands_over_its_stats(route53_client):
+    limiter = RateLimiter()
+    limiter.attach(route53_client, "route53", None, max_attempts=3)
+    route53_client.meta.events.register(
+        "before-send.route-53",
+        responder((400, THROTTLING), (200, HOSTED_ZONES), (200, HOSTED_ZONES)),
+    )
+    route53_client.list_hosted_zones()
+
+    taken = limiter.take_stats()
+    assert (taken["route53"].calls, taken["route53"].throttles) == (1, 1)
+    assert limiter.stats("route53").calls == 0
+
+    # the attached client keeps counting in the cleared stats
+    route53_client.list_hosted_zones()
+    limiter.merge_stats(taken)
+    assert (limiter.stats("route53").calls, limiter.stats("route53").throttles) == (
+        2,
+        1,
+    )
+
+
+def test_rate_limiter_gives_up_after_max_attempts(route53_client):
+    limiter = RateLimiter()
+    limiter.attach(route53_client, "route53", None, max_attempts=3)
+    route53_client.meta.events.register(
+        "before-send.route-53", responder(*[(400, THROTTLING)] * 3)
+    )
+
+    with pytest.raises(ClientError):
+        route53_client.list_hosted_zones()
+    assert limiter.stats("route53").throttles == 3
+
+
+def test_rate_limiter_buckets_by_service_and_account():
+    limiter = RateLimiter({"ses": 2})
+
+    assert limiter.bucket("route53") is limiter.bucket("route53", None)
+    assert limiter.bucket("route53") is not limiter.bucket("route53", "account-b")
+    assert limiter.bucket("ses").rate == 2
+
+    limiter.configure({"ses": 10})
+    assert limiter.bucket("ses").rate == 10
@@ -0,0 +1,83 @@
+import pytest
+
+from regions import parse_regions, run_regions
+from rules import CERBY_RULE_SET_NAME, proxy_bucket
+
+REGIONS = ["us-east-1", "eu-west-1", "ca-central-1"]
+
+
+def test_parse_regions():
+    assert parse_regions("us-east-1, eu-west-1,,us-east-1") == [
+        "us-east-1",
+        "eu-west-1",
+    ]
+
+
+def test_proxy_bucket():
+    assert proxy_bucket("ca-central-1").endswith("ca-central-1")
+    with pytest.raises(Exception, match="sa-east-1"):
+        proxy_bucket("sa-east-1")
+
+
+def test_run_regions(local_aws):
+    zone_id = local_aws.route53.add_hosted_zone("example.com")
+    domains = ["foo.example.com", "bar.example.com"]
+
+    reported = []
+    summary = run_regions(domains, REGIONS, workers=2, on_result=reported.append)
+
+    assert summary.failed == []
+    assert summary.changed == len(domains) * len(REGIONS)
+    assert sorted((result.domain, result.region) for result in reported) == (
+        sorted((domain, region) for domain in domains for region in REGIONS)
+    )
+    for region in REGIONS:
+        ses = local_aws.ses(region)
+        assert sorted(ses.identities) == sorted(domains)
+        (rule,) = ses.rule_sets[CERBY_RULE_SET_NAME]
+        assert sorted(rule["Recipients"]) == sorted(domains)
+        assert rule["Actions"][0]["S3Action"]["BucketName"] == proxy_bucket(region)
+    # Route53 is read once per domain and written once for every region
+    assert local_aws.calls["ChangeResourceRecordSets"] == 1
+    record_sets = {
+        (record_set["Name"], record_set["Type"]): record_set
+        for record_set in local_aws.route53.record_sets(zone_id)
+    }
+    inbound = record_sets[("foo.example.com.", "MX")]["ResourceRecords"]
+    assert sorted(value["Value"] for value in inbound) == sorted(
+        f"10 inbound-smtp.{region}.amazonaws.com" for region in REGIONS
+    )
+    # the stand-in gives an identity the same DKIM tokens in every region
+    dkim = [name for name, kind in record_sets if "_domainkey.foo" in name]
+    assert len(dkim) == 3
+
+    local_aws.calls.clear()
+    summary = run_regions(domains, REGIONS, workers=2)
+    assert summary.converged == len(domains) * len(REGIONS)
+    assert "ChangeResourceRecordSets" not in local_aws.calls
+
+
+def test_run_regions_adds_a_region(local_aws):
+    zone_id = local_aws.route53.add_hosted_zone("example.com")
+    domains = ["foo.example.com"]
+    assert run_regions(domains, REGIONS[:1]).failed == []
+
+    local_aws.calls.clear()
+    summary = run_regions(domains, REGIONS)
+
+    assert summary.failed == []
+    assert local_aws.calls["ChangeResourceRecordSets"] == 1
+    record_sets = {
+        (record_set["Name"], record_set["Type"]): record_set
+        for record_set in local_aws.route53.record_sets(zone_id)
+    }
+    # the MX of the first region is kept and the new regions are added to it
+    inbound = record_sets[("foo.example.com.", "MX")]["ResourceRecords"]
+    assert [value["Value"] for value in inbound] == [
+        f"10 inbound-smtp.{region}.amazonaws.com" for region in REGIONS
+    ]
+    feedback = record_sets[("bounce.foo.example.com.", "MX")]["ResourceRecords"]
+    assert [value["Value"] for value in feedback] == [
+        f"10 feedback-smtp.{region}.amazonses.com" for region in REGIONS
+    ]
+    assert run_regions(domains, REGIONS).converged == len(REGIONS)
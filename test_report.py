@@ -0,0 +1,65 @@
+import io
+import json
+
+from batch import run_batch
+from localaws import LocalAWSError
+from report import EventWriter
+
+
+def read_events(stream: io.StringIO):
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_batch_events(local_aws):
+    local_aws.route53.add_hosted_zone("example.com")
+    stream = io.StringIO()
+    events = EventWriter(stream)
+
+    summary = run_batch(
+        ["foo.example.com", "no-zone.com"], workers=2, on_result=events.domain_result
+    )
+    # every domain is reported by the batch, not by the summary
+    assert {event["domain"] for event in read_events(stream)} == {
+        "foo.example.com",
+        "no-zone.com",
+    }
+    events.summary(summary)
+
+    emitted = read_events(stream)
+    domains = {
+        event["domain"]: event["status"]
+        for event in emitted
+        if event["event"] == "domain"
+    }
+    assert domains == {"foo.example.com": "changed", "no-zone.com": "changed"}
+    pending = [event for event in emitted if event["event"] == "pending_record"]
+    assert len(pending) == 6
+    assert {event["domain"] for event in pending} == {"no-zone.com"}
+    changes = [event for event in emitted if event["event"] == "change"]
+    assert [change["domains"] for change in changes] == [["foo.example.com"]]
+    assert changes[0]["id"]
+    assert emitted[-1]["event"] == "summary"
+    assert emitted[-1]["changed"] == 2
+    assert all("time" in event for event in emitted)
+
+
+def test_rule_failures_are_reported_once(local_aws, monkeypatch):
+    events = EventWriter(io.StringIO())
+    local_aws.route53.add_hosted_zone("example.com")
+    ses = local_aws.ses()
+
+    def denied(**kwargs):
+        raise LocalAWSError("AccessDenied", "Access denied")
+
+    monkeypatch.setattr(ses, "create_receipt_rule", denied)
+    summary = run_batch(["foo.example.com"], on_result=events.domain_result)
+    events.summary(summary)
+
+    emitted = read_events(events.stream)
+    failures = [event for event in emitted if event["event"] == "rule_failed"]
+    assert len(failures) == 1
+    assert failures[0]["domain"] == "foo.example.com"
+    assert failures[0]["error"].endswith("Access denied")
+    (domain,) = [event for event in emitted if event["event"] == "domain"]
+    assert domain["status"] == "failed"
+    assert emitted[-1]["failed"] == 1
@@ -1,5 +1,9 @@
+import pytest
+
+from exceptions import ChangeConflictException
 from models import DkimAttributes, HostedZoneRecord, MailFromDomainAttributes
 from repository import (
+    MAX_RECORDS_PER_CHANGE_BATCH,
     AWSHostedZoneRecordsRepository,
     AWSHostedZoneRepository,
     AWSIdentityRepository,
@@ -84,6 +88,30 @@ def test_hosted_zone_repository_get(mock_boto3_client_patch):
     assert hosted_zone is None
 
 
+def test_hosted_zone_repository_get_most_specific_zone(mock_boto3_client_patch):
+    hosted_zone_repo = AWSHostedZoneRepository()
+
+    assert hosted_zone_repo.get("cerby.company.com") == "company-id"
+    assert hosted_zone_repo.get("Company.com.") == "company-id"
+    assert hosted_zone_repo.get("mail.internal.company.com") == "company-id"
+    assert hosted_zone_repo.get("company.org") is None
+    assert hosted_zone_repo.get("ny-company.com") is None
+    assert hosted_zone_repo.get("identity-present-in-route53.com") is None
+
+    # zones are listed once for every domain
+    assert hosted_zone_repo.client.list_hosted_zones.call_count == 2
+
+
+def test_hosted_zone_repository_zone_visibility(mock_boto3_client_patch):
+    hosted_zone_repo = AWSHostedZoneRepository(zone_visibility="private")
+    assert hosted_zone_repo.get("mail.internal.company.com") == "internal-company-id"
+    assert hosted_zone_repo.get("cerby.company.com") is None
+
+    hosted_zone_repo = AWSHostedZoneRepository(zone_visibility="all")
+    assert hosted_zone_repo.get("mail.internal.company.com") == "internal-company-id"
+    assert hosted_zone_repo.get("cerby.company.com") == "company-id"
+
+
 def test_hosted_zone_records_repository_add(mock_boto3_client_patch):
     record = HostedZoneRecord(
         "token-a._domainkey.us-east-1.my-identity.com",
@@ -113,3 +141,169 @@ def test_hosted_zone_records_repository_get(mock_boto3_client_patch):
 
     records = hosted_zone_record_repo.get(hosted_zone_id="token-b-id")
     assert record not in records
+
+
+def test_hosted_zone_records_repository_get_paginated(mock_boto3_client_patch):
+    hosted_zone_record_repo = AWSHostedZoneRecordsRepository()
+
+    records = hosted_zone_record_repo.get(hosted_zone_id="paginated-id")
+    assert len(records) == 8
+    assert hosted_zone_record_repo.client.list_resource_record_sets.call_count == 5
+
+
+def test_hosted_zone_records_repository_iter_stops_at_neighborhood(
+    mock_boto3_client_patch,
+):
+    hosted_zone_record_repo = AWSHostedZoneRecordsRepository()
+
+    records = hosted_zone_record_repo.iter(
+        "paginated-id", "my-identity.com", include_subdomains=False
+    )
+    assert [(record.name, record.type) for record in records] == [
+        ("my-identity.com.", "MX"),
+        ("my-identity.com.", "TXT"),
+    ]
+    assert hosted_zone_record_repo.client.list_resource_record_sets.call_count == 2
+
+    records = hosted_zone_record_repo.get(
+        "paginated-id", "bounce.my-identity.com", "TXT", include_subdomains=False
+    )
+    assert [(record.name, record.type) for record in records] == [
+        ("bounce.my-identity.com.", "TXT"),
+    ]
+
+
+def test_hosted_zone_records_repository_get_domain_records(mock_boto3_client_patch):
+    hosted_zone_record_repo = AWSHostedZoneRecordsRepository()
+
+    records = hosted_zone_record_repo.get_domain_records(
+        "paginated-id", "my-identity.com"
+    )
+    assert [(record.name, record.type) for record in records] == [
+        ("my-identity.com.", "MX"),
+        ("my-identity.com.", "TXT"),
+        ("bounce.my-identity.com.", "MX"),
+        ("bounce.my-identity.com.", "TXT"),
+        ("_domainkey.my-identity.com.", "TXT"),
+        ("token-a._domainkey.my-identity.com.", "CNAME"),
+        ("token-b._domainkey.my-identity.com.", "CNAME"),
+    ]
+
+
+def test_hosted_zone_records_repository_stage_and_flush(mock_boto3_client_patch):
+    hosted_zone_record_repo = AWSHostedZoneRecordsRepository()
+    record = HostedZoneRecord("my-identity.com", "MX", 600, ["10 inbound-smtp.com"])
+
+    hosted_zone_record_repo.stage("zone-a", record, owner="my-identity.com")
+    hosted_zone_record_repo.stage("zone-a", record, owner="other-identity.com")
+    hosted_zone_record_repo.stage(
+        "zone-a", HostedZoneRecord("bounce.my-identity.com", "MX", 600, ["10 f.com"])
+    )
+    hosted_zone_record_repo.stage("zone-b", record, action="UPSERT")
+    hosted_zone_record_repo.client.change_resource_record_sets.assert_not_called()
+
+    changes = hosted_zone_record_repo.flush()
+    assert [(change.hosted_zone_id, len(change.records)) for change in changes] == [
+        ("zone-a", 2),
+        ("zone-b", 1),
+    ]
+    assert changes[0].id == "/change/C1234567890"
+    assert changes[0].domains == ["my-identity.com", "other-identity.com"]
+    client = hosted_zone_record_repo.client
+    assert client.change_resource_record_sets.call_count == 2
+    batch = client.change_resource_record_sets.call_args_list[1].kwargs["ChangeBatch"]
+    assert batch["Changes"][0]["Action"] == "UPSERT"
+
+    assert hosted_zone_record_repo.flush() == []
+
+
+def test_hosted_zone_records_repository_stage_merges_record_sets(
+    mock_boto3_client_patch,
+):
+    hosted_zone_record_repo = AWSHostedZoneRecordsRepository()
+    name = "my-identity.com"
+
+    hosted_zone_record_repo.stage(
+        "zone-a", HostedZoneRecord(name, "TXT", 300, ['"a"']), owner="a.com"
+    )
+    hosted_zone_record_repo.stage(
+        "zone-a",
+        HostedZoneRecord(name, "TXT", 300, ['"a"', '"b"']),
+        action="UPSERT",
+        owner="b.com",
+    )
+    with pytest.raises(ChangeConflictException):
+        hosted_zone_record_repo.stage(
+            "zone-a", HostedZoneRecord(name, "TXT", 300, ['"a"']), action="DELETE"
+        )
+
+    changes = hosted_zone_record_repo.flush()
+    assert changes[0].domains == ["a.com", "b.com"]
+    client = hosted_zone_record_repo.client
+    batch = client.change_resource_record_sets.call_args.kwargs["ChangeBatch"]
+    assert len(batch["Changes"]) == 1
+    assert batch["Changes"][0]["Action"] == "UPSERT"
+    values = batch["Changes"][0]["ResourceRecordSet"]["ResourceRecords"]
+    assert values == [{"Value": '"a"'}, {"Value": '"b"'}]
+
+
+def test_hosted_zone_records_repository_stage_splits_batches(mock_boto3_client_patch):
+    hosted_zone_record_repo = AWSHostedZoneRecordsRepository()
+
+    submitted = []
+    for index in range(MAX_RECORDS_PER_CHANGE_BATCH + 1):
+        record = HostedZoneRecord(f"token-{index}.my-identity.com", "CNAME", 300, ["a"])
+        submitted.extend(hosted_zone_record_repo.stage("zone-a", record))
+    assert [len(change.records) for change in submitted] == [1000]
+
+    submitted = []
+    for index in range(40):
+        record = HostedZoneRecord(
+            f"txt-{index}.my-identity.com", "TXT", 300, ["a" * 1000]
+        )
+        submitted.extend(hosted_zone_record_repo.stage("zone-a", record))
+    submitted.extend(hosted_zone_record_repo.flush())
+    # the CNAME left over from the full batch is sent with the first 31 TXT
+    assert [len(change.records) for change in submitted] == [32, 9]
+
+
+def test_identity_repository_get_attributes_bulk(mock_boto3_client_patch):
+    identity_repo = AWSIdentityRepository()
+    names = [f"tenant-{index}.com" for index in range(250)] + [
+        "existing-identity-present-in-route53.com",
+        "empty-mail-from-attributes.com",
+    ]
+
+    dkim_attributes = identity_repo.get_dkim_attributes_bulk(names)
+    assert list(dkim_attributes) == ["existing-identity-present-in-route53.com"]
+    assert identity_repo.client.get_identity_dkim_attributes.call_count == 3
+
+    mail_from_attributes = identity_repo.get_mail_from_domain_attributes_bulk(names)
+    assert len(mail_from_attributes) == 251
+    assert "empty-mail-from-attributes.com" not in mail_from_attributes
+    assert identity_repo.client.get_identity_mail_from_domain_attributes.call_count == 3
+
+
+def test_identity_repository_prefetch(mock_boto3_client_patch):
+    identity_repo = AWSIdentityRepository()
+    identity_repo.prefetch(
+        [
+            "existing-identity-present-in-route53.com",
+            "new-identity-present-in-route53.com",
+        ]
+    )
+    client = identity_repo.client
+
+    assert identity_repo.get_dkim_attributes("existing-identity-present-in-route53.com")
+    assert (
+        identity_repo.get_dkim_attributes("new-identity-present-in-route53.com") is None
+    )
+    assert identity_repo.get_mail_from_domain_attributes(
+        "new-identity-present-in-route53.com"
+    )
+    assert client.get_identity_dkim_attributes.call_count == 1
+    assert client.get_identity_mail_from_domain_attributes.call_count == 1
+
+    # prefetched attributes are only used once
+    identity_repo.get_dkim_attributes("existing-identity-present-in-route53.com")
+    assert client.get_identity_dkim_attributes.call_count == 2
@@ -0,0 +1,194 @@
+import base64
+import socket
+import threading
+
+import pytest
+
+pytest.importorskip("dns")
+
+import dns.exception
+import dns.message
+import dns.name
+import dns.opcode
+import dns.query
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+import dns.rrset
+import dns.tsig
+
+from batch import run_batch
+from dns_provider import DNSProviders, Route53Provider
+from models import HostedZoneRecord
+from rfc2136 import RFC2136Provider, RFC2136Zone
+
+ZONE = "corp.example.com."
+KEY_NAME = "cerby."
+KEY_SECRET = base64.b64encode(b"cerby-test-secret").decode()
+SOA = "ns.corp.example.com. admin.corp.example.com. 1 3600 600 86400 300"
+
+
+class LocalDNSServer:
+    """Authoritative server of one zone, answering AXFR and UPDATE over TCP
+
+    Every message must be signed with the TSIG key, updates are applied to
+    the in-memory zone all at once.
+    """
+
+    def __init__(self) -> None:
+        self.key = dns.tsig.Key(KEY_NAME, KEY_SECRET)
+        self.origin = dns.name.from_text(ZONE)
+        self.records = {(self.origin, dns.rdatatype.SOA): (3600, {SOA})}
+        self.updates = 0
+        self.transfers = 0
+        self.rejected = 0
+        self._socket = socket.create_server(("127.0.0.1", 0))
+        self.port = self._socket.getsockname()[1]
+        self._thread = threading.Thread(target=self.serve, daemon=True)
+        self._thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                connection, _ = self._socket.accept()
+            except OSError:
+                return
+            with connection:
+                try:
+                    request, _ = dns.query.receive_tcp(connection, keyring=self.key)
+                except dns.exception.DNSException:
+                    # unsigned or badly signed, dropped without an answer
+                    self.rejected += 1
+                else:
+                    dns.query.send_tcp(connection, self.answer(request))
+
+    def answer(self, request):
+        response = dns.message.make_response(request)
+        if request.opcode() == dns.opcode.UPDATE:
+            rcode = self.check(request.prerequisite)
+            if rcode != dns.rcode.NOERROR:
+                response.set_rcode(rcode)
+                return response
+            self.updates += 1
+            self.apply(request.update)
+        else:
+            self.transfers += 1
+            soa = dns.rrset.from_text(self.origin, 3600, "IN", "SOA", SOA)
+            response.answer.append(soa)
+            for (name, rdtype), (ttl, values) in self.records.items():
+                if rdtype != dns.rdatatype.SOA:
+                    response.answer.append(
+                        dns.rrset.from_text(name, ttl, "IN", rdtype, *values)
+                    )
+            response.answer.append(soa)
+        return response
+
+    def check(self, rrsets):
+        """RFC 2136 prerequisites, an RRset that must or must not exist"""
+        for rrset in rrsets:
+            exists = (rrset.name, rrset.rdtype) in self.records
+            # parsed update RRsets keep their NONE or ANY class in deleting
+            if rrset.deleting == dns.rdataclass.NONE and exists:
+                return dns.rcode.YXRRSET
+            if rrset.deleting == dns.rdataclass.ANY and not exists:
+                return dns.rcode.NXRRSET
+        return dns.rcode.NOERROR
+
+    def apply(self, rrsets):
+        for rrset in rrsets:
+            key = (rrset.name, rrset.rdtype)
+            if rrset.deleting == dns.rdataclass.ANY:
+                self.records.pop(key, None)
+            else:
+                _, values = self.records.setdefault(key, (rrset.ttl, set()))
+                values.update(rdata.to_text() for rdata in rrset)
+
+    def values(self, name: str, rdtype: str):
+        key = (dns.name.from_text(name), dns.rdatatype.from_text(rdtype))
+        return sorted(self.records.get(key, (0, set()))[1])
+
+    def close(self):
+        self._socket.close()
+
+
+@pytest.fixture
+def local_dns():
+    server = LocalDNSServer()
+    yield server
+    server.close()
+
+
+def zone(server: LocalDNSServer, **kwargs) -> RFC2136Zone:
+    return RFC2136Zone(
+        zone=ZONE,
+        server="127.0.0.1",
+        port=server.port,
+        key_name=KEY_NAME,
+        key_secret=KEY_SECRET,
+        **kwargs,
+    )
+
+
+def test_run_batch_rfc2136(local_aws, local_dns):
+    domains = ["foo.corp.example.com", "bar.corp.example.com"]
+    provider = DNSProviders([RFC2136Provider([zone(local_dns)]), Route53Provider()])
+
+    summary = run_batch(domains, hzr_repo=provider, hz_repo=provider)
+
+    assert summary.failed == []
+    assert summary.pending_records == 0
+    # both domains go out in one atomic update of the zone
+    assert local_dns.updates == 1
+    assert local_dns.transfers == 1
+    assert [change.status for change in summary.changes] == ["INSYNC"]
+    assert "ChangeResourceRecordSets" not in local_aws.calls
+    assert local_dns.values("foo.corp.example.com", "MX") == [
+        "10 inbound-smtp.us-east-1.amazonaws.com."
+    ]
+    assert local_dns.values("bounce.bar.corp.example.com", "TXT") == [
+        '"v=spf1 include:amazonses.com ~all"'
+    ]
+
+    provider = DNSProviders([RFC2136Provider([zone(local_dns)]), Route53Provider()])
+    summary = run_batch(domains, hzr_repo=provider, hz_repo=provider)
+    assert summary.converged == len(domains)
+    assert local_dns.updates == 1
+
+
+def test_rfc2136_bad_key(local_dns):
+    provider = RFC2136Provider([zone(local_dns, timeout=2.0)])
+    zone_id = provider.get("foo.corp.example.com")
+    provider.zones[zone_id].key_secret = base64.b64encode(b"not-the-secret").decode()
+    record = HostedZoneRecord(
+        "foo.corp.example.com", "MX", values=["10 inbound-smtp.us-east-1.amazonaws.com"]
+    )
+    provider.stage(zone_id, record, owner="foo.corp.example.com")
+
+    (change,) = provider.flush()
+
+    assert change.error
+    assert change.domains == ["foo.corp.example.com"]
+    assert local_dns.updates == 0
+    assert local_dns.rejected == 1
+
+
+def test_rfc2136_create_fails_on_an_existing_record(local_dns):
+    provider = RFC2136Provider([zone(local_dns)])
+    zone_id = provider.get("foo.corp.example.com")
+    name = dns.name.from_text("foo.corp.example.com.")
+    local_dns.records[(name, dns.rdatatype.MX)] = (300, {"20 mx.example.net."})
+    record = HostedZoneRecord(
+        "foo.corp.example.com", "MX", values=["10 inbound-smtp.us-east-1.amazonaws.com"]
+    )
+    provider.stage(zone_id, record, owner="foo.corp.example.com")
+
+    (change,) = provider.flush()
+
+    assert change.status == "FAILED"
+    assert "YXRRSET" in change.error
+    assert local_dns.updates == 0
+    assert local_dns.values("foo.corp.example.com", "MX") == ["20 mx.example.net."]
+
+    provider.stage(zone_id, record, action="UPSERT", owner="foo.corp.example.com")
+    (change,) = provider.flush()
+    assert change.status == "INSYNC"
@@ -0,0 +1,139 @@
+from unittest.mock import MagicMock
+
+from botocore.exceptions import ClientError
+
+from models import ReceiptRule
+from rules import (
+    CERBY_RULE_SET_NAME,
+    MAX_RECIPIENTS_PER_RULE,
+    MAX_RULES_PER_RULE_SET,
+    ReceiptRuleManager,
+    legacy_rule_set_name,
+)
+
+
+def domains(count, start=0):
+    return [f"domain-{index}.com" for index in range(start, start + count)]
+
+
+def test_domains_are_packed_into_few_rules(local_aws):
+    manager = ReceiptRuleManager()
+    for domain in domains(250):
+        manager.stage(domain)
+
+    assert manager.flush() == {}
+
+    ses = local_aws.ses()
+    assert ses.active_rule_set == CERBY_RULE_SET_NAME
+    rules = ses.rule_sets[CERBY_RULE_SET_NAME]
+    assert [rule["Name"] for rule in rules] == [
+        "cerby-proxy-001",
+        "cerby-proxy-002",
+        "cerby-proxy-003",
+    ]
+    assert [len(rule["Recipients"]) for rule in rules] == [100, 100, 50]
+    assert local_aws.calls["CreateReceiptRule"] == 3
+    assert local_aws.calls["SetActiveReceiptRuleSet"] == 1
+
+    # a later run fills the last rule instead of adding one
+    manager = ReceiptRuleManager()
+    assert manager.covers("DOMAIN-7.com")
+    for domain in domains(10, start=245):
+        manager.stage(domain)
+
+    assert manager.flush() == {}
+    assert len(ses.rule_sets[CERBY_RULE_SET_NAME][2]["Recipients"]) == 55
+    assert local_aws.calls["UpdateReceiptRule"] == 1
+    assert local_aws.calls["CreateReceiptRuleSet"] == 1
+    assert local_aws.calls["SetActiveReceiptRuleSet"] == 1
+
+
+def test_legacy_rule_set_name():
+    assert legacy_rule_set_name("cerby.company.com") == "rule-set-for-cerby-company"
+    assert legacy_rule_set_name("mail.company.com") == "rule-set-for-cerby-company"
+
+
+def test_rules_are_added_to_the_active_rule_set(local_aws):
+    ses = local_aws.ses()
+    ses.create_receipt_rule_set("customer-rules")
+    ses.create_receipt_rule(
+        "customer-rules", {"Name": "customer-rule", "Recipients": ["customer.com"]}
+    )
+    ses.create_receipt_rule(
+        "customer-rules",
+        {"Name": "customer-catch-all", "Recipients": []},
+        After="customer-rule",
+    )
+    ses.set_active_receipt_rule_set("customer-rules")
+
+    manager = ReceiptRuleManager()
+    for domain in domains(MAX_RECIPIENTS_PER_RULE + 1):
+        manager.stage(domain)
+
+    assert manager.flush() == {}
+    assert list(ses.rule_sets) == ["customer-rules"]
+    # after the customer's rules, which the proxy rule would stop
+    assert [rule["Name"] for rule in ses.rule_sets["customer-rules"]] == [
+        "customer-rule",
+        "customer-catch-all",
+        "cerby-proxy-001",
+        "cerby-proxy-002",
+    ]
+    assert ses.active_rule_set == "customer-rules"
+    assert local_aws.calls["SetActiveReceiptRuleSet"] == 0
+
+
+def test_active_legacy_rule_set_covers_its_domains(local_aws):
+    ses = local_aws.ses()
+    name = legacy_rule_set_name("cerby.company.com")
+    ses.create_receipt_rule_set(name)
+    ses.create_receipt_rule(name, {"Name": name, "Recipients": []})
+
+    assert not ReceiptRuleManager().covers("cerby.company.com")
+
+    ses.set_active_receipt_rule_set(name)
+    manager = ReceiptRuleManager()
+
+    assert manager.covers("cerby.company.com")
+    assert manager.covers("mail.company.com")
+    assert not manager.covers("cerby.other.com")
+    manager.stage("mail.company.com")
+    assert manager.flush() == {}
+    assert local_aws.calls["CreateReceiptRule"] == 0
+
+
+def test_domains_that_do_not_fit_fail(mock_boto3_region_patch):
+    repository = MagicMock()
+    rules = []
+    for index in range(MAX_RULES_PER_RULE_SET):
+        rule = ReceiptRule(name=f"rule-{index}", rule_set_name="customer-rules")
+        rule.rule["Recipients"] = []
+        rules.append(rule)
+    repository.get_active_receipt_rule_set.return_value = ("customer-rules", rules)
+
+    manager = ReceiptRuleManager(repository)
+    manager.stage("my-identity.com")
+
+    assert "is full" in manager.flush()["my-identity.com"]
+    repository.create_receipt_rule.assert_not_called()
+
+
+def test_failed_rule_write_only_fails_its_domains(mock_boto3_region_patch):
+    repository = MagicMock()
+    repository.get_active_receipt_rule_set.return_value = (None, [])
+    repository.get_receipt_rule_set.return_value = None
+    repository.create_receipt_rule.side_effect = [
+        None,
+        ClientError(
+            {"Error": {"Code": "InvalidParameterValue", "Message": "Rule rejected"}},
+            "CreateReceiptRule",
+        ),
+    ]
+
+    manager = ReceiptRuleManager(repository)
+    for domain in domains(MAX_RECIPIENTS_PER_RULE + 1):
+        manager.stage(domain)
+
+    assert "Rule rejected" in manager.flush()["domain-100.com"]
+    assert [rule.name for rule in manager.rules] == ["cerby-proxy-001"]
+    repository.set_active_receipt_rule_set.assert_called_once_with(CERBY_RULE_SET_NAME)
@@ -0,0 +1,136 @@
+from batch import run_batch
+from models import HostedZoneRecord
+from plan import MAIL_FROM, RECORD, UPSERT
+from rules import CERBY_RULE_SET_NAME
+from teardown import DELETE, IDENTITY, RULE_SET, Teardown, cerby_values
+
+
+def test_cerby_values():
+    domain = "foo.example.com"
+    assert cerby_values(
+        domain,
+        HostedZoneRecord(
+            "abc._domainkey.foo.example.com.",
+            "CNAME",
+            values=["abc.dkim.amazonses.com"],
+        ),
+    ) == ["abc.dkim.amazonses.com"]
+    assert cerby_values(
+        domain,
+        HostedZoneRecord(
+            "bounce.foo.example.com",
+            "MX",
+            values=["10 feedback-smtp.eu-west-1.amazonses.com"],
+        ),
+    ) == ["10 feedback-smtp.eu-west-1.amazonses.com"]
+    # shared with another mail provider, only the SES value is Cerby's
+    assert cerby_values(
+        domain,
+        HostedZoneRecord(
+            domain,
+            "MX",
+            values=["10 inbound-smtp.us-east-1.amazonaws.com", "20 mx.example.net"],
+        ),
+    ) == ["10 inbound-smtp.us-east-1.amazonaws.com"]
+    assert (
+        cerby_values(
+            domain,
+            HostedZoneRecord(
+                domain, "TXT", values=['"v=spf1 include:amazonses.com ~all"']
+            ),
+        )
+        == []
+    )
+
+
+def test_teardown(local_aws):
+    zone_id = local_aws.route53.add_hosted_zone("example.com")
+    domains = ["foo.example.com", "bar.example.com", "baz.example.com"]
+    assert run_batch(domains).failed == []
+    customer_record = {
+        "Name": "foo.example.com.",
+        "Type": "TXT",
+        "TTL": 300,
+        "ResourceRecords": [{"Value": '"google-site-verification=abc"'}],
+    }
+    # a TXT record the SPF value was merged into
+    shared_record = {
+        "Name": "bounce.foo.example.com.",
+        "Type": "TXT",
+        "TTL": 600,
+        "ResourceRecords": [
+            {"Value": '"google-site-verification=def"'},
+            {"Value": '"v=spf1 include:amazonses.com ~all"'},
+        ],
+    }
+    local_aws.route53.change_resource_record_sets(
+        HostedZoneId=zone_id,
+        ChangeBatch={
+            "Changes": [
+                {"Action": "CREATE", "ResourceRecordSet": customer_record},
+                {"Action": "UPSERT", "ResourceRecordSet": shared_record},
+            ]
+        },
+    )
+    legacy = "rule-set-for-cerby-example"
+    local_aws.ses().create_receipt_rule_set(RuleSetName=legacy)
+    before = local_aws.route53.record_sets(zone_id)
+
+    teardown = Teardown()
+    plan = teardown.plan(["foo.example.com", "bar.example.com"])
+
+    assert plan.errors == {}
+    assert {(action.kind, action.action, action.target) for action in plan.actions} >= {
+        (MAIL_FROM, DELETE, "foo.example.com"),
+        (MAIL_FROM, DELETE, "bar.example.com"),
+        (RECORD, UPSERT, "bounce.foo.example.com."),
+    }
+    # the identities may predate Cerby, they are kept
+    assert IDENTITY not in {action.kind for action in plan.actions}
+    # baz.example.com still uses the legacy rule set of example.com
+    assert (RULE_SET, legacy) not in {
+        (action.kind, action.target) for action in plan.actions
+    }
+    # planning only reads
+    assert local_aws.route53.record_sets(zone_id) == before
+    assert legacy in local_aws.ses().rule_sets
+
+    local_aws.calls.clear()
+    result = teardown.apply(plan)
+
+    assert result.failures == {}
+    assert local_aws.calls["ChangeResourceRecordSets"] == 1
+    ses = local_aws.ses()
+    assert sorted(ses.identities) == sorted(domains)
+    assert "MailFromDomain" not in ses.identities["foo.example.com"]
+    assert ses.identities["baz.example.com"]["MailFromDomain"] == (
+        "bounce.baz.example.com"
+    )
+    assert legacy in ses.rule_sets
+    (rule,) = ses.rule_sets[CERBY_RULE_SET_NAME]
+    assert rule["Recipients"] == ["baz.example.com"]
+    names = {
+        record_set["Name"] for record_set in local_aws.route53.record_sets(zone_id)
+    }
+    assert not any(name.endswith("bar.example.com.") for name in names)
+    assert [
+        record_set
+        for record_set in local_aws.route53.record_sets(zone_id)
+        if record_set["Name"].endswith("foo.example.com.")
+    ] == [
+        customer_record,
+        {**shared_record, "ResourceRecords": [shared_record["ResourceRecords"][0]]},
+    ]
+    assert any(name.endswith("baz.example.com.") for name in names)
+
+    assert Teardown().plan(["foo.example.com", "bar.example.com"]).changes == []
+
+    teardown = Teardown(delete_identities=True)
+    plan = teardown.plan(["baz.example.com"])
+    assert {(action.kind, action.target) for action in plan.actions} >= {
+        (RULE_SET, legacy),
+        (IDENTITY, "baz.example.com"),
+    }
+    assert teardown.apply(plan).failures == {}
+    assert legacy not in local_aws.ses().rule_sets
+    assert "baz.example.com" not in local_aws.ses().identities
@@ -0,0 +1,79 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils import run_graph
+
+
+def test_run_graph_follows_dependencies():
+    order = []
+    steps = {
+        "read": ([], lambda: order.append("read")),
+        "write": (["read", "identity"], lambda: order.append("write")),
+        "identity": ([], lambda: order.append("identity")),
+    }
+
+    run_graph(steps)
+
+    assert order == ["read", "identity", "write"]
+
+
+def test_run_graph_runs_independent_steps_at_once():
+    # both steps only return once the other one started
+    barrier = threading.Barrier(2, timeout=5)
+    steps = {"a": ([], barrier.wait), "b": ([], barrier.wait), "c": (["a", "b"], list)}
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        run_graph(steps, executor)
+
+
+def test_run_graph_cancels_the_steps_after_a_failure():
+    ran = []
+
+    def fail():
+        raise RuntimeError("identity failed")
+
+    steps = {
+        "identity": ([], fail),
+        "mail_from": (["identity"], lambda: ran.append("mail_from")),
+        "records": ([], lambda: ran.append("records")),
+    }
+
+    with pytest.raises(RuntimeError, match="identity failed"):
+        run_graph(steps)
+    assert ran == []
+
+
+def test_run_graph_lets_running_steps_finish():
+    failing = threading.Event()
+    ran = []
+
+    def fail():
+        failing.set()
+        raise RuntimeError("identity failed")
+
+    def records():
+        # still running when the identity fails
+        failing.wait(timeout=5)
+        time.sleep(0.1)
+        ran.append("records")
+
+    steps = {
+        "identity": ([], fail),
+        "records": ([], records),
+        "rules": (["records"], lambda: ran.append("rules")),
+    }
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        with pytest.raises(RuntimeError, match="identity failed"):
+            run_graph(steps, executor)
+    assert ran == ["records"]
+
+
+def test_run_graph_rejects_cycles():
+    with pytest.raises(ValueError):
+        run_graph({"a": (["b"], list), "b": (["a"], list)})
+    with pytest.raises(ValueError):
+        run_graph({"a": (["missing"], list)})
@@ -0,0 +1,66 @@
+from watch import IdentityWatcher
+
+
+class FakeClock:
+    def __init__(self, on_sleep):
+        self.now = 0.0
+        self.sleeps = []
+        self.on_sleep = on_sleep
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+        self.on_sleep(len(self.sleeps))
+
+
+def test_watch_until_converged(local_aws):
+    ses = local_aws.ses()
+    domains = [f"domain-{index}.com" for index in range(150)]
+    for domain in domains:
+        ses.add_identity(domain, mail_from_domain=f"bounce.{domain}")
+
+    def verify(round):
+        # half the identities verify after the first round, the rest later
+        if round in [1, 4]:
+            for domain in domains[:75] if round == 1 else domains[75:]:
+                ses.set_status(domain, "Success", "Success", "Success")
+
+    clock = FakeClock(verify)
+    events = []
+    watcher = IdentityWatcher(clock=clock, sleep=clock.sleep)
+    result = watcher.watch(domains, timeout=600, on_event=events.append)
+
+    assert result.converged
+    # back to the minimum after a change, doubling while nothing changes
+    assert clock.sleeps == [5.0, 5.0, 10.0, 20.0]
+    # 150 identities need two requests per attribute until half converged,
+    # the remaining 75 one request per round
+    assert local_aws.calls["GetIdentityVerificationAttributes"] == 2 + 2 + 1 + 1 + 1
+    status_events = [event for event in events if event["event"] == "status"]
+    assert len(status_events) == 150 * 3 * 2
+    assert events[-1]["event"] == "done"
+    assert len(events[-1]["converged"]) == 150
+
+
+def test_watch_reports_failed_and_timed_out(local_aws):
+    ses = local_aws.ses()
+    ses.add_identity("failed.com", mail_from_domain="bounce.failed.com")
+    ses.add_identity("pending.com", mail_from_domain="bounce.pending.com")
+    ses.set_status("failed.com", dkim="Failed")
+    clock = FakeClock(lambda round: None)
+    events = []
+
+    watcher = IdentityWatcher(clock=clock, sleep=clock.sleep)
+    result = watcher.watch(
+        ["failed.com", "pending.com", "missing.com"],
+        timeout=30,
+        on_event=events.append,
+    )
+
+    assert not result.converged
+    assert clock.now == 30
+    assert events[-1]["failed"] == ["failed.com", "missing.com"]
+    assert events[-1]["timed_out"] == ["pending.com"]
@@ -1,7 +1,23 @@
+import contextvars
 import random
 import re
 import string
+from concurrent.futures import FIRST_COMPLETED, Executor, ThreadPoolExecutor, wait
 from datetime import datetime
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+T = TypeVar("T")
+R = TypeVar("R")
 
 
 def prints(message: str):
@@ -68,22 +84,62 @@ def aws_error(error: str):
     Please, make sure that you have the following permissions:
         AWS SES
             ses:GetIdentityDkimAttributes
+            ses:GetIdentityMailFromDomainAttributes
+            ses:GetIdentityVerificationAttributes
             ses:SetIdentityMailFromDomain
             ses:VerifyDomainDkim
             ses:CreateReceiptRule
             ses:CreateReceiptRuleSet
             ses:DescribeReceiptRule
             ses:DescribeReceiptRuleSet
+            ses:DescribeActiveReceiptRuleSet
             ses:SetActiveReceiptRuleSet
+            ses:UpdateReceiptRule
+            ses:DeleteIdentity (--teardown only)
+            ses:DeleteReceiptRule (--teardown only)
+            ses:DeleteReceiptRuleSet (--teardown only)
+            ses:ListReceiptRuleSets (--teardown only)
 
         AWS Route53
             route53:ChangeResourceRecordSets
-            route53:ListHostedZonesByName
+            route53:GetChange
+            route53:ListHostedZones
+            route53:ListResourceRecordSets
+
+        AWS STS (with --cache or --accounts)
+            sts:GetCallerIdentity
+            sts:AssumeRole (--accounts only)
         """
     )
     print(f"Error Summary:\n\t{error}")
 
 
+def normalize_fqdn(name: str) -> str:
+    """Normalize a DNS name so names from Route53 and from users compare equal
+
+    Args:
+        name (str): A DNS name, with or without the trailing dot
+
+    Returns:
+        str: The case-folded name with a single trailing dot
+    """
+    return name.strip().rstrip(".").replace("\\052", "*").casefold() + "."
+
+
+def is_subdomain(name: str, domain: str) -> bool:
+    """Check whether a DNS name is the domain itself or below it
+
+    Args:
+        name (str): The DNS name to check
+        domain (str): The parent domain
+
+    Returns:
+        bool: True when name is inside the domain's subtree
+    """
+    name, domain = normalize_fqdn(name), normalize_fqdn(domain)
+    return name == domain or name.endswith("." + domain)
+
+
 def extract_main_domain(url: str) -> str:
     pattern = r"(?:[\w-]+\.)*([\w-]+)\.\w+$"
     match = re.search(pattern, url)
@@ -93,3 +149,165 @@ def extract_main_domain(url: str) -> str:
 def generate_random_string(length: int = 4) -> str:
     characters = string.ascii_letters + string.digits
     return "".join(random.choices(characters, k=length))
+
+
+def chunked(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    """Split items in lists of at most size items
+
+    Args:
+        items (Iterable): The items, may be a lazy stream
+        size (int): Maximum items per list
+
+    Yields:
+        List: The next chunk of items
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def imap_bounded(
+    function: Callable[[T], R], items: Iterable[T], workers: int
+) -> Iterator[R]:
+    """Run a function over items on a thread pool, in completion order
+
+    Items are pulled from the iterable only as workers free up, so a long
+    stream is never read into memory up front. Calls run in a copy of the
+    caller's context, so they use the credentials of aws.use_credentials.
+
+    Args:
+        function (Callable): Function to call with each item
+        items (Iterable): The items, may be a lazy stream
+        workers (int): Maximum number of calls running at once
+
+    Yields:
+        The result of each call, as soon as it completes
+    """
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = set()
+        exhausted = False
+        while True:
+            while not exhausted and len(in_flight) < workers:
+                item = next(items, None)
+                if item is None:
+                    exhausted = True
+                else:
+                    context = contextvars.copy_context()
+                    in_flight.add(executor.submit(context.run, function, item))
+            if not in_flight:
+                return
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+# A step of a graph: the names of the steps it needs, and the function to run
+Step = Tuple[List[str], Callable[[], object]]
+
+
+class StepGraph:
+    """Scheduling state of steps that depend on each other
+
+    ready hands out the steps whose dependencies are done, finish records the
+    outcome of each. The first failure cancels every step not started yet,
+    the running ones are left to finish.
+    """
+
+    def __init__(self, steps: Dict[str, Step]) -> None:
+        for name, (dependencies, _) in steps.items():
+            unknown = [
+                dependency for dependency in dependencies if dependency not in steps
+            ]
+            if unknown:
+                raise ValueError(f"Step {name} depends on unknown steps {unknown}")
+        self.steps = steps
+        self.pending: List[str] = list(steps)
+        self.done: Set[str] = set()
+        self.failed: Set[str] = set()
+        self.errors: List[Exception] = []
+        self.running = 0
+
+    @property
+    def finished(self) -> bool:
+        return not self.pending and not self.running
+
+    def ready(
+        self, limit: Optional[int] = None
+    ) -> List[Tuple[str, Callable[[], object]]]:
+        """Take the steps that can start, in the order they were given
+
+        Args:
+            limit (int, optional): Most steps to take, all of them when not
+                given
+
+        Returns:
+            List[Tuple[str, Callable]]: Name and function of each step
+        """
+        runnable = [
+            name
+            for name in self.pending
+            if all(dependency in self.done for dependency in self.steps[name][0])
+        ][:limit]
+        if self.pending and not runnable and not self.running:
+            raise ValueError(f"Steps {self.pending} depend on each other")
+        for name in runnable:
+            self.pending.remove(name)
+        self.running += len(runnable)
+        return [(name, self.steps[name][1]) for name in runnable]
+
+    def finish(self, name: str, error: Optional[BaseException] = None):
+        self.running -= 1
+        if error is None:
+            self.done.add(name)
+        else:
+            self.failed.add(name)
+            self.errors.append(error)
+            self.cancel()
+
+    def cancel(self):
+        """Drop the steps not started yet"""
+        self.failed.update(self.pending)
+        self.pending = []
+
+    def raise_error(self):
+        if self.errors:
+            raise self.errors[0]
+
+
+def run_graph(steps: Dict[str, Step], executor: Optional[Executor] = None):
+    """Run steps once their dependencies are done, independent ones at once
+
+    Args:
+        steps (Dict[str, Step]): Dependencies and function by step name
+        executor (Executor, optional): Pool running independent steps at
+            once, steps run one by one in the calling thread when not given
+
+    Raises:
+        Exception: The first error of a step, once the steps running when it
+            failed are done
+    """
+    graph = StepGraph(steps)
+    running = {}
+    while not graph.finished:
+        for name, function in graph.ready(None if executor else 1):
+            if executor is None:
+                try:
+                    function()
+                except Exception as error:
+                    graph.finish(name, error)
+                else:
+                    graph.finish(name)
+            else:
+                context = contextvars.copy_context()
+                running[executor.submit(context.run, function)] = name
+        if running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                graph.finish(running.pop(future), future.exception())
+    graph.raise_error()
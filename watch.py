@@ -0,0 +1,167 @@
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional
+
+from repository import AWSIdentityRepository
+
+SUCCESS = "Success"
+MISSING = "Missing"
+
+# Statuses an identity attribute never leaves without someone fixing the DNS
+FAILED_STATUSES = ["Failed", MISSING]
+
+ATTRIBUTES = ["verification", "dkim", "mail_from"]
+
+# Seconds between polling rounds. The interval goes back to the minimum
+# whenever a round sees a change and doubles otherwise, up to the maximum.
+MIN_POLL_DELAY = 5.0
+MAX_POLL_DELAY = 120.0
+
+DEFAULT_WATCH_TIMEOUT = 3600.0
+
+
+@dataclass
+class WatchResult:
+    statuses: Dict[str, Dict[str, str]] = field(default_factory=dict)
+
+    def domains(self, state: str) -> List[str]:
+        return [
+            domain
+            for domain, statuses in self.statuses.items()
+            if identity_state(statuses) == state
+        ]
+
+    @property
+    def converged(self) -> bool:
+        return all(
+            identity_state(statuses) == "converged"
+            for statuses in self.statuses.values()
+        )
+
+
+def identity_state(statuses: Dict[str, str]) -> str:
+    """Summarize the attribute statuses of an identity
+
+    Returns:
+        str: converged when every attribute succeeded, failed when any needs
+            fixing, pending otherwise
+    """
+    if any(status in FAILED_STATUSES for status in statuses.values()):
+        return "failed"
+    if all(statuses.get(attribute) == SUCCESS for attribute in ATTRIBUTES):
+        return "converged"
+    return "pending"
+
+
+class IdentityWatcher:
+    """Polls the verification, DKIM and MAIL FROM status of many identities
+
+    Each round reads all three attributes of every pending identity in bulk,
+    100 identities per request, and emits an event for every status that
+    changed. Identities leave the round as soon as they converge or fail.
+    """
+
+    def __init__(
+        self,
+        identity_repo: Optional[AWSIdentityRepository] = None,
+        min_delay: float = MIN_POLL_DELAY,
+        max_delay: float = MAX_POLL_DELAY,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.identity_repo = identity_repo or AWSIdentityRepository()
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.clock = clock
+        self.sleep = sleep
+
+    def read(self, domains: List[str]) -> Dict[str, Dict[str, str]]:
+        """Read the current status of each attribute of the identities
+
+        Args:
+            domains (List[str]): The identities to read
+
+        Returns:
+            Dict[str, Dict[str, str]]: Status by attribute by identity
+        """
+        verification = self.identity_repo.get_verification_status_bulk(domains)
+        dkim = self.identity_repo.get_dkim_attributes_bulk(domains)
+        mail_from = self.identity_repo.get_mail_from_domain_attributes_bulk(domains)
+        return {
+            domain: {
+                "verification": verification.get(domain, MISSING),
+                "dkim": dkim[domain].verification_status if domain in dkim else MISSING,
+                "mail_from": (
+                    mail_from[domain].mail_from_domain_status or MISSING
+                    if domain in mail_from
+                    else MISSING
+                ),
+            }
+            for domain in domains
+        }
+
+    def watch(
+        self,
+        domains: Iterable[str],
+        timeout: Optional[float] = DEFAULT_WATCH_TIMEOUT,
+        on_event: Optional[Callable[[dict], None]] = None,
+    ) -> WatchResult:
+        """Poll until every identity converged or failed, or the timeout expires
+
+        Args:
+            domains (Iterable[str]): The identities to watch
+            timeout (float, optional): Seconds to watch at most, None to watch
+                for as long as it takes
+            on_event (Callable, optional): Called with a status event for each
+                attribute that changed, and a final summary event
+
+        Returns:
+            WatchResult: The last status of every identity
+        """
+        emit = on_event or (lambda event: None)
+        result = WatchResult()
+        pending = list(dict.fromkeys(domains))
+        deadline = None if timeout is None else self.clock() + timeout
+        delay = self.min_delay
+        while pending:
+            changed = False
+            for domain, statuses in self.read(pending).items():
+                previous = result.statuses.get(domain, {})
+                for attribute, status in statuses.items():
+                    if previous.get(attribute) != status:
+                        changed = True
+                        emit(
+                            {
+                                "event": "status",
+                                "time": datetime.now(timezone.utc).isoformat(),
+                                "domain": domain,
+                                "attribute": attribute,
+                                "status": status,
+                                "previous": previous.get(attribute),
+                            }
+                        )
+                result.statuses[domain] = statuses
+            pending = [
+                domain
+                for domain in pending
+                if identity_state(result.statuses[domain]) == "pending"
+            ]
+            if not pending:
+                break
+            if deadline is not None:
+                remaining = deadline - self.clock()
+                if remaining <= 0:
+                    break
+            delay = self.min_delay if changed else min(delay * 2, self.max_delay)
+            self.sleep(delay if deadline is None else min(delay, remaining))
+        emit(
+            {
+                "event": "done",
+                "time": datetime.now(timezone.utc).isoformat(),
+                "converged": result.domains("converged"),
+                "failed": result.domains("failed"),
+                "timed_out": result.domains("pending"),
+            }
+        )
+        return result